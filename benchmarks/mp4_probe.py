@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the in-process MP4 box parser against ffprobe
+Describes the same files with mp4_boxes.parse() and with an ffprobe
+process, prints the time per call of each and any field they disagree on.
+
+Usage: python benchmarks/mp4_probe.py FILE [FILE ...] [-n iterations]
+"""
+
+import os
+import sys
+import time
+import shutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mp4_boxes
+from media_info import MediaInfo
+from process_runner import probe_sync
+
+
+def timed(func, path: str, iterations: int) -> tuple:
+    result = func(path)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func(path)
+    return result, (time.perf_counter() - started) / iterations
+
+
+def compare(parsed: dict, probed: MediaInfo) -> list:
+    """Fields on which the parser and ffprobe disagree"""
+    differences = []
+    for name in ('vcodec', 'acodec', 'width', 'height'):
+        if parsed[name] != getattr(probed, name):
+            differences.append(f"{name}: {parsed[name]!r} vs {getattr(probed, name)!r}")
+    if abs(parsed['duration'] - probed.duration) > 0.1:
+        differences.append(f"duration: {parsed['duration']:.3f} vs {probed.duration:.3f}")
+    return differences
+
+
+def main():
+    args = sys.argv[1:]
+    iterations = 20
+    if '-n' in args:
+        index = args.index('-n')
+        iterations = int(args[index + 1])
+        del args[index:index + 2]
+    if not args:
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(2)
+    has_ffprobe = shutil.which('ffprobe') is not None
+    if not has_ffprobe:
+        print("ffprobe not found; timing the parser only")
+
+    for path in args:
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        parsed, parse_time = timed(mp4_boxes.parse, path, iterations)
+        line = f"{os.path.basename(path)} ({size_mb:.1f}MB): mp4_boxes {parse_time * 1000:8.3f} ms"
+        if has_ffprobe:
+            data, probe_time = timed(probe_sync, path, iterations)
+            line += f"   ffprobe {probe_time * 1000:8.3f} ms   x{probe_time / parse_time:.0f}"
+        print(line)
+        if parsed is None:
+            print("  not handled by the parser (ffprobe fallback)")
+        elif has_ffprobe and data:
+            for difference in compare(parsed, MediaInfo.from_ffprobe(None, data)):
+                print(f"  differs: {difference}")
+
+
+if __name__ == '__main__':
+    main()
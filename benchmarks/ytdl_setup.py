@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the per-job yt-dlp setup cost
+Compares a fresh YoutubeDL per job with a pooled checkout, and download
+worker start-up with and without the fork server preload.
+
+Usage: python benchmarks/ytdl_setup.py [iterations]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def bench_instances(iterations: int):
+    import yt_dlp
+    from downloader import VideoDownloader
+    from ytdl_pool import YoutubeDLPool
+
+    opts = dict(VideoDownloader().ydl_opts, quiet=True)
+    overrides = {'outtmpl': os.path.join(ROOT, 'downloads', 'tmpbench', '%(title)s.%(ext)s')}
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with yt_dlp.YoutubeDL(dict(opts, **overrides)) as ydl:
+            ydl.get_info_extractor('Youtube')
+    fresh = (time.perf_counter() - started) / iterations
+
+    pool = YoutubeDLPool(opts, 1, 'bench')
+    pool.warm()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with pool.checkout(**overrides) as ydl:
+            ydl.get_info_extractor('Youtube')
+    pooled = (time.perf_counter() - started) / iterations
+    pool.close()
+
+    print(f"YoutubeDL per job:  fresh {fresh * 1000:8.2f} ms   pooled {pooled * 1000:8.2f} ms")
+
+
+def bench_workers(iterations: int, preload: bool):
+    import download_workers
+    if not preload:
+        download_workers.PRELOAD_MODULES = []
+    from download_workers import DownloadProcessPool
+
+    async def run():
+        pool = DownloadProcessPool(1)
+        pool.warm_up()
+        # Let the fork server finish its preload before timing
+        await pool.run('warmup', '_is_subpath', ROOT, ROOT)
+        started = time.perf_counter()
+        for i in range(iterations):
+            await pool.run(f"bench-{i}", '_is_subpath', ROOT, ROOT)
+        return (time.perf_counter() - started) / iterations
+
+    elapsed = asyncio.run(run())
+    label = 'preloaded' if preload else 'cold'
+    print(f"Worker start-up:    {label:9s} {elapsed * 1000:8.2f} ms")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    if len(sys.argv) > 2:
+        # Child run: each fork server configuration needs its own process
+        bench_workers(iterations, sys.argv[2] == 'preload')
+        return
+
+    bench_instances(iterations)
+    for mode in ('nopreload', 'preload'):
+        subprocess.run([sys.executable, os.path.abspath(__file__), str(iterations), mode], check=True)
+
+
+if __name__ == '__main__':
+    main()
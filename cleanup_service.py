@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Background cleanup of downloaded files and temp directories
+Deletions are queued and run in a worker thread instead of on the event
+loop. A janitor sweeps DOWNLOAD_DIR at startup and on a timer for temp
+directories left behind by crashed or failed jobs.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Callable, Optional
+from config import DOWNLOAD_DIR, JANITOR_INTERVAL, TEMP_DIR_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the job directories tempfile.mkdtemp() creates under DOWNLOAD_DIR
+TEMP_DIR_PREFIX = 'tmp'
+
+
+def _tree_usage(path: str) -> tuple:
+    """(bytes on disk, newest mtime) of a file or directory tree"""
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return st.st_blocks * 512, st.st_mtime
+    total, newest = 0, os.stat(path).st_mtime
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            total += st.st_blocks * 512
+            newest = max(newest, st.st_mtime)
+    return total, newest
+
+
+class CleanupService:
+    """Queue of deletions run off the event loop, plus the temp dir janitor.
+
+    downloader provides the path-safe deletion helpers (cleanup_file,
+    cleanup_files, cleanup_dir). journal and in_use() name temp dirs the
+    janitor must keep: journaled jobs waiting to resume and running tasks.
+    """
+
+    def __init__(self, downloader, journal=None, in_use: Optional[Callable] = None,
+                 download_dir: str = DOWNLOAD_DIR, interval: float = JANITOR_INTERVAL,
+                 max_age: float = TEMP_DIR_MAX_AGE):
+        self.downloader = downloader
+        self.journal = journal
+        self.in_use = in_use
+        self.download_dir = download_dir
+        self.interval = interval
+        self.max_age = max_age
+        self._queue = None
+        self._worker = None
+        self._janitor = None
+        # Metrics
+        self.reclaimed_bytes = 0
+        self.deleted = 0
+        self.swept_dirs = 0
+        self.last_sweep = None
+
+    def start(self):
+        """Start the deletion worker and the periodic janitor"""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._work())
+            self._janitor = asyncio.create_task(self._janitor_loop())
+
+    async def stop(self):
+        """Finish queued deletions and stop the background tasks"""
+        if self._worker is None:
+            return
+        self._janitor.cancel()
+        await self._queue.join()
+        self._worker.cancel()
+        await asyncio.gather(self._worker, self._janitor, return_exceptions=True)
+        self._worker = self._janitor = None
+
+    def remove_file(self, file_path: Optional[str]):
+        """Delete a downloaded file and its job temp directory in the background"""
+        if file_path:
+            self._submit(self.downloader.cleanup_file, file_path, file_path)
+
+    def remove_files(self, file_paths: list):
+        """Delete downloaded files and their job temp directory in the background"""
+        if file_paths:
+            self._submit(self.downloader.cleanup_files, list(file_paths), os.path.dirname(file_paths[0]))
+
+    def remove_dir(self, temp_dir: Optional[str]):
+        """Delete a job temp directory in the background"""
+        if temp_dir:
+            self._submit(self.downloader.cleanup_dir, temp_dir, temp_dir)
+
+    async def sweep(self) -> int:
+        """Remove orphaned temp dirs older than max_age; returns reclaimed bytes"""
+        keep = set()
+        if self.journal is not None:
+            keep |= {os.path.realpath(path) for path in self.journal.temp_dirs()}
+        if self.in_use is not None:
+            keep |= {os.path.realpath(path) for path in self.in_use() if path}
+        loop = asyncio.get_running_loop()
+        reclaimed, removed = await loop.run_in_executor(None, self._sweep_sync, keep)
+        self.last_sweep = time.time()
+        self.swept_dirs += removed
+        self.reclaimed_bytes += reclaimed
+        if removed:
+            logger.info(f"Janitor removed {removed} orphaned temp dirs, reclaimed {reclaimed} bytes")
+        return reclaimed
+
+    def stats(self) -> dict:
+        return {
+            'pending': self._queue.qsize() if self._queue else 0,
+            'deleted': self.deleted,
+            'swept_dirs': self.swept_dirs,
+            'reclaimed_bytes': self.reclaimed_bytes,
+            'last_sweep': self.last_sweep,
+        }
+
+    def _submit(self, func: Callable, arg, measure_path: str):
+        if self._queue is None:
+            # Not started (e.g. during shutdown); delete inline as before
+            func(arg)
+            return
+        self._queue.put_nowait((func, arg, measure_path))
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            func, arg, measure_path = await self._queue.get()
+            try:
+                reclaimed = await loop.run_in_executor(None, self._delete_sync, func, arg, measure_path)
+                self.reclaimed_bytes += reclaimed
+                self.deleted += 1
+            except Exception as e:
+                logger.warning(f"Background cleanup of {measure_path} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _delete_sync(self, func: Callable, arg, measure_path: str) -> int:
+        """Run a deletion and return how many bytes it freed"""
+        target = self._job_dir(measure_path) or measure_path
+        try:
+            before = _tree_usage(target)[0] if os.path.exists(target) else 0
+        except OSError:
+            before = 0
+        func(arg)
+        try:
+            after = _tree_usage(target)[0] if os.path.exists(target) else 0
+        except OSError:
+            after = 0
+        return max(0, before - after)
+
+    def _job_dir(self, path: str) -> Optional[str]:
+        """Top-level directory under download_dir that contains path"""
+        base = os.path.realpath(self.download_dir)
+        real = os.path.realpath(path)
+        if real == base or os.path.commonpath([real, base]) != base:
+            return None
+        return os.path.join(base, os.path.relpath(real, base).split(os.sep)[0])
+
+    def _sweep_sync(self, keep: set) -> tuple:
+        reclaimed = removed = 0
+        now = time.time()
+        try:
+            entries = list(os.scandir(self.download_dir))
+        except OSError as e:
+            logger.warning(f"Janitor cannot list {self.download_dir}: {e}")
+            return 0, 0
+        for entry in entries:
+            # Only job temp dirs; databases and other files are never touched
+            if not entry.name.startswith(TEMP_DIR_PREFIX) or not entry.is_dir(follow_symlinks=False):
+                continue
+            path = os.path.realpath(entry.path)
+            if path in keep:
+                continue
+            try:
+                size, newest = _tree_usage(path)
+            except OSError:
+                continue
+            if now - newest < self.max_age:
+                continue
+            self.downloader.cleanup_dir(path)
+            if not os.path.exists(path):
+                reclaimed += size
+                removed += 1
+        return reclaimed, removed
+
+    async def _janitor_loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"Janitor sweep failed: {e}")
+            await asyncio.sleep(self.interval)
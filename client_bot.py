@@ -6,12 +6,30 @@ Supports files up to 2GB and better upload reliability with cancellation support
 
 import logging
 import os
+import time
 import asyncio
+import tempfile
+import contextlib
+from collections import OrderedDict
 from telethon import TelegramClient, events
+from telethon.errors import FileReferenceExpiredError
 from telethon.tl.types import DocumentAttributeVideo
 from downloader import VideoDownloader
-from audio_enhancer import AudioEnhancer
-from config import API_ID, API_HASH, PHONE_NUMBER, TARGET_CHAT_ID, ADMIN_USER_ID
+from download_workers import DownloadProcessPool
+from media_farm import MediaWorkerFarm
+from media_info import media_info_cache
+from progress import ProgressReporter
+from task_registry import TaskRecord, TaskRegistry
+from uploader import ParallelUploader
+from media_cache import MediaCache
+from job_journal import JobJournal
+from cleanup_service import CleanupService
+from disk_space import PHOTO_SET_ESTIMATE, DiskSpaceController, DiskSpaceError, estimate_job_bytes
+from postprocessing import PostProcessStats
+from url_canonicalizer import UrlCanonicalizer
+from config import (API_ID, API_HASH, PHONE_NUMBER, TARGET_CHAT_ID, ADMIN_USER_ID,
+                    MAX_CONCURRENT_JOBS, MAX_JOBS_PER_USER, MAX_QUEUED_JOBS, FORWARD_TARGETS,
+                    STREAM_UPLOAD, DOWNLOAD_DIR)
 from utils import (extract_urls_from_text, format_file_size, format_duration, 
                    get_video_platform, is_valid_video_url, is_spam_url,
                    is_user_allowed, add_allowed_user, remove_allowed_user, get_all_allowed_users, load_allowed_users)
@@ -23,6 +41,167 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class QueueFullError(Exception):
+    """Raised when the job admission queue has no room left"""
+
+
+class _QueuedJob:
+    """A job waiting in the scheduler admission queue"""
+    __slots__ = ('job_id', 'user_id', 'future', 'on_queued', 'position', 'enqueued_at')
+
+    def __init__(self, job_id: str, user_id: int, future: asyncio.Future, on_queued=None):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.future = future
+        self.on_queued = on_queued
+        self.position = 0
+        self.enqueued_at = time.monotonic()
+
+
+class JobScheduler:
+    """Admit download/upload pipelines under a global and a per-user concurrency cap.
+
+    Jobs that cannot start right away wait in a bounded FIFO queue. A job whose
+    user is already at the per-user cap does not block jobs from other users
+    queued behind it. When the queue is full, new jobs are rejected with
+    QueueFullError instead of piling up.
+    """
+
+    def __init__(self, max_concurrent: int, max_per_user: int, max_queued: int):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_per_user = max(1, max_per_user)
+        self.max_queued = max(0, max_queued)
+        self._running = {}  # job_id -> user_id
+        self._running_by_user = {}
+        self._queue = OrderedDict()  # job_id -> _QueuedJob, in arrival order
+        self._notify_tasks = set()
+        # Metrics
+        self.admitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.peak_queue_depth = 0
+        self._total_wait = 0.0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, job_id: str, user_id: int, on_queued=None):
+        """Hold a running slot for the duration of the block.
+
+        on_queued is an optional coroutine function called with the 1-based
+        queue position whenever the job has to wait or moves up in the queue.
+        """
+        await self.acquire(job_id, user_id, on_queued)
+        try:
+            yield
+        finally:
+            self.release(job_id)
+
+    async def acquire(self, job_id: str, user_id: int, on_queued=None):
+        """Wait until the job may run"""
+        if not self._queue and self._can_run(user_id):
+            self._start(job_id, user_id, 0.0)
+            return
+
+        if len(self._queue) >= self.max_queued:
+            self.rejected += 1
+            logger.warning(f"Job queue full ({len(self._queue)}), rejecting job {job_id} for user {user_id}")
+            raise QueueFullError(f"Job queue is full ({self.max_queued} waiting)")
+
+        job = _QueuedJob(job_id, user_id, asyncio.get_running_loop().create_future(), on_queued)
+        self._queue[job_id] = job
+        self.peak_queue_depth = max(self.peak_queue_depth, len(self._queue))
+        logger.info(f"Job {job_id} queued for user {user_id}, queue depth {len(self._queue)}, running {len(self._running)}")
+
+        # A user at the per-user cap may be queued while free global slots let others through
+        self._dispatch()
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job.future.done() and not job.future.cancelled():
+                # Slot was granted in the same tick the caller got cancelled
+                self.release(job_id)
+            elif self._queue.pop(job_id, None) is not None:
+                self._notify_positions()
+            raise
+
+    def release(self, job_id: str):
+        """Free the slot held by a running job and admit waiting jobs"""
+        user_id = self._running.pop(job_id, None)
+        if user_id is None:
+            return
+        remaining = self._running_by_user.get(user_id, 1) - 1
+        if remaining > 0:
+            self._running_by_user[user_id] = remaining
+        else:
+            self._running_by_user.pop(user_id, None)
+        self.completed += 1
+        self._dispatch()
+
+    def queue_position(self, job_id: str) -> int:
+        """1-based position of a waiting job, or 0 if it is not queued"""
+        for position, queued_id in enumerate(self._queue, start=1):
+            if queued_id == job_id:
+                return position
+        return 0
+
+    def stats(self) -> dict:
+        """Snapshot of queue depth and throughput counters"""
+        return {
+            'running': len(self._running),
+            'queued': len(self._queue),
+            'max_concurrent': self.max_concurrent,
+            'max_per_user': self.max_per_user,
+            'max_queued': self.max_queued,
+            'peak_queue_depth': self.peak_queue_depth,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'completed': self.completed,
+            'avg_wait': self._total_wait / self.admitted if self.admitted else 0.0,
+            'running_by_user': dict(self._running_by_user),
+        }
+
+    def _can_run(self, user_id: int) -> bool:
+        return (len(self._running) < self.max_concurrent
+                and self._running_by_user.get(user_id, 0) < self.max_per_user)
+
+    def _start(self, job_id: str, user_id: int, waited: float):
+        self._running[job_id] = user_id
+        self._running_by_user[user_id] = self._running_by_user.get(user_id, 0) + 1
+        self.admitted += 1
+        self._total_wait += waited
+
+    def _dispatch(self):
+        """Start queued jobs in arrival order while slots are free"""
+        for job_id, job in list(self._queue.items()):
+            if len(self._running) >= self.max_concurrent:
+                break
+            if job.future.done() or not self._can_run(job.user_id):
+                continue
+            del self._queue[job_id]
+            self._start(job_id, job.user_id, time.monotonic() - job.enqueued_at)
+            job.future.set_result(True)
+            logger.info(f"Job {job_id} admitted after {time.monotonic() - job.enqueued_at:.1f}s, queue depth {len(self._queue)}")
+        if self._queue:
+            self._notify_positions()
+
+    def _notify_positions(self):
+        """Tell waiting jobs about their new queue position"""
+        for position, job in enumerate(self._queue.values(), start=1):
+            if job.position == position:
+                continue
+            job.position = position
+            if job.on_queued:
+                task = asyncio.create_task(self._safe_notify(job.on_queued, position))
+                self._notify_tasks.add(task)
+                task.add_done_callback(self._notify_tasks.discard)
+
+    @staticmethod
+    async def _safe_notify(callback, position: int):
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.debug(f"Queue position update failed: {e}")
+
+
 class TelegramVideoClient:
     def __init__(self):
         # Use session_data folder for session files
@@ -31,15 +210,34 @@ class TelegramVideoClient:
         os.makedirs(session_dir, exist_ok=True)
         session_path = os.path.join(session_dir, 'video_bot_session')
         self.client = TelegramClient(session_path, API_ID, API_HASH)
-        self.downloader = VideoDownloader()
-        self.active_tasks = {}  # Store active download/upload tasks
+        self.canonicalizer = UrlCanonicalizer()
+        self.downloader = VideoDownloader(self.canonicalizer)
+        self.journal = JobJournal()  # Downloads to resume after a crash or restart
+        self.active_tasks = TaskRegistry(on_remove=self.forget_journaled_job)  # Store active download/upload tasks
+        self.shutting_down = False  # Jobs cancelled from now on stay journaled for the next start
         self.task_counter = 0
+        self.scheduler = JobScheduler(MAX_CONCURRENT_JOBS, MAX_JOBS_PER_USER, MAX_QUEUED_JOBS)
+        self.media_farm = MediaWorkerFarm()  # ffmpeg slots shared by all download workers
+        self.download_pool = DownloadProcessPool(MAX_CONCURRENT_JOBS, farm=self.media_farm)
+        self.disk_space = DiskSpaceController()
+        self.cleanup = CleanupService(self.downloader, self.journal,
+                                      in_use=lambda: [task.temp_dir for task in self.active_tasks])
+        self.uploader = ParallelUploader(self.client)
+        self.media_cache = MediaCache()
+        self.postprocess_stats = PostProcessStats()
         
     async def start(self):
         """Start the client"""
         await self.client.start(phone=PHONE_NUMBER)
         logger.info("Client started successfully!")
         
+        # Pre-warm yt-dlp so the first job does not pay for its setup
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            loop.run_in_executor(None, self.downloader.warm_up),
+            loop.run_in_executor(None, self.download_pool.warm_up)
+        )
+        
         # Wrap event handlers with error handling
         def safe_handler(handler_func):
             async def wrapped_handler(event):
@@ -70,6 +268,10 @@ class TelegramVideoClient:
         async def forward_handler(event):
             await safe_handler(self.handle_forward_command)(event)
         
+        @self.client.on(events.NewMessage(pattern='/both'))
+        async def both_handler(event):
+            await safe_handler(self.handle_both_command)(event)
+        
         @self.client.on(events.NewMessage(pattern='/download'))
         async def download_handler(event):
             await safe_handler(self.handle_download_command)(event)
@@ -98,12 +300,22 @@ class TelegramVideoClient:
         async def list_users_handler(event):
             await safe_handler(self.handle_list_users)(event)
         
+        @self.client.on(events.NewMessage(pattern='/queue'))
+        async def queue_handler(event):
+            await safe_handler(self.handle_queue)(event)
+        
         @self.client.on(events.NewMessage(func=lambda e: not e.message.text.startswith('/')))
         async def message_handler(event):
             await safe_handler(self.handle_message)(event)
         
         
         logger.info("Event handlers registered. Bot is ready!")
+        
+        # Continue downloads that were interrupted by the last shutdown
+        await self.resume_jobs()
+        
+        # Background deletions and the orphaned temp dir janitor
+        self.cleanup.start()
     
     async def handle_start(self, event):
         """Handle /start command"""
@@ -171,6 +383,7 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
 • `/add_user <user_id>` - Thêm user
 • `/remove_user <user_id>` - Xóa user
 • `/list_users` - Xem danh sách users
+• `/queue` - Xem hàng đợi tác vụ
             """
         await event.respond(help_text)
     
@@ -315,6 +528,53 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
             logger.error(f"Error in list_users: {e}")
             await event.respond(f"❌ Lỗi: {str(e)}")
     
+    async def handle_queue(self, event):
+        """Handle /queue command: show scheduler metrics"""
+        if not self.is_allowed_chat(event) or not self.is_admin(event.sender_id):
+            if self.is_allowed_chat(event):
+                await event.respond("❌ Chỉ admin mới có thể xem hàng đợi.")
+            return
+        
+        stats = self.scheduler.stats()
+        stages = ', '.join(f"{stage}: {count}" for stage, count in self.active_tasks.stage_counts().items()) or "—"
+        cache = self.media_cache.stats()
+        links = self.canonicalizer.stats()
+        post = self.postprocess_stats.stats()
+        await self.disk_space.refresh()
+        disk = self.disk_space.stats()
+        cleanup = self.cleanup.stats()
+        farm = self.media_farm.stats()
+        farm_waits = ', '.join(f"{kind}: {entry['wait'] / entry['count']:.1f}s"
+                               for kind, entry in farm['kinds'].items() if entry['count']) or "—"
+        actions = ', '.join(f"{action}: {entry['count']} ({entry['cpu']:.0f}s CPU)"
+                            for action, entry in post['actions'].items())
+        saved = f"~{post['cpu_saved']:.0f}s CPU" if post['cpu_saved'] is not None else "—"
+        await event.respond(
+            f"🚦 **Hàng đợi tác vụ:**\n\n"
+            f"▶️ **Đang chạy:** {stats['running']}/{stats['max_concurrent']}\n"
+            f"⏳ **Đang chờ:** {stats['queued']}/{stats['max_queued']}\n"
+            f"📈 **Hàng đợi cao nhất:** {stats['peak_queue_depth']}\n"
+            f"✅ **Đã nhận:** {stats['admitted']} | 🚫 **Từ chối:** {stats['rejected']}\n"
+            f"⏱️ **Chờ trung bình:** {stats['avg_wait']:.1f}s\n"
+            f"👤 **Giới hạn mỗi user:** {stats['max_per_user']}\n"
+            f"📋 **Tác vụ theo giai đoạn:** {stages}\n"
+            f"⚡ **Cache video:** {cache['entries']}/{cache['max_entries']} "
+            f"(trúng {cache['hits']}, trượt {cache['misses']})\n"
+            f"🔗 **Cache link rút gọn:** {links['entries']} "
+            f"(trúng {links['hits']}, trượt {links['misses']})\n"
+            f"🎞️ **Hậu xử lý:** {actions}\n"
+            f"💡 **Tiết kiệm so với transcode:** {saved}\n"
+            f"🎛️ **ffmpeg:** {farm['running']}/{farm['slots']} tiến trình × {farm['threads']} luồng "
+            f"({farm['cpus']:g} CPU), {farm['queued']} đang chờ, "
+            f"sử dụng {farm['utilization']:.0%} (CPU {farm['cpu_utilization']:.0%})\n"
+            f"⌛ **Chờ ffmpeg trung bình:** {farm_waits}\n"
+            f"💽 **Đĩa:** trống {format_file_size(max(0, disk['free']))}, "
+            f"đặt trước {format_file_size(disk['reserved'])} cho {disk['active']} tác vụ "
+            f"(còn ghi {format_file_size(disk['outstanding'])}), {disk['waiting']} đang chờ\n"
+            f"🧹 **Dọn dẹp:** đã thu hồi {format_file_size(cleanup['reclaimed_bytes'])} "
+            f"({cleanup['swept_dirs']} thư mục mồ côi), {cleanup['pending']} đang chờ xóa"
+        )
+    
     async def handle_message(self, event):
         """Handle incoming messages with URLs"""
         if not event.message or not event.message.text:
@@ -334,10 +594,9 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
             return  # No URLs found
         
         # Check if user already has an active task for this URL to prevent duplicates
-        for task_id, task_info in self.active_tasks.items():
-            if task_info.get('user_id') == user_id and task_info.get('url') == urls[0]:
-                logger.info(f"User {user_id} already has active task for URL: {urls[0]}")
-                return
+        if self.active_tasks.find(user_id, urls[0]):
+            logger.info(f"User {user_id} already has active task for URL: {urls[0]}")
+            return
         
         # Process only the first URL to avoid spam
         url = urls[0]
@@ -382,24 +641,29 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
             return
             
         user_id = event.sender_id
-        user_tasks = [(tid, info) for tid, info in list(self.active_tasks.items()) 
-                      if info.get('user_id') == user_id]
+        user_tasks = self.active_tasks.for_user(user_id)
         
         if not user_tasks:
             await event.respond("ℹ️ Không có tác vụ nào đang chạy.")
             return
         
         cancelled_count = 0
-        for task_id, task_info in user_tasks:
+        for task_info in user_tasks:
+            task_id = task_info.task_id
             try:
-                task_info['task'].cancel()
+                # Wake anything waiting on this task, then stop the running stage
+                task_info.cancelled.set()
+                task_info.stage_changed.set()
+                if task_info.task:
+                    task_info.task.cancel()
                 cancelled_count += 1
                 logger.info(f"Cancelled task {task_id} for user {user_id}")
                 
-                await task_info['status_msg'].edit(
-                    f"❌ **Đã hủy**\n🔗 `{task_info['url']}`"
+                await self.stop_progress(task_id)
+                await task_info.status_msg.edit(
+                    f"❌ **Đã hủy**\n🔗 `{task_info.url}`"
                 )
-                del self.active_tasks[task_id]
+                self.active_tasks.pop(task_id, None)
                 
             except Exception as e:
                 logger.warning(f"Error cancelling task {task_id}: {e}")
@@ -418,12 +682,32 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
             return
         
         task_id, task_info = pending_task
+        self.attach_current_task(task_id)
         await self.handle_forward_action_direct(task_id)
         try:
             await event.delete()
         except Exception:
             pass
     
+    async def handle_both_command(self, event):
+        """Handle /both command: forward to the target chats and send a copy to the user"""
+        if not self.is_allowed_chat(event) or not self.is_authorized(event.sender_id):
+            return
+            
+        pending_task = self.find_pending_task(event.sender_id)
+        
+        if not pending_task:
+            await event.respond("ℹ️ Không có video đang chờ. Gửi URL trước.")
+            return
+        
+        task_id, task_info = pending_task
+        self.attach_current_task(task_id)
+        await self.handle_forward_action_direct(task_id, copy_to_user=event.sender_id)
+        try:
+            await event.delete()
+        except Exception:
+            pass
+    
     async def handle_download_command(self, event):
         """Handle /download command"""
         if not self.is_allowed_chat(event) or not self.is_authorized(event.sender_id):
@@ -436,19 +720,115 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
             return
         
         task_id, task_info = pending_task
+        self.attach_current_task(task_id)
         await self.handle_download_action_direct(task_id, event.sender_id)
         try:
             await event.delete()
         except Exception:
             pass
     
+    async def stop_progress(self, task_id: str):
+        """Stop progress edits so they cannot overwrite a final status text"""
+        task_info = self.active_tasks.get(task_id)
+        progress = task_info.progress if task_info else None
+        if progress:
+            task_info.progress = None
+            await progress.close()
+    
+    def set_task_stage(self, task_id: str, stage: str):
+        """Move a task to a new stage and wake whoever waits on the change"""
+        self.active_tasks.set_stage(task_id, stage)
+    
+    async def wait_for_stage_change(self, task_id: str, stage: str):
+        """Wait until the task leaves the given stage, is cancelled or removed"""
+        while True:
+            task_info = self.active_tasks.get(task_id)
+            if not task_info or task_info.stage != stage or task_info.cancelled.is_set():
+                return
+            await task_info.stage_changed.wait()
+    
+    def attach_current_task(self, task_id: str, stage: str = 'queued'):
+        """Make /cancel stop the coroutine now running this task's action"""
+        task_info = self.active_tasks.get(task_id)
+        if task_info:
+            task_info.task = asyncio.current_task()
+            self.set_task_stage(task_id, stage)
+    
     def find_pending_task(self, user_id: int):
         """Find the most recent pending task for a user"""
-        for task_id, task_info in self.active_tasks.items():
-            if task_info.get('stage') == 'info' and task_info.get('user_id') == user_id:
-                return task_id, task_info
+        task_info = self.active_tasks.first_in_stage(user_id, 'info')
+        if task_info:
+            return task_info.task_id, task_info
         return None
     
+    async def show_queue_position(self, status_msg, url: str, position: int):
+        """Show the task's position in the job queue"""
+        try:
+            await status_msg.edit(
+                f"⏳ **Đang chờ trong hàng đợi...**\n"
+                f"🔗 URL: `{url}`\n"
+                f"📊 Bạn đang ở vị trí #{position}\n"
+                f"💡 Gửi `/cancel` để hủy."
+            )
+        except Exception as e:
+            logger.debug(f"Could not update queue position: {e}")
+    
+    async def reject_queue_full(self, status_msg, url: str, task_id: str):
+        """Tell the user the job queue is full and drop the task"""
+        logger.info(f"Task {task_id} rejected, job queue is full")
+        task_info = self.active_tasks.get(task_id)
+        if task_info and task_info.temp_dir:
+            self.cleanup.remove_dir(task_info.temp_dir)
+        try:
+            await status_msg.edit(
+                f"🚦 **Hàng đợi đã đầy!**\n"
+                f"🔗 URL: `{url}`\n"
+                f"💡 Vui lòng thử lại sau vài phút."
+            )
+        except Exception:
+            pass
+        self.active_tasks.pop(task_id, None)
+    
+    @contextlib.asynccontextmanager
+    async def disk_reservation(self, task_id: str, estimate: int = None):
+        """Reserve the task's estimated disk footprint before it downloads.
+
+        Taken before the scheduler slot, so a job waiting for disk does not
+        hold one of the MAX_CONCURRENT_JOBS slots.
+        """
+        task_info = self.active_tasks.get(task_id)
+        if not task_info.temp_dir:
+            task_info.temp_dir = tempfile.mkdtemp(dir=DOWNLOAD_DIR)
+        if estimate is None:
+            estimate = estimate_job_bytes((task_info.video_info or {}).get('filesize'))
+        
+        async def on_waiting():
+            await task_info.status_msg.edit(
+                f"💽 **Đang chờ dung lượng đĩa...**\n"
+                f"🔗 URL: `{task_info.url}`\n"
+                f"💾 Cần khoảng {format_file_size(estimate)}\n"
+                f"💡 Gửi `/cancel` để hủy."
+            )
+        
+        async with self.disk_space.reserve(task_id, estimate, task_info.temp_dir, on_waiting=on_waiting):
+            yield
+    
+    async def reject_no_disk_space(self, status_msg, url: str, task_id: str, error: Exception):
+        """Tell the user the video can't fit on disk and drop the task"""
+        logger.warning(f"Task {task_id} rejected: {error}")
+        task_info = self.active_tasks.get(task_id)
+        if task_info and task_info.temp_dir:
+            self.cleanup.remove_dir(task_info.temp_dir)
+        try:
+            await status_msg.edit(
+                f"💽 **Không đủ dung lượng đĩa!**\n"
+                f"🔗 URL: `{url}`\n"
+                f"💡 Video quá lớn so với dung lượng trống của bot."
+            )
+        except Exception:
+            pass
+        self.active_tasks.pop(task_id, None)
+    
     def is_authorized(self, user_id: int) -> bool:
         """Check if user is authorized"""
         return is_user_allowed(user_id)
@@ -497,16 +877,13 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
                     raise
             
             # Create and store task
-            main_task = asyncio.create_task(self._process_video_task(status_msg, url, task_id))
-            self.active_tasks[task_id] = {
-                'task': main_task,
-                'url': url,
-                'status_msg': status_msg,
-                'stage': 'info',
-                'user_id': event.sender_id,
-                'source_chat_id': getattr(event, 'chat_id', None),
-                'source_msg_id': getattr(getattr(event, 'message', None), 'id', getattr(event, 'id', None))
-            }
+            task_info = TaskRecord(
+                task_id, url, status_msg, event.sender_id,
+                source_chat_id=getattr(event, 'chat_id', None),
+                source_msg_id=getattr(getattr(event, 'message', None), 'id', getattr(event, 'id', None))
+            )
+            self.active_tasks.add(task_info)
+            task_info.task = asyncio.create_task(self._process_video_task(status_msg, url, task_id))
             
             # Don't wait for task completion here
             # Let the task run in the background
@@ -534,10 +911,15 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
         try:
             # Update task stage
             if task_id in self.active_tasks:
-                self.active_tasks[task_id]['stage'] = 'info'
+                self.set_task_stage(task_id, 'info')
+            
+            # Resolve short links once; later stages use the canonical URL
+            canonical_url = await self.canonicalizer.canonicalize_async(url)
+            if task_id in self.active_tasks:
+                self.active_tasks.get(task_id).canonical_url = canonical_url
             
             # Get video info
-            video_info = self.downloader.get_video_info(url)
+            video_info = await self.downloader.get_video_info_async(canonical_url)
             
             if not video_info:
                 # Provide more helpful error message based on URL type
@@ -588,22 +970,26 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
 
 **Gửi lệnh để chọn hành động:**
 • `/forward` - Download video
+• `/both` - Chuyển tiếp và gửi bản sao cho bạn
 • `/cancel` - Hủy bỏ tác vụ
 • `/fowd_photos` - Download ảnh
             """
             
             await status_msg.edit(info_text)
             
-            # Store video info in task for later use
+            # Store video info in task for later use; the raw extraction
+            # result lets the download skip a second extraction
+            ie_result = video_info.pop('ie_result', None)
             if task_id in self.active_tasks:
-                self.active_tasks[task_id]['video_info'] = video_info
+                task_info = self.active_tasks.get(task_id)
+                task_info.video_info = video_info
+                task_info.ie_result = ie_result
             
             # Task stays in active_tasks, waiting for user command
             # No need to return or complete the task here
             
-            # Wait indefinitely until user takes action or cancels
-            while task_id in self.active_tasks and self.active_tasks[task_id]['stage'] == 'info':
-                await asyncio.sleep(1)
+            # Wait until user takes action or cancels
+            await self.wait_for_stage_change(task_id, 'info')
             
         except asyncio.CancelledError:
             logger.info(f"Video task {task_id} was cancelled")
@@ -616,33 +1002,141 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
             if task_id in self.active_tasks:
                 self.active_tasks.pop(task_id, None)
     
+    def forget_journaled_job(self, task_info):
+        """Drop a task's journal entry once it leaves the registry (done, failed or cancelled by the user)"""
+        if task_info.journal_id is not None and not self.keep_for_resume(task_info):
+            self.journal.finish(task_info.journal_id)
+            task_info.journal_id = None
+    
+    def keep_for_resume(self, task_info) -> bool:
+        """Whether a stopping task is only interrupted by shutdown, so its entry and files stay for resume_jobs()"""
+        return self.shutting_down and task_info is not None and not task_info.cancelled.is_set()
+    
+    async def stop_jobs(self):
+        """Cancel every running task on shutdown without discarding what resume_jobs() needs"""
+        self.shutting_down = True
+        tasks = [task_info.task for task_info in self.active_tasks if task_info.task and not task_info.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if tasks:
+            logger.info(f"Stopped {len(tasks)} tasks, {len(self.journal)} journaled jobs will resume on the next start")
+    
+    async def resume_jobs(self):
+        """Restart jobs the journal still lists, reusing their partial downloads"""
+        for entry in self.journal.unfinished():
+            if not os.path.isdir(entry.temp_dir):
+                self.journal.finish(entry.journal_id)
+                continue
+            
+            chat_id = entry.source_chat_id or entry.user_id
+            try:
+                status_msg = await self.client.send_message(
+                    chat_id,
+                    f"🔄 **Tiếp tục tải sau khi khởi động lại...**\n🔗 URL: `{entry.url}`",
+                    reply_to=entry.source_msg_id
+                )
+            except Exception as e:
+                logger.warning(f"Cannot resume job {entry.journal_id} in chat {chat_id}: {e}")
+                self.journal.finish(entry.journal_id)
+                self.cleanup.remove_dir(entry.temp_dir)
+                continue
+            
+            self.task_counter += 1
+            task_id = str(self.task_counter)
+            task_info = TaskRecord(task_id, entry.url, status_msg, entry.user_id,
+                                   source_chat_id=entry.source_chat_id, source_msg_id=entry.source_msg_id,
+                                   stage='queued')
+            task_info.canonical_url = entry.canonical_url
+            task_info.video_info = entry.video_info
+            task_info.action = entry.action
+            task_info.journal_id = entry.journal_id
+            task_info.temp_dir = entry.temp_dir
+            task_info.format_id = entry.format_id
+            if entry.stage == 'upload':
+                task_info.downloaded_file = entry.file_path
+            else:
+                self.downloader.prepare_resume(entry.temp_dir, entry.stream_path)
+            self.active_tasks.add(task_info)
+            
+            if entry.action == 'user':
+                action = self.handle_download_action_direct(task_id, entry.user_id)
+            else:
+                copy_to_user = entry.user_id if entry.action == 'forward_user' else None
+                action = self.handle_forward_action_direct(task_id, copy_to_user=copy_to_user)
+            task_info.task = asyncio.create_task(action)
+            logger.info(f"Resumed job {entry.journal_id} as task {task_id} ({entry.stage}): {entry.url}")
+    
     async def download_video_async_cancellable(self, url: str, task_id: str) -> str:
-        """Download video in executor with cancellation support"""
-        loop = asyncio.get_event_loop()
+        """Download video in a worker process with cancellation support"""
+        task_info = self.active_tasks.get(task_id)
+        if not task_info:
+            raise asyncio.CancelledError("Download cancelled by user")
+        
+        # A resumed job that had finished downloading goes straight to upload
+        if task_info.downloaded_file and os.path.exists(task_info.downloaded_file):
+            return task_info.downloaded_file
+        
+        # Journal the job so a restart can continue from its partial files
+        resuming = task_info.journal_id is not None
+        if not task_info.temp_dir:
+            task_info.temp_dir = tempfile.mkdtemp(dir=DOWNLOAD_DIR)
+        if not task_info.format_id and task_info.ie_result:
+            task_info.format_id = task_info.ie_result.get('format_id')
+        if not resuming:
+            task_info.journal_id = self.journal.start(task_info, task_info.temp_dir, task_info.format_id)
+        
+        # Files the worker announces are uploaded while they are still downloading
+        streamed = set()
+        
+        def on_stream(path: str, expected_size):
+            if expected_size is None:
+                streamed.discard(path)
+                self.uploader.abort_stream(path)
+                self.journal.update(task_info.journal_id, stream_path=None)
+            else:
+                streamed.add(path)
+                self.uploader.start_stream(path, expected_size)
+                self.journal.update(task_info.journal_id, stream_path=path)
         
-        # Create download task
-        download_task = loop.run_in_executor(None, self.downloader.download_video, url)
+        # Create download task; cancelling it kills the worker's process tree
+        progress = task_info.progress
+        download_task = asyncio.ensure_future(self.download_pool.download_video(
+            task_id, task_info.canonical_url or url, on_progress=progress.update if progress else None,
+            on_stream=on_stream if STREAM_UPLOAD and not resuming else None,
+            ie_result=task_info.ie_result, on_postprocess=self.postprocess_stats.record,
+            temp_dir=task_info.temp_dir, format_id=task_info.format_id
+        ))
+        cancel_waiter = asyncio.ensure_future(task_info.cancelled.wait())
+        file_path = None
         
         try:
-            # Wait for download with cancellation check
-            while not download_task.done():
-                # Check if task was cancelled
-                if task_id not in self.active_tasks:
-                    download_task.cancel()
-                    raise asyncio.CancelledError("Download cancelled by user")
-                
-                # Wait a bit before checking again
-                await asyncio.sleep(1)
+            # Wake on whichever comes first: download completion or /cancel
+            await asyncio.wait({download_task, cancel_waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if not download_task.done():
+                raise asyncio.CancelledError("Download cancelled by user")
             
-            return await download_task
+            file_path = await download_task
+            if file_path:
+                self.journal.update(task_info.journal_id, stage='upload', file_path=file_path, stream_path=None)
+            return file_path
             
         except asyncio.CancelledError:
-            # Try to cancel the download task
+            # Kill the worker; its partial files are kept only if shutdown interrupted it
             download_task.cancel()
+            await asyncio.gather(download_task, return_exceptions=True)
+            if not self.keep_for_resume(task_info):
+                self.cleanup.remove_dir(task_info.temp_dir)
             raise
+        finally:
+            cancel_waiter.cancel()
+            # Only the returned file may finish its streamed upload
+            for path in streamed - {file_path}:
+                self.uploader.abort_stream(path)
     
-    async def upload_and_forward_cancellable(self, status_msg, file_path: str, url: str, video_info: dict, task_id: str):
-        """Upload video to target chat using client with cancellation support"""
+    async def upload_and_forward_cancellable(self, status_msg, file_path: str, url: str, video_info: dict, task_id: str,
+                                             copy_to_user: int = None):
+        """Upload video once and deliver it to the forward targets (and optionally the requester)"""
         try:
             file_size = os.path.getsize(file_path)
             file_size_mb = file_size / (1024 * 1024)
@@ -654,18 +1148,11 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
                 f"⏳ Vui lòng đợi..."
             )
             
-            # Prepare caption with length limits
-            truncated_url = self.truncate_url(url, max_length=100)
-            truncated_title = video_info.get('title', 'Unknown')[:80] + '...' if len(video_info.get('title', '')) > 80 else video_info.get('title', 'Unknown')
-            truncated_uploader = video_info.get('uploader', 'Unknown')[:50] + '...' if len(video_info.get('uploader', '')) > 50 else video_info.get('uploader', 'Unknown')
-            
-            caption = f"🎬 **{truncated_title}**\n👤 **Tác giả:** {truncated_uploader}\n🔗 {truncated_url}"
-            
             # Get video duration for attributes
             duration = video_info.get('duration', 0)
             
             # Get video dimensions for preserved aspect ratio
-            width, height = await self.get_video_dimensions(file_path)
+            width, height = await self.get_video_dimensions(file_path, video_info)
             
             # Upload with video attributes including dimensions
             attributes = []
@@ -677,37 +1164,35 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
                     supports_streaming=True
                 ))
             
-            # Upload file with cancellation check
-            upload_task = self.client.send_file(
-                TARGET_CHAT_ID,
-                file_path,
-                caption=caption,
-                attributes=attributes,
-                supports_streaming=True,
+            destinations = self.forward_destinations(video_info, url, copy_to_user)
+            
+            # Upload once, then send the same media to every destination
+            delivered = await self.deliver_video(
+                task_id, file_path, destinations, attributes,
                 progress_callback=lambda current, total: self.upload_progress_cancellable(
                     status_msg, current, total, file_size_mb, task_id
                 )
             )
             
-            await upload_task
-            
             # Success message
+            await self.stop_progress(task_id)
             await status_msg.edit(
                 f"✅ **Hoàn thành!**\n"
                 f"🎬 Video đã được chuyển tiếp thành công!\n"
+                f"📨 Đã gửi tới {delivered}/{len(destinations)} chat\n"
                 f"📁 Kích thước: {file_size_mb:.1f}MB\n"
                 f"🔗 URL: `{url}`"
             )
             
             # Clean up
-            self.downloader.cleanup_file(file_path)
+            self.cleanup.remove_file(file_path)
 
             # Delete source link message and processing message after success
             try:
                 task = self.active_tasks.get(task_id)
                 if task:
-                    source_chat_id = task.get('source_chat_id')
-                    source_msg_id = task.get('source_msg_id')
+                    source_chat_id = task.source_chat_id
+                    source_msg_id = task.source_msg_id
                     if source_chat_id and source_msg_id:
                         await self.client.delete_messages(source_chat_id, [source_msg_id])
                 # Delete status/processing message
@@ -721,85 +1206,244 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
             
         except asyncio.CancelledError:
             logger.info(f"Upload task {task_id} was cancelled")
-            # Clean up on cancellation
-            self.downloader.cleanup_file(file_path)
+            # Clean up on cancellation, unless the upload resumes after a restart
+            if not self.keep_for_resume(self.active_tasks.get(task_id)):
+                self.cleanup.remove_file(file_path)
             raise
         except Exception as e:
             logger.error(f"Upload error: {e}")
+            await self.stop_progress(task_id)
             await status_msg.edit(
                 f"❌ **Lỗi upload:**\n"
                 f"📝 Chi tiết: {str(e)}\n"
                 f"🔗 URL: `{url}`"
             )
             # Clean up on error
-            self.downloader.cleanup_file(file_path)
+            self.cleanup.remove_file(file_path)
+    
+    async def deliver_video(self, task_id: str, file_path: str, destinations: list, attributes: list,
+                            progress_callback=None) -> int:
+        """Send a video to every (chat, caption) destination with a single upload.
+
+        The first destination gets the uploaded file and its media is kept on
+        the task; the other chats receive that media by reference. A failure
+        on the first destination raises, later ones are logged and skipped.
+        Returns the number of chats the video reached.
+        """
+        task_info = self.active_tasks.get(task_id)
+        media = task_info.uploaded_media if task_info else None
+        delivered = 0
+        
+        for index, (chat, caption) in enumerate(destinations):
+            try:
+                if media is None:
+                    # Upload file parts in parallel with cancellation check
+                    input_file = await self.uploader.upload(file_path, progress_callback=progress_callback)
+                    message = await self.client.send_file(
+                        chat,
+                        input_file,
+                        caption=caption,
+                        attributes=attributes,
+                        supports_streaming=True
+                    )
+                    media = message.media
+                    if task_info:
+                        task_info.uploaded_media = media
+                        self.remember_media(task_info, message)
+                else:
+                    await self.client.send_file(chat, media, caption=caption)
+                delivered += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if index == 0 or media is None:
+                    raise
+                logger.warning(f"Could not deliver task {task_id} to chat {chat}: {e}")
+        
+        return delivered
+    
+    async def deliver_cached(self, task_id: str, destinations: list) -> int:
+        """Re-send a video this bot already sent for the same platform ID.
+
+        Returns the number of chats reached, or 0 when the video is not cached
+        (or its cached reference is unusable) and must be downloaded.
+        """
+        task_info = self.active_tasks.get(task_id)
+        key = task_info and (task_info.video_info or {}).get('media_key')
+        entry = self.media_cache.get(key) if key else None
+        if not entry:
+            return 0
+        
+        for attempt in range(2):
+            task_info.uploaded_media = entry.input_document()
+            try:
+                delivered = await self.deliver_video(task_id, None, destinations, [])
+                logger.info(f"Served task {task_id} from media cache ({key})")
+                return delivered
+            except FileReferenceExpiredError:
+                if attempt == 0:
+                    entry = await self.refresh_cached_media(entry)
+                    if entry:
+                        continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cached media for {key} is unusable: {e}")
+            break
+        
+        # Fall back to a normal download; the new upload replaces the entry
+        task_info.uploaded_media = None
+        self.media_cache.delete(key)
+        return 0
+    
+    async def refresh_cached_media(self, entry):
+        """Fetch the cached message again to get a fresh file reference"""
+        try:
+            message = await self.client.get_messages(entry.chat_id, ids=entry.message_id)
+        except Exception as e:
+            logger.warning(f"Could not refresh cached media {entry.key}: {e}")
+            return None
+        if not message or not message.document or message.document.id != entry.document_id:
+            return None
+        return self.media_cache.put(entry.key, entry.chat_id, entry.message_id, message.document)
+    
+    def remember_media(self, task_info, message):
+        """Store the document of a freshly uploaded video in the media cache"""
+        key = (task_info.video_info or {}).get('media_key')
+        if not key or not message or not message.document:
+            return
+        try:
+            self.media_cache.put(key, message.chat_id, message.id, message.document)
+        except Exception as e:
+            logger.warning(f"Could not cache media for {key}: {e}")
+    
+    def forward_destinations(self, video_info: dict, url: str, copy_to_user: int = None) -> list:
+        """(chat, caption) pairs for a forward, plus the requester for /both"""
+        truncated_url = self.truncate_url(url, max_length=100)
+        truncated_title = video_info.get('title', 'Unknown')[:80] + '...' if len(video_info.get('title', '')) > 80 else video_info.get('title', 'Unknown')
+        truncated_uploader = video_info.get('uploader', 'Unknown')[:50] + '...' if len(video_info.get('uploader', '')) > 50 else video_info.get('uploader', 'Unknown')
+        
+        caption = f"🎬 **{truncated_title}**\n👤 **Tác giả:** {truncated_uploader}\n🔗 {truncated_url}"
+        destinations = [(chat, caption) for chat in FORWARD_TARGETS]
+        if copy_to_user:
+            destinations.append((copy_to_user, self.user_caption(video_info, url)))
+        return destinations
+    
+    async def finish_cached_delivery(self, task_id: str, status_msg, url: str, delivered: int, total: int):
+        """Report a cache hit and clean up like a normal successful delivery"""
+        task_info = self.active_tasks.get(task_id)
+        try:
+            await status_msg.edit(
+                f"✅ **Hoàn thành!**\n"
+                f"⚡ Video đã có sẵn, gửi lại không cần tải\n"
+                f"📨 Đã gửi tới {delivered}/{total} chat\n"
+                f"🔗 URL: `{url}`"
+            )
+            if task_info and task_info.source_chat_id and task_info.source_msg_id:
+                await self.client.delete_messages(task_info.source_chat_id, [task_info.source_msg_id])
+            try:
+                await status_msg.delete()
+            except Exception:
+                pass
+        except Exception as e:
+            logger.debug(f"Cleanup after cached delivery failed: {e}")
+        finally:
+            self.active_tasks.pop(task_id, None)
+    
+    def user_caption(self, video_info: dict, url: str) -> str:
+        """Caption for a video sent to the requesting user"""
+        truncated_url = self.truncate_url(url, max_length=100)
+        truncated_title = video_info.get('title', 'Unknown')[:80] + '...' if len(video_info.get('title', '')) > 80 else video_info.get('title', 'Unknown')
+        truncated_uploader = video_info.get('uploader', 'Unknown')[:50] + '...' if len(video_info.get('uploader', '')) > 50 else video_info.get('uploader', 'Unknown')
+        
+        return f"🎬 **Video đã tải:**\n📹 {truncated_title}\n👤 {truncated_uploader}\n🔗 {truncated_url}"
     
     async def upload_progress_cancellable(self, status_msg, current: int, total: int, file_size_mb: float, task_id: str):
         """Update upload progress with cancellation check"""
         try:
             # Check if task was cancelled
-            if task_id not in self.active_tasks:
+            task_info = self.active_tasks.get(task_id)
+            if not task_info or task_info.cancelled.is_set():
                 raise asyncio.CancelledError("Upload cancelled by user")
             
-            if total > 0:
-                percentage = (current / total) * 100
-                await status_msg.edit(
-                    f"📤 **Đang upload... {percentage:.1f}%**\n"
-                    f"💾 Kích thước: {file_size_mb:.1f}MB\n"
-                    f"📊 Tiến trình: {current // (1024*1024):.1f}MB / {total // (1024*1024):.1f}MB"
-                )
+            # Edits are coalesced by the job's progress reporter
+            progress = task_info.progress
+            if progress is None:
+                progress = task_info.progress = ProgressReporter(status_msg)
+            progress.update('upload', current, total)
         except asyncio.CancelledError:
             raise
         except Exception:
             pass  # Ignore progress update errors
     
     
-    async def handle_forward_action_direct(self, task_id: str):
-        """Handle forward action"""
+    async def handle_forward_action_direct(self, task_id: str, copy_to_user: int = None):
+        """Handle forward action, optionally sending a copy to the requester"""
         if task_id not in self.active_tasks:
             return
         
-        task_info = self.active_tasks[task_id]
-        status_msg = task_info['status_msg']
-        url = task_info['url']
+        task_info = self.active_tasks.get(task_id)
+        status_msg = task_info.status_msg
+        url = task_info.url
         
         try:
             # Update task stage
-            self.active_tasks[task_id]['stage'] = 'download'
-            self.active_tasks[task_id]['action'] = 'forward'
-            
-            # Show downloading status
-            await status_msg.edit(
-                f"⬇️ **Đang tải video...**\n🔗 URL: `{url}`\n⏳ Vui lòng đợi..."
-            )
-            
-            # Download video
-            file_path = await self.download_video_async_cancellable(url, task_id)
+            self.set_task_stage(task_id, 'queued')
+            task_info.action = 'forward' if not copy_to_user else 'forward_user'
+            
+            # A video already sent before is re-sent without downloading
+            destinations = self.forward_destinations(task_info.video_info or {}, url, copy_to_user)
+            delivered = await self.deliver_cached(task_id, destinations)
+            if delivered:
+                await self.finish_cached_delivery(task_id, status_msg, url, delivered, len(destinations))
+                return
             
-            if not file_path:
+            async with (
+                self.disk_reservation(task_id),
+                self.scheduler.slot(task_id, task_info.user_id,
+                                    on_queued=lambda pos: self.show_queue_position(status_msg, url, pos))
+            ):
+                self.set_task_stage(task_id, 'download')
+                
+                # Show downloading status
                 await status_msg.edit(
-                    f"❌ **Không thể tải video!**\n"
-                    f"🔗 URL: `{url}`\n"
-                    f"💡 Video có thể bị giới hạn địa lý hoặc riêng tư."
+                    f"⬇️ **Đang tải video...**\n🔗 URL: `{url}`\n⏳ Vui lòng đợi..."
                 )
-                # Remove task if download failed
-                if task_id in self.active_tasks:
-                    self.active_tasks.pop(task_id, None)
-                return
-            
-            # Update task stage
-            self.active_tasks[task_id]['stage'] = 'upload'
-            
-            # Get video info for upload
-            video_info = self.downloader.get_video_info(url)
-            
-            # Upload to target chat
-            await self.upload_and_forward_cancellable(status_msg, file_path, url, video_info, task_id)
+                task_info.progress = ProgressReporter(status_msg, footer=f"🔗 URL: `{url}`")
+                
+                # Download video
+                file_path = await self.download_video_async_cancellable(url, task_id)
+                
+                if not file_path:
+                    await self.stop_progress(task_id)
+                    await status_msg.edit(
+                        f"❌ **Không thể tải video!**\n"
+                        f"🔗 URL: `{url}`\n"
+                        f"💡 Video có thể bị giới hạn địa lý hoặc riêng tư."
+                    )
+                    # Remove task if download failed
+                    if task_id in self.active_tasks:
+                        self.active_tasks.pop(task_id, None)
+                    return
+                
+                # Update task stage
+                self.set_task_stage(task_id, 'upload')
+                
+                # Reuse video info fetched when the URL was posted
+                video_info = task_info.video_info or await self.downloader.get_video_info_async(task_info.canonical_url or url) or {}
+                
+                # Upload to target chat
+                await self.upload_and_forward_cancellable(status_msg, file_path, url, video_info, task_id,
+                                                          copy_to_user=copy_to_user)
             
             # Remove task after successful completion
             if task_id in self.active_tasks:
                 self.active_tasks.pop(task_id, None)
             
+        except QueueFullError:
+            await self.reject_queue_full(status_msg, url, task_id)
+        except DiskSpaceError as e:
+            await self.reject_no_disk_space(status_msg, url, task_id, e)
         except asyncio.CancelledError:
             logger.info(f"Forward task {task_id} was cancelled")
             # Remove task if cancelled
@@ -807,6 +1451,7 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
                 self.active_tasks.pop(task_id, None)
         except Exception as e:
             logger.error(f"Error in forward action: {e}")
+            await self.stop_progress(task_id)
             await status_msg.edit(f"❌ Lỗi khi chuyển tiếp: {str(e)}")
             # Remove task if error occurred
             if task_id in self.active_tasks:
@@ -817,54 +1462,74 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
         if task_id not in self.active_tasks:
             return
         
-        task_info = self.active_tasks[task_id]
-        status_msg = task_info['status_msg']
-        url = task_info['url']
+        task_info = self.active_tasks.get(task_id)
+        status_msg = task_info.status_msg
+        url = task_info.url
         
         try:
             # Update task stage
-            self.active_tasks[task_id]['stage'] = 'download'
-            self.active_tasks[task_id]['action'] = 'user'
-            
-            # Show downloading status
-            await status_msg.edit(
-                f"💾 **Đang tải video cho bạn...**\n🔗 URL: `{url}`\n⏳ Vui lòng đợi..."
-            )
+            self.set_task_stage(task_id, 'queued')
+            task_info.action = 'user'
             
-            # Download video
-            file_path = await self.download_video_async_cancellable(url, task_id)
+            # A video already sent before is re-sent without downloading
+            destinations = [(user_id, self.user_caption(task_info.video_info or {}, url))]
+            if await self.deliver_cached(task_id, destinations):
+                await self.finish_cached_delivery(task_id, status_msg, url, 1, 1)
+                return
             
-            if not file_path:
+            async with (
+                self.disk_reservation(task_id),
+                self.scheduler.slot(task_id, user_id,
+                                    on_queued=lambda pos: self.show_queue_position(status_msg, url, pos))
+            ):
+                self.set_task_stage(task_id, 'download')
+                
+                # Show downloading status
                 await status_msg.edit(
-                    f"❌ **Không thể tải video!**\n"
-                    f"🔗 URL: `{url}`\n"
-                    f"💡 Video có thể bị giới hạn địa lý hoặc riêng tư."
+                    f"💾 **Đang tải video cho bạn...**\n🔗 URL: `{url}`\n⏳ Vui lòng đợi..."
                 )
-                # Remove task if download failed
-                if task_id in self.active_tasks:
-                    self.active_tasks.pop(task_id, None)
-                return
-            
-            # Update task stage
-            self.active_tasks[task_id]['stage'] = 'upload'
-            
-            # Send video to user
-            await self.send_video_to_user(status_msg, file_path, url, user_id, task_id)
+                task_info.progress = ProgressReporter(status_msg, footer=f"🔗 URL: `{url}`")
+                
+                # Download video
+                file_path = await self.download_video_async_cancellable(url, task_id)
+                
+                if not file_path:
+                    await self.stop_progress(task_id)
+                    await status_msg.edit(
+                        f"❌ **Không thể tải video!**\n"
+                        f"🔗 URL: `{url}`\n"
+                        f"💡 Video có thể bị giới hạn địa lý hoặc riêng tư."
+                    )
+                    # Remove task if download failed
+                    if task_id in self.active_tasks:
+                        self.active_tasks.pop(task_id, None)
+                    return
+                
+                # Update task stage
+                self.set_task_stage(task_id, 'upload')
+                
+                # Send video to user
+                await self.send_video_to_user(status_msg, file_path, url, user_id, task_id)
             
             # Remove task after successful completion
             if task_id in self.active_tasks:
                 self.active_tasks.pop(task_id, None)
             
+        except QueueFullError:
+            await self.reject_queue_full(status_msg, url, task_id)
+        except DiskSpaceError as e:
+            await self.reject_no_disk_space(status_msg, url, task_id, e)
         except asyncio.CancelledError:
             logger.info(f"Download task {task_id} was cancelled")
-            # Clean up temp file if exists
-            if 'file_path' in locals() and file_path:
-                self.downloader.cleanup_file(file_path)
+            # Clean up temp file if exists, unless the job resumes after a restart
+            if 'file_path' in locals() and file_path and not self.keep_for_resume(self.active_tasks.get(task_id)):
+                self.cleanup.remove_file(file_path)
             # Remove task if cancelled
             if task_id in self.active_tasks:
                 self.active_tasks.pop(task_id, None)
         except Exception as e:
             logger.error(f"Error in download action: {e}")
+            await self.stop_progress(task_id)
             await status_msg.edit(f"❌ Lỗi khi tải video: {str(e)}")
             # Remove task if error occurred
             if task_id in self.active_tasks:
@@ -883,19 +1548,15 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
                 f"⏳ Vui lòng đợi..."
             )
             
-            # Get video info for metadata
-            video_info = self.downloader.get_video_info(url)
+            # Reuse video info fetched when the URL was posted
+            task_info = self.active_tasks.get(task_id)
+            video_info = (task_info and task_info.video_info) or await self.downloader.get_video_info_async((task_info and task_info.canonical_url) or url) or {}
             
-            # Prepare caption with length limits
-            truncated_url = self.truncate_url(url, max_length=100)
-            truncated_title = video_info.get('title', 'Unknown')[:80] + '...' if len(video_info.get('title', '')) > 80 else video_info.get('title', 'Unknown')
-            truncated_uploader = video_info.get('uploader', 'Unknown')[:50] + '...' if len(video_info.get('uploader', '')) > 50 else video_info.get('uploader', 'Unknown')
-            
-            caption = f"🎬 **Video đã tải:**\n📹 {truncated_title}\n👤 {truncated_uploader}\n🔗 {truncated_url}"
+            caption = self.user_caption(video_info, url)
             
             # Get video dimensions and duration for attributes
             duration = video_info.get('duration', 0)
-            width, height = await self.get_video_dimensions(file_path)
+            width, height = await self.get_video_dimensions(file_path, video_info)
             
             # Create video attributes with preserved aspect ratio
             attributes = []
@@ -907,21 +1568,16 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
                     supports_streaming=True
                 ))
             
-            # Send video to user with cancellation check
-            upload_task = self.client.send_file(
-                user_id,
-                file_path,
-                caption=caption,
-                attributes=attributes,
-                supports_streaming=True,
+            # Send video to user (reuses the upload if this job already sent it)
+            await self.deliver_video(
+                task_id, file_path, [(user_id, caption)], attributes,
                 progress_callback=lambda current, total: self.upload_progress_cancellable(
                     status_msg, current, total, file_size_mb, task_id
                 )
             )
             
-            await upload_task
-            
             # Success message
+            await self.stop_progress(task_id)
             await status_msg.edit(
                 f"✅ **Video đã gửi thành công!**\n"
                 f"🎬 Video đã được gửi vào chat riêng của bạn\n"
@@ -930,14 +1586,14 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
             )
             
             # Clean up
-            self.downloader.cleanup_file(file_path)
+            self.cleanup.remove_file(file_path)
 
             # Delete source link message and processing message after success
             try:
                 task = self.active_tasks.get(task_id)
                 if task:
-                    source_chat_id = task.get('source_chat_id')
-                    source_msg_id = task.get('source_msg_id')
+                    source_chat_id = task.source_chat_id
+                    source_msg_id = task.source_msg_id
                     if source_chat_id and source_msg_id:
                         await self.client.delete_messages(source_chat_id, [source_msg_id])
                 # Delete status/processing message
@@ -951,18 +1607,20 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
             
         except asyncio.CancelledError:
             logger.info(f"User upload task {task_id} was cancelled")
-            # Clean up on cancellation
-            self.downloader.cleanup_file(file_path)
+            # Clean up on cancellation, unless the upload resumes after a restart
+            if not self.keep_for_resume(self.active_tasks.get(task_id)):
+                self.cleanup.remove_file(file_path)
             raise
         except Exception as e:
             logger.error(f"User upload error: {e}")
+            await self.stop_progress(task_id)
             await status_msg.edit(
                 f"❌ **Lỗi gửi video:**\n"
                 f"📝 Chi tiết: {str(e)}\n"
                 f"🔗 URL: `{url}`"
             )
             # Clean up on error
-            self.downloader.cleanup_file(file_path)
+            self.cleanup.remove_file(file_path)
 
     async def handle_photos_command(self, event):
         """Handle /photos command: send images from TikTok slideshow instead of video"""
@@ -978,56 +1636,62 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
             return
 
         task_id, task_info = pending_task
-        status_msg = task_info['status_msg']
-        url = task_info['url']
+        status_msg = task_info.status_msg
+        url = task_info.url
+        source_url = task_info.canonical_url or url
 
         # Only applicable for TikTok photo URLs
-        if 'tiktok.com' not in url or ('/photo/' not in url and 'slideshow' not in url.lower()):
+        if 'tiktok.com' not in source_url or ('/photo/' not in source_url and 'slideshow' not in source_url.lower()):
             await status_msg.edit("ℹ️ Lệnh `/photos` chỉ áp dụng cho TikTok Photo Slideshow.")
             return
 
+        self.attach_current_task(task_id)
         try:
-            self.active_tasks[task_id]['stage'] = 'download'
-            self.active_tasks[task_id]['action'] = 'photos'
-            await status_msg.edit("⬇️ **Đang tải bộ ảnh slideshow...**\n⏳ Vui lòng đợi...")
-
-            loop = asyncio.get_event_loop()
-            image_paths = await loop.run_in_executor(None, self.downloader.download_tiktok_images, url)
-            if not image_paths:
-                await status_msg.edit("❌ Không tìm thấy ảnh trong slideshow hoặc tải thất bại.")
-                if task_id in self.active_tasks:
-                    self.active_tasks.pop(task_id, None)
-                return
+            self.set_task_stage(task_id, 'queued')
+            task_info.action = 'photos'
 
-            await status_msg.edit(f"📤 **Đang gửi {len(image_paths)} ảnh...**")
-
-            # Send images as media groups (max 10 per album message)
-            CHUNK_SIZE = 10
-            total = len(image_paths)
-            for i in range(0, total, CHUNK_SIZE):
-                if task_id not in self.active_tasks:
-                    raise asyncio.CancelledError("Photos sending cancelled by user")
-                chunk = image_paths[i:i + CHUNK_SIZE]
-                await status_msg.edit(f"📤 **Đang gửi ảnh...** {min(i + CHUNK_SIZE, total)}/{total}")
-                await self.client.send_file(
-                    event.sender_id,
-                    chunk,
-                    caption=("📸 Ảnh nè" if i == 0 else None),
-                    part_size_kb=512,
-                    force_document=False
-                )
+            async with (
+                self.disk_reservation(task_id, PHOTO_SET_ESTIMATE),
+                self.scheduler.slot(task_id, event.sender_id,
+                                    on_queued=lambda pos: self.show_queue_position(status_msg, url, pos))
+            ):
+                self.set_task_stage(task_id, 'download')
+                await status_msg.edit("⬇️ **Đang tải bộ ảnh slideshow...**\n⏳ Vui lòng đợi...")
+
+                image_paths = await self.download_pool.download_tiktok_images(task_id, source_url,
+                                                                               temp_dir=task_info.temp_dir)
+                if not image_paths:
+                    await status_msg.edit("❌ Không tìm thấy ảnh trong slideshow hoặc tải thất bại.")
+                    if task_id in self.active_tasks:
+                        self.active_tasks.pop(task_id, None)
+                    return
+
+                await status_msg.edit(f"📤 **Đang gửi {len(image_paths)} ảnh...**")
+
+                # Send images as media groups (max 10 per album message)
+                CHUNK_SIZE = 10
+                total = len(image_paths)
+                for i in range(0, total, CHUNK_SIZE):
+                    if task_id not in self.active_tasks:
+                        raise asyncio.CancelledError("Photos sending cancelled by user")
+                    chunk = image_paths[i:i + CHUNK_SIZE]
+                    await status_msg.edit(f"📤 **Đang gửi ảnh...** {min(i + CHUNK_SIZE, total)}/{total}")
+                    await self.client.send_file(
+                        event.sender_id,
+                        chunk,
+                        caption=("📸 Ảnh nè" if i == 0 else None),
+                        part_size_kb=512,
+                        force_document=False
+                    )
 
             await status_msg.edit(f"✅ **Đã gửi xong {total} ảnh!**")
 
             # Delete source link message and processing message after success
             try:
-                pending = self.find_pending_task(event.sender_id)
-                if pending:
-                    t_id, t_info = pending
-                    source_chat_id = t_info.get('source_chat_id')
-                    source_msg_id = t_info.get('source_msg_id')
-                    if source_chat_id and source_msg_id:
-                        await self.client.delete_messages(source_chat_id, [source_msg_id])
+                source_chat_id = task_info.source_chat_id
+                source_msg_id = task_info.source_msg_id
+                if source_chat_id and source_msg_id:
+                    await self.client.delete_messages(source_chat_id, [source_msg_id])
                 try:
                     await status_msg.delete()
                 except Exception:
@@ -1043,16 +1707,20 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
 
         except asyncio.CancelledError:
             if 'image_paths' in locals() and image_paths:
-                self.downloader.cleanup_files(image_paths)
+                self.cleanup.remove_files(image_paths)
             if task_id in self.active_tasks:
                 self.active_tasks.pop(task_id, None)
             raise
+        except QueueFullError:
+            await self.reject_queue_full(status_msg, url, task_id)
+        except DiskSpaceError as e:
+            await self.reject_no_disk_space(status_msg, url, task_id, e)
         except Exception as e:
             logger.error(f"Error sending photos: {e}")
             await status_msg.edit(f"❌ Lỗi khi gửi ảnh: {str(e)}")
         finally:
             if 'image_paths' in locals() and image_paths:
-                self.downloader.cleanup_files(image_paths)
+                self.cleanup.remove_files(image_paths)
             if task_id in self.active_tasks:
                 self.active_tasks.pop(task_id, None)
 
@@ -1070,56 +1738,74 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
             return
 
         task_id, task_info = pending_task
-        status_msg = task_info['status_msg']
-        url = task_info['url']
+        status_msg = task_info.status_msg
+        url = task_info.url
+        source_url = task_info.canonical_url or url
 
         # Only applicable for TikTok photo URLs
-        if 'tiktok.com' not in url or ('/photo/' not in url and 'slideshow' not in url.lower()):
+        if 'tiktok.com' not in source_url or ('/photo/' not in source_url and 'slideshow' not in source_url.lower()):
             await status_msg.edit("ℹ️ Lệnh `/photos_forward` chỉ áp dụng cho TikTok Photo Slideshow.")
             return
 
+        self.attach_current_task(task_id)
         try:
-            self.active_tasks[task_id]['stage'] = 'download'
-            self.active_tasks[task_id]['action'] = 'photos_forward'
-            await status_msg.edit("⬇️ **Đang tải bộ ảnh slideshow để gửi vào nhóm...**\n⏳ Vui lòng đợi...")
-
-            loop = asyncio.get_event_loop()
-            image_paths = await loop.run_in_executor(None, self.downloader.download_tiktok_images, url)
-            if not image_paths:
-                await status_msg.edit("❌ Không tìm thấy ảnh trong slideshow hoặc tải thất bại.")
-                if task_id in self.active_tasks:
-                    self.active_tasks.pop(task_id, None)
-                return
+            self.set_task_stage(task_id, 'queued')
+            task_info.action = 'photos_forward'
 
-            await status_msg.edit(f"📤 **Đang gửi {len(image_paths)} ảnh vào nhóm...**")
-
-            # Send images as media groups (max 10 per album message)
-            CHUNK_SIZE = 10
-            total = len(image_paths)
-            for i in range(0, total, CHUNK_SIZE):
-                if task_id not in self.active_tasks:
-                    raise asyncio.CancelledError("Photos sending cancelled by user")
-                chunk = image_paths[i:i + CHUNK_SIZE]
-                await status_msg.edit(f"📤 **Đang gửi ảnh vào nhóm...** {min(i + CHUNK_SIZE, total)}/{total}")
-                await self.client.send_file(
-                    TARGET_CHAT_ID,
-                    chunk,
-                    caption=("📸 Ảnh nè" if i == 0 else None),
-                    part_size_kb=512,
-                    force_document=False
-                )
+            async with (
+                self.disk_reservation(task_id, PHOTO_SET_ESTIMATE),
+                self.scheduler.slot(task_id, event.sender_id,
+                                    on_queued=lambda pos: self.show_queue_position(status_msg, url, pos))
+            ):
+                self.set_task_stage(task_id, 'download')
+                await status_msg.edit("⬇️ **Đang tải bộ ảnh slideshow để gửi vào nhóm...**\n⏳ Vui lòng đợi...")
+
+                image_paths = await self.download_pool.download_tiktok_images(task_id, source_url,
+                                                                               temp_dir=task_info.temp_dir)
+                if not image_paths:
+                    await status_msg.edit("❌ Không tìm thấy ảnh trong slideshow hoặc tải thất bại.")
+                    if task_id in self.active_tasks:
+                        self.active_tasks.pop(task_id, None)
+                    return
+
+                await status_msg.edit(f"📤 **Đang gửi {len(image_paths)} ảnh vào nhóm...**")
+
+                # Send images as media groups (max 10 per album message)
+                CHUNK_SIZE = 10
+                total = len(image_paths)
+                for i in range(0, total, CHUNK_SIZE):
+                    if task_id not in self.active_tasks:
+                        raise asyncio.CancelledError("Photos sending cancelled by user")
+                    chunk = image_paths[i:i + CHUNK_SIZE]
+                    await status_msg.edit(f"📤 **Đang gửi ảnh vào nhóm...** {min(i + CHUNK_SIZE, total)}/{total}")
+                    messages = await self.client.send_file(
+                        TARGET_CHAT_ID,
+                        chunk,
+                        caption=("📸 Ảnh nè" if i == 0 else None),
+                        part_size_kb=512,
+                        force_document=False
+                    )
+                    # Re-send the uploaded album to the other targets without uploading again
+                    if not isinstance(messages, list):
+                        messages = [messages]
+                    for chat in FORWARD_TARGETS[1:]:
+                        try:
+                            await self.client.send_file(
+                                chat,
+                                [m.media for m in messages],
+                                caption=("📸 Ảnh nè" if i == 0 else None)
+                            )
+                        except Exception as e:
+                            logger.warning(f"Could not deliver photos to chat {chat}: {e}")
 
             await status_msg.edit(f"✅ **Đã gửi xong {total} ảnh vào nhóm!**")
 
             # Delete source link message and processing message after success
             try:
-                pending = self.find_pending_task(event.sender_id)
-                if pending:
-                    t_id, t_info = pending
-                    source_chat_id = t_info.get('source_chat_id')
-                    source_msg_id = t_info.get('source_msg_id')
-                    if source_chat_id and source_msg_id:
-                        await self.client.delete_messages(source_chat_id, [source_msg_id])
+                source_chat_id = task_info.source_chat_id
+                source_msg_id = task_info.source_msg_id
+                if source_chat_id and source_msg_id:
+                    await self.client.delete_messages(source_chat_id, [source_msg_id])
                 try:
                     await status_msg.delete()
                 except Exception:
@@ -1135,16 +1821,20 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
 
         except asyncio.CancelledError:
             if 'image_paths' in locals() and image_paths:
-                self.downloader.cleanup_files(image_paths)
+                self.cleanup.remove_files(image_paths)
             if task_id in self.active_tasks:
                 self.active_tasks.pop(task_id, None)
             raise
+        except QueueFullError:
+            await self.reject_queue_full(status_msg, url, task_id)
+        except DiskSpaceError as e:
+            await self.reject_no_disk_space(status_msg, url, task_id, e)
         except Exception as e:
             logger.error(f"Error sending photos to group: {e}")
             await status_msg.edit(f"❌ Lỗi khi gửi ảnh vào nhóm: {str(e)}")
         finally:
             if 'image_paths' in locals() and image_paths:
-                self.downloader.cleanup_files(image_paths)
+                self.cleanup.remove_files(image_paths)
             if task_id in self.active_tasks:
                 self.active_tasks.pop(task_id, None)
     
@@ -1178,32 +1868,21 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
         
         return url
     
-    async def get_video_dimensions(self, file_path: str) -> tuple:
-        """Get video dimensions using ffprobe"""
+    async def get_video_dimensions(self, file_path: str, video_info: dict = None) -> tuple:
+        """Get video dimensions, probing the file only if nothing describes it yet"""
         try:
-            import subprocess
-            import json
-            
-            cmd = [
-                'ffprobe',
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_streams',
-                file_path
-            ]
+            # Filled in by the download worker for the files it produced
+            info = media_info_cache.get(file_path)
+            if info and info.width > 0 and info.height > 0:
+                return info.width, info.height
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+            # Dimensions yt-dlp reported for the selected format
+            if video_info and (video_info.get('width') or 0) > 0 and (video_info.get('height') or 0) > 0:
+                return video_info['width'], video_info['height']
             
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                
-                # Find video stream
-                for stream in data.get('streams', []):
-                    if stream.get('codec_type') == 'video':
-                        width = stream.get('width', 0)
-                        height = stream.get('height', 0)
-                        if width > 0 and height > 0:
-                            return width, height
+            info = await media_info_cache.probe(file_path)
+            if info and info.width > 0 and info.height > 0:
+                return info.width, info.height
             
             # Fallback dimensions
             return 1280, 720
@@ -1216,7 +1895,13 @@ YouTube, TikTok, Twitter/X, Vimeo, v.v.
         """Run the client"""
         await self.start()
         logger.info("Bot is running. Press Ctrl+C to stop.")
-        await self.client.run_until_disconnected()
+        try:
+            await self.client.run_until_disconnected()
+        finally:
+            await self.stop_jobs()
+            self.download_pool.shutdown()
+            await self.cleanup.stop()
+            self.journal.close()
 
 async def main():
     """Main function"""
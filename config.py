@@ -62,4 +62,60 @@ if TARGET_CHAT_ID:
 
 # Download settings
 MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB limit for Telegram Client
-DOWNLOAD_TIMEOUT = 1800  # 30 minutes
\ No newline at end of file
+DOWNLOAD_TIMEOUT = 1800  # 30 minutes
+
+# Job scheduling
+MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', '3'))  # Download/upload pipelines running at once
+MAX_JOBS_PER_USER = int(os.getenv('MAX_JOBS_PER_USER', '1'))  # Pipelines one user may run at once
+MAX_QUEUED_JOBS = int(os.getenv('MAX_QUEUED_JOBS', '20'))  # Jobs allowed to wait for a slot
+FFMPEG_SLOTS = int(os.getenv('FFMPEG_SLOTS', '0'))  # ffmpeg encodes running at once; 0 = from the CPU quota
+FFMPEG_THREADS = int(os.getenv('FFMPEG_THREADS', '0'))  # -threads per ffmpeg encode; 0 = CPUs / slots
+
+# Video info extraction
+INFO_WORKERS = int(os.getenv('INFO_WORKERS', '4'))  # Threads reserved for yt-dlp info lookups
+INFO_TIMEOUT = int(os.getenv('INFO_TIMEOUT', '45'))  # Seconds before an info lookup is abandoned
+
+# Progress reporting
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', '3'))  # Minimum seconds between status message edits
+
+# Upload settings
+UPLOAD_CONNECTIONS = int(os.getenv('UPLOAD_CONNECTIONS', '6'))  # Max parallel connections for one large upload
+# Upload progressive MP4s while they download; these skip audio enhancement
+STREAM_UPLOAD = os.getenv('STREAM_UPLOAD', 'false').lower() in ('1', 'true', 'yes')
+
+# Download settings
+DOWNLOAD_CONNECTIONS = int(os.getenv('DOWNLOAD_CONNECTIONS', '4'))  # Parallel fragments/byte ranges per download
+# Boost/normalize the audio of downloaded videos (costs an audio re-encode per video)
+AUDIO_ENHANCE = os.getenv('AUDIO_ENHANCE', 'true').lower() in ('1', 'true', 'yes')
+
+# Disk-space admission (jobs wait until their estimated footprint fits)
+DISK_EXPANSION_FACTOR = float(os.getenv('DISK_EXPANSION_FACTOR', '2.0'))  # Peak disk use per downloaded byte (merge/post-processing copies)
+DISK_FREE_MARGIN = int(os.getenv('DISK_FREE_MARGIN_MB', '512')) * 1024 * 1024  # Always left free on the volume
+
+# Delivery targets
+# Extra chats /forward also delivers to, comma separated IDs or @usernames.
+# The file is uploaded once and re-sent to these chats by media reference.
+FORWARD_CHAT_IDS = []
+for _chat in os.getenv('FORWARD_CHAT_IDS', '').split(','):
+    _chat = _chat.strip()
+    if _chat:
+        FORWARD_CHAT_IDS.append(int(_chat) if _chat.lstrip('-').isdigit() else _chat)
+FORWARD_TARGETS = [TARGET_CHAT_ID] + [c for c in FORWARD_CHAT_IDS if c != TARGET_CHAT_ID]
+
+# Media cache (repeat links are re-sent from Telegram instead of downloaded)
+MEDIA_CACHE_FILE = os.getenv('MEDIA_CACHE_FILE', os.path.join(DOWNLOAD_DIR, 'media_cache.db'))
+MEDIA_CACHE_MAX_ENTRIES = int(os.getenv('MEDIA_CACHE_MAX_ENTRIES', '5000'))  # Least recently used entries are evicted
+
+# Job journal (downloads interrupted by a crash or restart are resumed)
+JOB_JOURNAL_FILE = os.getenv('JOB_JOURNAL_FILE', os.path.join(DOWNLOAD_DIR, 'jobs.db'))
+
+# Loudness measurements of audio tracks, by content hash (audio enhancement)
+LOUDNESS_CACHE_FILE = os.getenv('LOUDNESS_CACHE_FILE', os.path.join(DOWNLOAD_DIR, 'loudness.db'))
+
+# Temp dir janitor (orphaned job directories in DOWNLOAD_DIR)
+JANITOR_INTERVAL = int(os.getenv('JANITOR_INTERVAL', '1800'))  # Seconds between sweeps
+TEMP_DIR_MAX_AGE = int(os.getenv('TEMP_DIR_MAX_AGE', '21600'))  # Untouched for this many seconds = orphaned
+
+# Short-link resolution cache
+URL_CACHE_SIZE = int(os.getenv('URL_CACHE_SIZE', '1024'))  # Resolved short links kept in memory
+URL_CACHE_TTL = int(os.getenv('URL_CACHE_TTL', '3600'))  # Seconds a resolved short link is trusted
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Disk-space admission control for DOWNLOAD_DIR
+Jobs reserve their estimated footprint (download size x post-processing
+expansion) before they start writing. Jobs that do not fit wait in a FIFO
+queue until running jobs release their reservations or space frees up.
+"""
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+import contextlib
+from collections import OrderedDict
+from typing import Optional
+from config import DOWNLOAD_DIR, DISK_EXPANSION_FACTOR, DISK_FREE_MARGIN
+
+logger = logging.getLogger(__name__)
+
+# Assumed download size when the info dict has no filesize
+UNKNOWN_SIZE_ESTIMATE = 300 * 1024 * 1024
+# Assumed size of a photo slideshow's images, which are not post-processed
+PHOTO_SET_ESTIMATE = 100 * 1024 * 1024
+# Seconds between free-space checks while jobs are waiting
+RECHECK_INTERVAL = 30
+
+
+class DiskSpaceError(Exception):
+    """Raised when a job can never fit on the download volume"""
+
+
+def estimate_job_bytes(filesize: Optional[int], factor: float = DISK_EXPANSION_FACTOR) -> int:
+    """Peak disk usage of a job: the download plus the copies post-processing makes"""
+    return int((filesize or UNKNOWN_SIZE_ESTIMATE) * factor)
+
+
+def _dir_size(path: str) -> int:
+    """Bytes currently used by the files under a directory"""
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def _dir_sizes(paths: list) -> list:
+    return [_dir_size(path) for path in paths]
+
+
+class _Reservation:
+    """Bytes set aside for one job; path is where the job writes"""
+    __slots__ = ('job_id', 'nbytes', 'path', 'future', 'on_waiting', 'created_at', 'written')
+
+    def __init__(self, job_id: str, nbytes: int, path: Optional[str], future: Optional[asyncio.Future] = None,
+                 on_waiting=None):
+        self.job_id = job_id
+        self.nbytes = nbytes
+        self.path = path
+        self.future = future
+        self.on_waiting = on_waiting
+        self.created_at = time.monotonic()
+        self.written = 0  # Bytes under path at the last refresh()
+
+    def remaining(self) -> int:
+        """Part of the reservation the job had not written to disk at the last refresh()"""
+        return max(0, self.nbytes - self.written)
+
+
+class DiskSpaceController:
+    """Reserve disk space for jobs before they start writing.
+
+    Free space already reflects what running jobs wrote, so only the part of
+    each reservation not yet on disk is subtracted. margin bytes are always
+    kept free for everything else on the volume.
+
+    What each job wrote is measured by refresh() in a thread, since a
+    fragmented download can leave thousands of files to walk. Between
+    refreshes the last sizes are used; they only undercount, so admission
+    stays on the safe side.
+    """
+
+    def __init__(self, path: str = DOWNLOAD_DIR, margin: int = DISK_FREE_MARGIN):
+        self.path = path
+        self.margin = max(0, margin)
+        self._active = OrderedDict()  # job_id -> _Reservation
+        self._waiting = OrderedDict()  # job_id -> _Reservation, in arrival order
+        self._recheck_task = None
+        self._notify_tasks = set()
+        # Metrics
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, job_id: str, nbytes: int, path: Optional[str] = None, on_waiting=None):
+        """Hold a reservation of nbytes for the duration of the block.
+
+        on_waiting is an optional coroutine function called once if the job
+        has to wait for space.
+        """
+        await self.acquire(job_id, nbytes, path, on_waiting)
+        try:
+            yield
+        finally:
+            self.release(job_id)
+
+    async def acquire(self, job_id: str, nbytes: int, path: Optional[str] = None, on_waiting=None):
+        """Wait until nbytes can be reserved for the job"""
+        await self.refresh()
+        if not self._waiting and self._fits(nbytes):
+            self._admit(_Reservation(job_id, nbytes, path))
+            return
+        if not self._active and not self._fits(nbytes):
+            self.rejected += 1
+            raise DiskSpaceError(f"Job needs {nbytes} bytes but only {self.free_bytes()} are usable")
+
+        reservation = _Reservation(job_id, nbytes, path, asyncio.get_running_loop().create_future(), on_waiting)
+        self._waiting[job_id] = reservation
+        self.waited += 1
+        logger.info(f"Job {job_id} waits for {nbytes} bytes of disk space, {len(self._waiting)} waiting")
+        if on_waiting:
+            task = asyncio.create_task(self._safe_notify(on_waiting))
+            self._notify_tasks.add(task)
+            task.add_done_callback(self._notify_tasks.discard)
+        self._ensure_recheck()
+        try:
+            await reservation.future
+        except asyncio.CancelledError:
+            if reservation.future.done() and not reservation.future.cancelled():
+                self.release(job_id)  # Admitted in the same tick the caller got cancelled
+            else:
+                self._waiting.pop(job_id, None)
+            raise
+
+    def release(self, job_id: str):
+        """Drop a job's reservation and admit waiting jobs that now fit"""
+        if self._active.pop(job_id, None) is not None:
+            self._dispatch()
+
+    async def refresh(self):
+        """Measure what the active jobs have written so far, off the event loop"""
+        reservations = [r for r in self._active.values() if r.path]
+        if not reservations:
+            return
+        sizes = await asyncio.get_running_loop().run_in_executor(None, _dir_sizes, [r.path for r in reservations])
+        for reservation, size in zip(reservations, sizes):
+            reservation.written = size
+
+    def free_bytes(self) -> int:
+        """Free bytes on the volume minus the safety margin"""
+        try:
+            return shutil.disk_usage(self.path).free - self.margin
+        except OSError as e:
+            logger.warning(f"Could not read free space of {self.path}: {e}")
+            return 0
+
+    def reservations(self) -> list:
+        """Active reservations with how much of each is already on disk"""
+        return [{'job_id': r.job_id, 'reserved': r.nbytes, 'written': r.written,
+                 'age': time.monotonic() - r.created_at} for r in self._active.values()]
+
+    def stats(self) -> dict:
+        outstanding = sum(r.remaining() for r in self._active.values())
+        return {
+            'free': self.free_bytes(),
+            'reserved': sum(r.nbytes for r in self._active.values()),
+            'outstanding': outstanding,
+            'active': len(self._active),
+            'waiting': len(self._waiting),
+            'admitted': self.admitted,
+            'waited': self.waited,
+            'rejected': self.rejected,
+        }
+
+    def _fits(self, nbytes: int) -> bool:
+        outstanding = sum(r.remaining() for r in self._active.values())
+        return nbytes <= self.free_bytes() - outstanding
+
+    def _admit(self, reservation: _Reservation):
+        reservation.created_at = time.monotonic()
+        self._active[reservation.job_id] = reservation
+        self.admitted += 1
+
+    def _dispatch(self):
+        """Admit waiting jobs in arrival order while they fit"""
+        for job_id, reservation in list(self._waiting.items()):
+            if reservation.future.done():
+                del self._waiting[job_id]
+                continue
+            if not self._fits(reservation.nbytes):
+                if not self._active:
+                    # Nothing left to wait for; it will not fit by itself
+                    del self._waiting[job_id]
+                    self.rejected += 1
+                    reservation.future.set_exception(DiskSpaceError(
+                        f"Job needs {reservation.nbytes} bytes but only {self.free_bytes()} are usable"))
+                    continue
+                break  # Strict FIFO so large jobs are not starved
+            del self._waiting[job_id]
+            self._admit(reservation)
+            reservation.future.set_result(True)
+            logger.info(f"Job {job_id} got {reservation.nbytes} bytes of disk space, {len(self._waiting)} waiting")
+
+    def _ensure_recheck(self):
+        """Poll free space while jobs wait; other processes may free some"""
+        if self._recheck_task is None or self._recheck_task.done():
+            self._recheck_task = asyncio.create_task(self._recheck_loop())
+
+    async def _recheck_loop(self):
+        while self._waiting:
+            await asyncio.sleep(RECHECK_INTERVAL)
+            await self.refresh()
+            self._dispatch()
+
+    @staticmethod
+    async def _safe_notify(callback):
+        try:
+            await callback()
+        except Exception as e:
+            logger.debug(f"Disk space wait notification failed: {e}")
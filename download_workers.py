@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Process-isolated download workers
+Each job runs VideoDownloader in its own process group so that cancelling it
+kills yt-dlp, ffmpeg and gallery-dl children and frees the temp directory.
+Workers ask the bot's MediaWorkerFarm for a slot before each ffmpeg run and
+receive the grant on a second pipe.
+"""
+
+import os
+import time
+import signal
+import threading
+import asyncio
+import logging
+import tempfile
+import shutil
+import multiprocessing
+from typing import Optional
+from config import DOWNLOAD_DIR
+from media_info import MediaInfo, media_info_cache
+import media_farm
+
+logger = logging.getLogger(__name__)
+
+# Imported once by the fork server instead of by every worker
+PRELOAD_MODULES = ['yt_dlp', 'downloader']
+
+
+class DownloadWorkerError(Exception):
+    """Raised when a download worker fails or dies without a result"""
+
+
+class _ProgressSender:
+    """Forward progress from a worker to the parent, at most a few times per second"""
+
+    MIN_INTERVAL = 0.25
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._lock = threading.Lock()
+        self._last_sent = {}
+
+    def __call__(self, phase: str, current: float, total: Optional[float] = None):
+        now = time.monotonic()
+        finished = bool(total) and current >= total
+        with self._lock:
+            if not finished and now - self._last_sent.get(phase, 0.0) < self.MIN_INTERVAL:
+                return
+            self._last_sent[phase] = now
+        self.send('progress', (phase, current, total))
+
+    def stream(self, path: str, expected_size: Optional[int]):
+        """Announce (or withdraw, with expected_size None) a file growing on disk"""
+        self.send('stream', (path, expected_size))
+
+    def send(self, kind: str, payload):
+        with self._lock:
+            try:
+                self._conn.send((kind, payload))
+            except (OSError, ValueError):
+                pass  # Parent went away; the result send will fail too
+
+
+def _worker_main(conn, grant_conn, method_name: str, args: tuple):
+    """Entry point of a download worker process"""
+    if hasattr(os, 'setsid'):
+        # Become a process group leader so the whole tree can be killed at once
+        os.setsid()
+    try:
+        from downloader import VideoDownloader
+        downloader = VideoDownloader()
+        sender = _ProgressSender(conn)
+        if grant_conn is not None:
+            media_farm.connect(media_farm.FarmClient(sender.send, grant_conn))
+        downloader.set_progress_callback(sender)
+        downloader.set_stream_callback(sender.stream)
+        downloader.set_postprocess_callback(lambda *result: sender.send('postprocess', result))
+        result = getattr(downloader, method_name)(*args)
+        if isinstance(result, str):
+            # Hand over what the worker learned about the file so the parent need not probe it
+            info = media_info_cache.get(result)
+            if info is not None:
+                sender.send('media', (info.to_dict(),))
+        conn.send(('result', result))
+    except BaseException as e:
+        try:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+        except Exception:
+            pass
+    finally:
+        conn.close()
+
+
+def _remember_media(data: dict):
+    """Store a worker's MediaInfo for the downloaded file in this process's cache"""
+    media_info_cache.put(MediaInfo.from_dict(data))
+
+
+class DownloadProcessPool:
+    """Run VideoDownloader jobs in killable worker processes"""
+
+    def __init__(self, max_workers: int, farm: Optional[media_farm.MediaWorkerFarm] = None):
+        start_method = 'forkserver' if os.name == 'posix' else 'spawn'
+        self._ctx = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            # Workers fork from a server that already imported yt-dlp and its extractors
+            self._ctx.set_forkserver_preload(PRELOAD_MODULES)
+        self.max_workers = max(1, max_workers)
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._processes = {}  # job_id -> Process
+        self.farm = farm  # Schedules the workers' ffmpeg runs; None lets each worker gate its own
+
+    async def download_video(self, job_id: str, url: str, on_progress=None, on_stream=None,
+                             ie_result: Optional[dict] = None, on_postprocess=None,
+                             temp_dir: Optional[str] = None, format_id: Optional[str] = None) -> Optional[str]:
+        """Download a video in a worker; returns the file path or None.
+
+        With on_stream(path, expected_size), progressive MP4s are announced
+        before they are written so they can be uploaded while downloading.
+        ie_result is the info dict extracted earlier, reused by the worker.
+        on_postprocess(action, cpu_seconds, media_seconds) reports the
+        post-processing pass the worker ran. An existing temp_dir (and the
+        format_id downloaded into it) resumes a download from its partial files.
+        If the job is cancelled, temp_dir is left for the caller to remove or
+        resume from.
+        """
+        temp_dir = temp_dir or tempfile.mkdtemp(dir=DOWNLOAD_DIR)
+        return await self.run(job_id, 'download_video', url, temp_dir, on_stream is not None, ie_result, format_id,
+                              temp_dir=temp_dir, remove_on_cancel=False, on_progress=on_progress,
+                              on_stream=on_stream, on_postprocess=on_postprocess)
+
+    async def download_tiktok_images(self, job_id: str, url: str, on_progress=None,
+                                     temp_dir: Optional[str] = None) -> Optional[list]:
+        """Download TikTok slideshow images in a worker"""
+        temp_dir = temp_dir or tempfile.mkdtemp(dir=DOWNLOAD_DIR)
+        return await self.run(job_id, 'download_tiktok_images', url, temp_dir, temp_dir=temp_dir, on_progress=on_progress)
+
+    async def run(self, job_id: str, method_name: str, *args, temp_dir: Optional[str] = None,
+                  remove_on_cancel: bool = True, on_progress=None, on_stream=None, on_postprocess=None):
+        """Call a VideoDownloader method in a fresh worker process.
+
+        on_progress(phase, current, total), on_stream(path, expected_size) and
+        on_postprocess(action, cpu_seconds, media_seconds) are called on the
+        event loop for what the worker reports. If the awaiting coroutine is
+        cancelled, the worker's process group is killed and temp_dir is
+        removed (unless remove_on_cancel is False) before CancelledError
+        propagates. temp_dir is always removed if the worker fails.
+        """
+        async with self._slots:
+            receiver, sender = self._ctx.Pipe(duplex=False)
+            grant_receiver, grant_sender = self._ctx.Pipe(duplex=False) if self.farm else (None, None)
+            process = self._ctx.Process(
+                target=_worker_main,
+                args=(sender, grant_receiver, method_name, args),
+                name=f"download-{job_id}",
+                daemon=True
+            )
+            process.start()
+            sender.close()
+            if grant_receiver is not None:
+                grant_receiver.close()
+            self._processes[job_id] = process
+            logger.info(f"Started download worker pid={process.pid} for job {job_id}")
+
+            try:
+                kind, payload = await self._receive(receiver, on_progress, on_stream, on_postprocess,
+                                                    self._farm_handler(job_id, grant_sender))
+            except asyncio.CancelledError:
+                logger.info(f"Killing download worker pid={process.pid} for cancelled job {job_id}")
+                self._kill(process)
+                await self._reap(process)
+                if temp_dir and remove_on_cancel:
+                    await asyncio.get_running_loop().run_in_executor(None, self._remove_dir, temp_dir)
+                raise
+            finally:
+                receiver.close()
+                if grant_sender is not None:
+                    # Free any slot the worker held and drop its queued requests
+                    self.farm.forget(job_id)
+                    grant_sender.close()
+                self._processes.pop(job_id, None)
+
+            await self._reap(process)
+            if kind == 'error':
+                if temp_dir:
+                    await asyncio.get_running_loop().run_in_executor(None, self._remove_dir, temp_dir)
+                raise DownloadWorkerError(payload)
+            return payload
+
+    def warm_up(self):
+        """Start the fork server (and its module preload) before the first job"""
+        if self._ctx.get_start_method() == 'forkserver':
+            from multiprocessing import forkserver
+            forkserver.ensure_running()
+            logger.info("Download worker fork server is running")
+
+    def shutdown(self):
+        """Kill every running worker"""
+        for process in list(self._processes.values()):
+            self._kill(process)
+        self._processes.clear()
+
+    def _farm_handler(self, job_id: str, grant_conn):
+        """Callback for a worker's ffmpeg slot requests; grants are sent back on grant_conn"""
+        if grant_conn is None:
+            return None
+        return lambda op, *args: self.farm.handle(job_id, grant_conn.send, op, *args)
+
+    async def _receive(self, conn, on_progress=None, on_stream=None, on_postprocess=None, on_farm=None):
+        """Relay progress, stream, post-processing, media info and farm messages until the worker sends its result"""
+        callbacks = {'progress': on_progress, 'stream': on_stream, 'postprocess': on_postprocess,
+                     'media': _remember_media, 'farm': on_farm}
+        while True:
+            await self._wait_readable(conn)
+            try:
+                kind, payload = conn.recv()
+            except EOFError:
+                return 'error', 'Download worker exited without a result'
+            if kind not in callbacks:
+                return kind, payload
+            callback = callbacks[kind]
+            if callback:
+                try:
+                    callback(*payload)
+                except Exception as e:
+                    logger.debug(f"{kind.capitalize()} callback failed: {e}")
+
+    async def _wait_readable(self, conn):
+        """Wait for data on the pipe without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        try:
+            ready = loop.create_future()
+            fd = conn.fileno()
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        except NotImplementedError:
+            # Event loops without add_reader support (e.g. Proactor on Windows)
+            await loop.run_in_executor(None, conn.poll, None)
+
+    def _kill(self, process):
+        """Kill the worker and everything it started"""
+        if not process.is_alive():
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (AttributeError, ProcessLookupError, PermissionError):
+            # No process group yet (or not POSIX): kill the worker itself
+            process.kill()
+
+    async def _reap(self, process):
+        """Join a finished or killed worker off the event loop"""
+        await asyncio.get_running_loop().run_in_executor(None, process.join, 5)
+
+    @staticmethod
+    def _remove_dir(path: str):
+        """Remove a job temp directory under DOWNLOAD_DIR"""
+        try:
+            base = os.path.realpath(DOWNLOAD_DIR)
+            real = os.path.realpath(path)
+            if real != base and os.path.commonpath([real, base]) == base:
+                shutil.rmtree(real, ignore_errors=True)
+        except Exception as e:
+            logger.warning(f"Could not remove temp dir {path}: {e}")
@@ -4,19 +4,39 @@ Optimized video downloader using yt-dlp with browser cookies and gallery-dl for
 """
 
 import os
+import copy
+import time
+import asyncio
 import yt_dlp
 import tempfile
 import logging
 import glob
-import subprocess
-import json
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from config import DOWNLOAD_DIR, MAX_FILE_SIZE, DOWNLOAD_TIMEOUT
-from audio_enhancer import AudioEnhancer
+from config import DOWNLOAD_DIR, INFO_WORKERS, INFO_TIMEOUT, DOWNLOAD_CONNECTIONS, AUDIO_ENHANCE
+from process_runner import run_process_sync, ffmpeg_progress_parser
+from media_farm import MediaJob
+from media_info import media_info_cache
+from format_ranking import TelegramFormatSelector
+from parallel_download import ParallelYoutubeDL
+from postprocessing import MediaPostProcessor
+from url_canonicalizer import UrlCanonicalizer
+from ytdl_pool import YoutubeDLPool
 
 logger = logging.getLogger(__name__)
 
+# Progressive single-file MP4 that Telegram plays as is; only these formats
+# are uploaded while they are still downloading
+STREAM_FORMAT = (
+    'best[ext=mp4][vcodec^=avc1][acodec^=mp4a][protocol^=http][filesize<2G]/'
+    'best[ext=mp4][vcodec^=avc1][acodec^=mp4a][protocol^=http][filesize_approx<2G]'
+)
+
+# Format URLs in an extracted info dict are signed and expire; older
+# extractions are not reused for downloading
+IE_RESULT_MAX_AGE = 1800
+
 class GalleryDLDownloader:
     """Download TikTok photo slideshows using gallery-dl"""
     
@@ -35,7 +55,11 @@ class GalleryDLDownloader:
             ]
             
             logger.info(f"Running gallery-dl command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+            result = run_process_sync(cmd, timeout=120, capture_stdout=False)
+            
+            if result.timed_out:
+                logger.error("Gallery-dl timed out")
+                return False
             
             if result.returncode == 0:
                 # Check if files were downloaded
@@ -52,9 +76,6 @@ class GalleryDLDownloader:
                 logger.error(f"STDERR: {result.stderr}")
                 return False
             
-        except subprocess.TimeoutExpired:
-            logger.error("Gallery-dl timed out")
-            return False
         except FileNotFoundError:
             logger.error("gallery-dl command not found. Install with: pip install gallery-dl")
             return False
@@ -66,7 +87,24 @@ class SlideshowCreator:
     """Create video slideshow from TikTok photos with high quality audio"""
     
     def __init__(self):
-        self.temp_files = []
+        self.progress_callback = None  # callback(phase, current, total)
+    
+    def _run_ffmpeg(self, cmd: list, timeout: float, duration: float):
+        """Run an ffmpeg encode in a farm slot, reporting progress if requested.
+        
+        A partial output (the last argument) is removed if the encode fails.
+        """
+        on_progress = None
+        if self.progress_callback:
+            # Insert progress output before the output path (last argument)
+            cmd = cmd[:-1] + ['-progress', 'pipe:1', '-nostats', cmd[-1]]
+            on_progress = ffmpeg_progress_parser(duration, lambda done, total: self.progress_callback('process', done, total))
+        with MediaJob('slideshow') as job:
+            output_path = job.track(cmd[-1])
+            result = job.run(cmd, timeout=timeout, capture_stdout=False, on_stdout_line=on_progress)
+            if result.ok:
+                job.keep(output_path)
+            return result
     
     def create_slideshow(self, temp_dir: str) -> Optional[str]:
         """Create slideshow from photos and audio in temp_dir"""
@@ -139,9 +177,9 @@ class SlideshowCreator:
             cmd = self._build_ffmpeg_command_with_audio(image_files, audio_file, output_path, duration_per_image)
             
             # Run ffmpeg
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+            result = self._run_ffmpeg(cmd, 600, min(audio_duration, duration_per_image * len(image_files)))
             
-            if result.returncode == 0 and os.path.exists(output_path):
+            if result.ok and os.path.exists(output_path):
                 logger.info(f"TikTok slideshow created with audio: {output_path}")
                 return output_path
             else:
@@ -159,9 +197,9 @@ class SlideshowCreator:
             
             cmd = self._build_ffmpeg_command_no_audio(image_files, output_path, duration_per_image)
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            result = self._run_ffmpeg(cmd, 300, duration_per_image * len(image_files))
             
-            if result.returncode == 0 and os.path.exists(output_path):
+            if result.ok and os.path.exists(output_path):
                 logger.info(f"TikTok slideshow created without audio: {output_path}")
                 return output_path
             else:
@@ -173,18 +211,12 @@ class SlideshowCreator:
             return None
     
     def _get_audio_duration(self, audio_file: str) -> float:
-        """Get audio duration using ffprobe"""
+        """Get audio duration (probed once, see media_info)"""
         try:
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                '-show_format', audio_file
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+            info = media_info_cache.probe_sync(audio_file)
             
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                duration = float(data.get('format', {}).get('duration', 0))
-                return duration
+            if info:
+                return info.duration
             
         except Exception as e:
             logger.warning(f"Could not get audio duration: {e}")
@@ -276,36 +308,53 @@ class SlideshowCreator:
         ]
         
         return cmd
-    
-    def cleanup(self):
-        """Clean up temporary files"""
-        for file_path in self.temp_files:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                logger.warning(f"Could not clean up {file_path}: {e}")
-        self.temp_files.clear()
 
 class VideoDownloader:
-    def __init__(self):
+    def __init__(self, canonicalizer: Optional[UrlCanonicalizer] = None):
         os.makedirs(DOWNLOAD_DIR, exist_ok=True)
         
+        # Shared short-link cache; callers usually pass URLs already canonicalized
+        self.canonicalizer = canonicalizer or UrlCanonicalizer()
+        
+        # Progress reporting: callback(phase, current, total)
+        self.progress_callback = None
+        # Stream-through upload: callback(path, expected_size) once the output file is known
+        self.stream_callback = None
+        
         # Initialize gallery-dl downloader for TikTok photos
         self.gallery_dl = GalleryDLDownloader()
         
-        # Initialize audio enhancer
-        self.audio_enhancer = AudioEnhancer()
+        # Probes downloads and runs the cheapest pass that makes them playable
+        self.postprocessor = MediaPostProcessor(enhance_audio=AUDIO_ENHANCE)
+        
+        # Format choice shared by info lookups and downloads
+        self.format_selector = TelegramFormatSelector()
+        
+        # yt-dlp options for info lookups (no download)
+        self.info_opts = {
+            'quiet': True,
+            'format': self.format_selector,
+            'socket_timeout': 30,
+            'retries': 2
+        }
+        
+        # Dedicated executor so slow info lookups never occupy the event loop
+        # or the default executor; threads are only started on first use
+        self._info_executor = ThreadPoolExecutor(max_workers=INFO_WORKERS, thread_name_prefix='video-info')
         
         # Optimized yt-dlp options with high quality audio/video
         self.ydl_opts = {
-            # Prioritize best video + best audio quality, merge if needed
-            'format': 'bestvideo[filesize<2G]+bestaudio[ext=m4a]/bestvideo[filesize<2G]+bestaudio/best[filesize<2G]/best',
+            # Best format that stream-copies into a Telegram-playable mp4 under
+            # MAX_FILE_SIZE; see format_ranking
+            'format': self.format_selector,
             'outtmpl': os.path.join(DOWNLOAD_DIR, '%(title)s.%(ext)s'),
             'noplaylist': True,
             'socket_timeout': 60,
             'retries': 3,
             'fragment_retries': 3,
+            # DASH/HLS fragments fetched in parallel; large progressive files are
+            # split into byte ranges by ParallelYoutubeDL
+            'concurrent_fragment_downloads': DOWNLOAD_CONNECTIONS,
             # Audio quality settings
             'audio_quality': 0,  # Best audio quality (0 = best, 9 = worst)
             'prefer_ffmpeg': True,  # Use ffmpeg for better quality merging
@@ -315,15 +364,51 @@ class VideoDownloader:
             'writeautomaticsub': False,
             # Ensure good quality merging
             'merge_output_format': 'mp4',  # Ensure mp4 output for better compatibility
-            # Post-processing to ensure quality
-            'postprocessors': [
-                {
-                    'key': 'FFmpegVideoConvertor',
-                    'preferedformat': 'mp4',
-                },
-            ],
+            # Conversion and audio enhancement run afterwards in one codec-aware
+            # pass (see postprocessing), not as yt-dlp post-processors
+            'postprocessors': [],
         }
         
+        # Warm YoutubeDL instances: one per info thread, and one for the
+        # download attempts of a job (each job runs in its own worker process)
+        self._info_ydls = YoutubeDLPool(self.info_opts, INFO_WORKERS, 'info')
+        self._download_ydls = YoutubeDLPool(self.ydl_opts, 1, 'download', factory=ParallelYoutubeDL)
+        
+    
+    def set_progress_callback(self, callback):
+        """Report download and processing progress as callback(phase, current, total)"""
+        self.progress_callback = callback
+        self.postprocessor.progress_callback = callback
+    
+    def set_postprocess_callback(self, callback):
+        """Report the post-processing action taken as callback(action, cpu_seconds, media_seconds)"""
+        self.postprocessor.result_callback = callback
+    
+    def set_stream_callback(self, callback):
+        """Announce a file that can be uploaded while it downloads as callback(path, expected_size).
+        
+        expected_size is None when an announced file is withdrawn.
+        """
+        self.stream_callback = callback
+    
+    def _ytdlp_progress_hook(self, d: dict):
+        """yt-dlp progress hook forwarding byte counts to progress_callback"""
+        if not self.progress_callback or d.get('status') != 'downloading':
+            return
+        total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+        self.progress_callback('download', d.get('downloaded_bytes') or 0, total)
+    
+    def warm_up(self):
+        """Create the pooled YoutubeDL instances before the first job (blocking)"""
+        self._info_ydls.warm()
+    
+    def _ydl_opts_for(self, temp_dir: str) -> dict:
+        """Per-job overrides of the base yt-dlp options, writing into temp_dir"""
+        opts = {}
+        opts['outtmpl'] = os.path.join(temp_dir, '%(title)s.%(ext)s')
+        if self.progress_callback:
+            opts['progress_hooks'] = [self._ytdlp_progress_hook]
+        return opts
     
     def _is_subpath(self, path: str, base: str) -> bool:
         """Return True if path is inside base directory."""
@@ -368,22 +453,35 @@ class VideoDownloader:
             # Best-effort cleanup; ignore errors
             pass
 
-    def download_video(self, url: str) -> Optional[str]:
-        """Download video with specialized handling for TikTok photos"""
-        temp_dir = tempfile.mkdtemp(dir=DOWNLOAD_DIR)
+    def download_video(self, url: str, temp_dir: Optional[str] = None, stream: bool = False,
+                       ie_result: Optional[dict] = None, format_id: Optional[str] = None) -> Optional[str]:
+        """Download video with specialized handling for TikTok photos.
+        
+        With stream set, a progressive MP4 is downloaded as is (no audio
+        enhancement) and announced through stream_callback first, so the
+        caller can upload it while it is being written. ie_result is the
+        info dict from get_video_info; when still fresh it is downloaded
+        from directly instead of extracting the URL again. format_id pins
+        the format, so a resumed download continues its .part files.
+        """
+        temp_dir = temp_dir or tempfile.mkdtemp(dir=DOWNLOAD_DIR)
         
         # Enhanced TikTok photo detection and handling
         if self._is_tiktok_photo_url(url):
             logger.info("Detected TikTok photo URL, using gallery-dl for slideshow creation...")
             return self._download_tiktok_slideshow(url, temp_dir)
         
+        if stream and self.stream_callback:
+            file_path = self._try_stream_download(url, temp_dir, ie_result)
+            if file_path:
+                return file_path
+        
         # Regular video download methods
         # Method 1: Standard download
-        file_path = self._try_standard_download(url, temp_dir)
+        # (streams merged and post-processed in one pass, see postprocessing)
+        file_path = self._try_standard_download(url, temp_dir, ie_result, format_id)
         if file_path:
-            # Enhance audio quality
-            enhanced_path = self.audio_enhancer.enhance_video_audio(file_path)
-            return enhanced_path if enhanced_path else file_path
+            return file_path
         
         logger.error("Download failed")
         return None
@@ -397,17 +495,10 @@ class VideoDownloader:
         if '/photo/' in url or 'slideshow' in url.lower():
             return True
         
-        # If it's a short URL (vt.tiktok.com or vm.tiktok.com), resolve it
-        if 'vt.tiktok.com' in url or 'vm.tiktok.com' in url:
-            try:
-                import requests
-                response = requests.head(url, allow_redirects=True, timeout=10)
-                resolved_url = response.url
-                logger.info(f"Resolved TikTok URL {url} -> {resolved_url}")
-                return '/photo/' in resolved_url or 'slideshow' in resolved_url.lower()
-            except Exception as e:
-                logger.warning(f"Could not resolve TikTok URL {url}: {e}")
-                return False
+        # If it's a short URL (vt.tiktok.com or vm.tiktok.com), resolve it (cached)
+        if self.canonicalizer.is_short_link(url):
+            resolved_url = self.canonicalizer.canonicalize(url)
+            return '/photo/' in resolved_url or 'slideshow' in resolved_url.lower()
         
         return False
     
@@ -436,13 +527,12 @@ class VideoDownloader:
             video_url = url.replace('/photo/', '/video/')
             
             # Enhanced yt-dlp options for TikTok photos
-            opts = self.ydl_opts.copy()
-            opts['outtmpl'] = os.path.join(temp_dir, '%(title)s.%(ext)s')
+            opts = self._ydl_opts_for(temp_dir)
             opts['writeinfojson'] = True
-            opts['format'] = 'bestvideo[filesize<2G]+bestaudio[ext=m4a]/bestvideo[filesize<2G]+bestaudio/best[filesize<2G]/best'  # High quality audio priority
+            opts['format'] = self.format_selector
             opts['audio_quality'] = 0  # Ensure best audio quality for slideshow
             
-            with yt_dlp.YoutubeDL(opts) as ydl:
+            with self._download_ydls.checkout(**opts) as ydl:
                 ydl.download([video_url])
                 
             return self._find_downloaded_file(temp_dir)
@@ -451,38 +541,128 @@ class VideoDownloader:
             logger.error(f"Error downloading TikTok photos with yt-dlp fallback: {e}")
             return None
     
-    def _try_standard_download(self, url: str, temp_dir: str) -> Optional[str]:
-        """Try standard download with enhanced TikTok URL resolution"""
+    def _resolve_short_url(self, url: str) -> str:
+        """Resolve TikTok short URLs before downloading"""
+        return self.canonicalizer.canonicalize(url)
+    
+    def _is_fresh(self, ie_result: Optional[dict]) -> bool:
+        """Whether an extracted info dict is recent enough to download from"""
+        return bool(ie_result) and time.time() - ie_result.get('epoch', 0) < IE_RESULT_MAX_AGE
+    
+    def _download_with_info(self, ydl, url: str, ie_result: Optional[dict] = None):
+        """Download from an earlier extraction, extracting again only if it is stale.
+        
+        Same as yt-dlp's --load-info-json: the stored result goes through
+        format selection and download without any page or API requests. If
+        its format URLs were rejected as expired, the URL is extracted anew.
+        Returns the processed info dict.
+        """
+        if self._is_fresh(ie_result):
+            try:
+                return ydl.process_ie_result(copy.deepcopy(ie_result), download=True)
+            except yt_dlp.utils.DownloadError as e:
+                if not self._is_expired_error(e):
+                    raise
+                logger.info(f"Stored format URLs expired, extracting again: {e}")
+        return ydl.extract_info(self._resolve_short_url(url), download=True)
+    
+    @staticmethod
+    def _is_expired_error(error: Exception) -> bool:
+        """HTTP errors that mean a signed media URL is no longer valid"""
+        message = str(error)
+        return any(marker in message for marker in ('403', '410', 'Forbidden', 'Gone', 'expired'))
+    
+    def _try_stream_download(self, url: str, temp_dir: str, ie_result: Optional[dict] = None) -> Optional[str]:
+        """Download a progressive MP4 straight to its final name, announcing it first.
+        
+        Returns None when the URL has no such format or the download fails;
+        an announced file is then withdrawn with expected_size None and the
+        caller falls back to the standard download.
+        """
+        file_path = None
         try:
-            # Resolve TikTok short URLs first
-            resolved_url = url
-            if 'vt.tiktok.com' in url or 'vm.tiktok.com' in url:
-                logger.info(f"Resolving TikTok short URL for download: {url}")
-                try:
-                    import requests
-                    response = requests.head(url, allow_redirects=True, timeout=15)
-                    resolved_url = response.url
-                    logger.info(f"Resolved TikTok URL for download: {url} -> {resolved_url}")
-                except Exception as e:
-                    logger.warning(f"Could not resolve TikTok short URL for download {url}: {e}")
-                    # Continue with original URL as fallback
+            opts = self._ydl_opts_for(temp_dir)
+            opts['format'] = STREAM_FORMAT
+            opts['postprocessors'] = []
+            opts['fixup'] = 'never'  # Fixups rewrite the file after it was uploaded
+            opts['nopart'] = True  # Write to the final name so it can be tailed
             
-            opts = self.ydl_opts.copy()
-            opts['outtmpl'] = os.path.join(temp_dir, '%(title)s.%(ext)s')
+            with self._download_ydls.checkout(**opts) as ydl:
+                info = None
+                if self._is_fresh(ie_result):
+                    try:
+                        info = ydl.process_ie_result(copy.deepcopy(ie_result), download=False)
+                    except yt_dlp.utils.DownloadError:
+                        pass  # No streamable format in the stored result
+                if info is None:
+                    info = ydl.extract_info(self._resolve_short_url(url), download=False)
+                if not info or info.get('requested_formats') or info.get('_type', 'video') != 'video':
+                    return None
+                
+                file_path = ydl.prepare_filename(info)
+                expected_size = info.get('filesize') or info.get('filesize_approx') or 0
+                logger.info(f"Streaming download of {info.get('format_id')} to {file_path} ({expected_size} bytes)")
+                self.stream_callback(file_path, expected_size)
+                
+                self._download_with_info(ydl, url, info)
+            
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(file_path)
+            return file_path
+            
+        except Exception as e:
+            logger.info(f"Stream download not possible, using standard download: {e}")
+            if file_path:
+                # Withdraw the announcement; the partial file must not be reused
+                self.stream_callback(file_path, None)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            return None
+    
+    def _try_standard_download(self, url: str, temp_dir: str, ie_result: Optional[dict] = None,
+                               format_id: Optional[str] = None) -> Optional[str]:
+        """Try standard download with enhanced TikTok URL resolution"""
+        try:
+            opts = self._ydl_opts_for(temp_dir)
+            if format_id:
+                opts['format'] = TelegramFormatSelector(preferred_format=format_id)
             # Add better timeout and retry settings for TikTok
             opts['socket_timeout'] = 60
             opts['retries'] = 3
+            # Separate video/audio downloads are muxed by the finishing pass
+            opts['defer_merge'] = True
+            
+            with self._download_ydls.checkout(**opts) as ydl:
+                info = self._download_with_info(ydl, url, ie_result)
             
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                ydl.download([resolved_url])
-                return self._find_downloaded_file(temp_dir)
+            self._seed_media_info(info)
+            streams = self._deferred_streams(info)
+            if streams:
+                inputs, output_path = streams
+                return self.postprocessor.finish(inputs, output_path)
+            return self._find_downloaded_file(temp_dir)
                 
         except Exception as e:
             logger.warning(f"Standard download failed: {e}")
             return None
     
+    @staticmethod
+    def _seed_media_info(info: Optional[dict]):
+        """Describe the downloaded files from the info dict, so they need no ffprobe"""
+        for entry in (info or {}).get('requested_downloads') or []:
+            for fmt in entry.get('requested_formats') or [entry]:
+                if fmt.get('filepath'):
+                    # Stream formats lack the duration of the whole video
+                    media_info_cache.seed(fmt['filepath'], dict(entry, **fmt))
     
-    
+    @staticmethod
+    def _deferred_streams(info: Optional[dict]) -> Optional[tuple]:
+        """(stream files, mp4 output path) of a merge left to the finishing pass"""
+        for entry in (info or {}).get('requested_downloads') or []:
+            inputs = [path for path in entry.get('deferred_merge') or [] if os.path.exists(path)]
+            if inputs and entry.get('filepath'):
+                return inputs, os.path.splitext(entry['filepath'])[0] + '.mp4'
+        return None
     
     def _find_downloaded_file(self, temp_dir: str) -> Optional[str]:
         """Find downloaded file or create slideshow if multiple images found"""
@@ -501,9 +681,8 @@ class VideoDownloader:
             
             # If we already have a video file, use it (yt-dlp may have created it)
             if video_files:
-                # Enhance audio quality for regular videos
-                enhanced_path = self.audio_enhancer.enhance_video_audio(video_files[0])
-                return enhanced_path if enhanced_path else video_files[0]
+                # Remux/re-encode only what Telegram can't play, enhance audio
+                return self.postprocessor.process(video_files[0])
             
             # Check if this is a TikTok photo download (multiple images + audio)
             if len(image_files) > 1:
@@ -524,8 +703,8 @@ class VideoDownloader:
         """Create slideshow from TikTok photos"""
         try:
             creator = SlideshowCreator()
+            creator.progress_callback = self.progress_callback
             slideshow_path = creator.create_slideshow(temp_dir)
-            creator.cleanup()
             
             if slideshow_path and os.path.exists(slideshow_path):
                 # Verify the created video is valid
@@ -557,25 +736,14 @@ class VideoDownloader:
                 logger.warning(f"Video file too small: {file_size} bytes")
                 return False
             
-            # Use ffprobe to verify video structure
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                '-show_streams', '-show_format', video_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+            # Verify video structure (probed once, see media_info)
+            info = media_info_cache.probe_sync(video_path)
             
-            if result.returncode == 0:
-                import json
-                data = json.loads(result.stdout)
-                
+            if info:
                 # Check if it has video stream
-                video_streams = [s for s in data.get('streams', []) if s.get('codec_type') == 'video']
-                
-                if video_streams:
-                    duration = float(data.get('format', {}).get('duration', 0))
-                    if duration > 0:
-                        logger.info(f"Video verified: {duration}s duration, {len(video_streams)} video streams")
+                if info.has_video:
+                    if info.duration > 0:
+                        logger.info(f"Video verified: {info.duration}s duration, {info.width}x{info.height}")
                         return True
                     else:
                         logger.warning("Video has no duration")
@@ -584,7 +752,7 @@ class VideoDownloader:
                     logger.warning("Video has no video streams")
                     return False
             else:
-                logger.warning(f"ffprobe failed: {result.stderr}")
+                logger.warning(f"ffprobe failed for {video_path}")
                 return False
                 
         except Exception as e:
@@ -609,7 +777,7 @@ class VideoDownloader:
             logger.error(f"Error finding fallback video: {e}")
             return None
     
-    def download_tiktok_images(self, url: str) -> Optional[list]:
+    def download_tiktok_images(self, url: str, temp_dir: Optional[str] = None) -> Optional[list]:
         """Download TikTok slideshow images and return their file paths (sorted).
         
         Returns a list of absolute image paths, or None on failure.
@@ -619,7 +787,7 @@ class VideoDownloader:
                 logger.info("download_tiktok_images called for non-TikTok-photo URL")
                 return None
             
-            temp_dir = tempfile.mkdtemp(dir=DOWNLOAD_DIR)
+            temp_dir = temp_dir or tempfile.mkdtemp(dir=DOWNLOAD_DIR)
             logger.info(f"Created temp dir for TikTok images: {temp_dir}")
             
             # Prefer gallery-dl for robust image extraction
@@ -653,6 +821,28 @@ class VideoDownloader:
             logger.error(f"Error downloading TikTok images: {e}")
             return None
     
+    def prepare_resume(self, temp_dir: str, stream_path: Optional[str] = None):
+        """Remove outputs of an interrupted job that would pass for finished files.
+        
+        yt-dlp continues from .part files on its own; a stream download
+        (written without .part) and half-written post-processing outputs are
+        deleted so they are produced again.
+        """
+        stale = glob.glob(os.path.join(glob.escape(temp_dir), '**', '*_processed.mp4'), recursive=True)
+        if stream_path and self._is_subpath(stream_path, temp_dir):
+            stale.append(stream_path)
+        for path in stale:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+                    logger.info(f"Removed incomplete output {path}")
+            except OSError as e:
+                logger.warning(f"Could not remove incomplete output {path}: {e}")
+    
+    def cleanup_dir(self, temp_dir: str):
+        """Remove a job temp directory under downloads"""
+        self._safe_rmtree(temp_dir)
+    
     def cleanup_file(self, file_path: str):
         """Clean up downloaded file and its temp directory tree under downloads."""
         try:
@@ -678,8 +868,6 @@ class VideoDownloader:
                 except Exception:
                     break
                 parent = os.path.dirname(parent)
-            # Clean up audio enhancer temp files
-            self.audio_enhancer.cleanup()
         except Exception as e:
             logger.error(f"Error cleaning up: {e}")
     
@@ -700,29 +888,29 @@ class VideoDownloader:
             top_temp_dir = self._get_top_temp_dir(file_paths[0])
             if top_temp_dir and os.path.isdir(top_temp_dir):
                 self._safe_rmtree(top_temp_dir)
-
-            # Clean up audio enhancer temp files
-            self.audio_enhancer.cleanup()
         except Exception as e:
             logger.error(f"Error cleaning up files: {e}")
 
+    async def get_video_info_async(self, url: str, timeout: float = INFO_TIMEOUT) -> Optional[dict]:
+        """Get video information off the event loop with a per-call timeout"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._info_executor, self.get_video_info, url)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # The worker thread finishes on its own (socket timeouts apply); only the wait is abandoned
+            logger.warning(f"Video info extraction timed out after {timeout}s: {url}")
+            if 'tiktok.com' in url:
+                return self._create_fallback_tiktok_info(url)
+            return None
+    
     def get_video_info(self, url: str) -> Optional[dict]:
         """Get video information with enhanced TikTok photo handling and robust error handling"""
         original_url = url
         
         try:
-            # Step 1: Resolve TikTok short URLs first
-            if 'vt.tiktok.com' in url or 'vm.tiktok.com' in url:
-                logger.info(f"Resolving TikTok short URL: {url}")
-                try:
-                    import requests
-                    response = requests.head(url, allow_redirects=True, timeout=15)
-                    resolved_url = response.url
-                    logger.info(f"Resolved TikTok URL: {url} -> {resolved_url}")
-                    url = resolved_url
-                except Exception as e:
-                    logger.warning(f"Could not resolve TikTok short URL {url}: {e}")
-                    # Continue with original URL as fallback
+            # Step 1: Resolve TikTok short URLs first (cached)
+            url = self.canonicalizer.canonicalize(url)
             
             # Step 2: Enhanced TikTok photo URL handling
             if self._is_tiktok_photo_url(url):
@@ -735,7 +923,11 @@ class VideoDownloader:
             # Try standard extraction
             info = self._try_standard_info_extraction(url)
             if info:
-                return self._format_video_info(info, original_url)
+                video_info = self._format_video_info(info, original_url)
+                # Handed to the download step so it need not extract again; the
+                # previous format selection is dropped like in --write-info-json
+                video_info['ie_result'] = yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+                return video_info
             
             # Fallback for TikTok - create basic info from URL
             if 'tiktok.com' in url:
@@ -755,16 +947,10 @@ class VideoDownloader:
     def _try_standard_info_extraction(self, url: str) -> Optional[dict]:
         """Try standard yt-dlp info extraction without cookies"""
         try:
-            info_opts = {
-                'quiet': True,
-                'format': 'bestvideo[filesize<2G]+bestaudio[ext=m4a]/bestvideo[filesize<2G]+bestaudio/best[filesize<2G]/best',
-                'socket_timeout': 30,
-                'retries': 2
-            }
-            
-            with yt_dlp.YoutubeDL(info_opts) as ydl:
+            with self._info_ydls.checkout() as ydl:
                 info = ydl.extract_info(url, download=False)
-                return info
+                # Plain JSON-safe dict, so it can be passed to a worker process
+                return ydl.sanitize_info(info)
                 
         except Exception as e:
             logger.warning(f"Standard info extraction failed: {e}")
@@ -803,7 +989,8 @@ class VideoDownloader:
                 'uploader': f"@{username}",
                 'duration': 15 if is_photo else 30,  # Estimate duration
                 'filesize': 10 * 1024 * 1024,  # Estimate 10MB
-                'description': f"TikTok content from @{username} (ID: {video_id})"
+                'description': f"TikTok content from @{username} (ID: {video_id})",
+                'media_key': self._media_key('TikTok', video_id if video_id.isdigit() else None)
             }
             
         except Exception as e:
@@ -825,16 +1012,15 @@ class VideoDownloader:
         elif 'tiktok.com' in original_url:
             title = f"🎵 {title}"
         
-        # Get filesize from the selected format
+        # Get filesize from the selected format (exact or estimated)
         filesize = 0
         if 'requested_formats' in info:
             # Multiple formats (video + audio)
             for fmt in info['requested_formats']:
-                if fmt.get('filesize'):
-                    filesize += fmt['filesize']
-        elif info.get('filesize'):
+                filesize += fmt.get('filesize') or fmt.get('filesize_approx') or 0
+        else:
             # Single format
-            filesize = info['filesize']
+            filesize = info.get('filesize') or info.get('filesize_approx') or 0
         
         # For TikTok photos, estimate slideshow filesize (typically larger due to processing)
         if self._is_tiktok_photo_url(original_url) and filesize > 0:
@@ -844,6 +1030,16 @@ class VideoDownloader:
             'title': title,
             'uploader': info.get('uploader', 'Unknown'),
             'duration': info.get('duration', 0),
+            'width': info.get('width') or 0,
+            'height': info.get('height') or 0,
             'filesize': filesize,
-            'description': info.get('description', '')[:200] + '...' if info.get('description') else ''
-        }
\ No newline at end of file
+            'description': info.get('description', '')[:200] + '...' if info.get('description') else '',
+            'media_key': self._media_key(info.get('extractor_key'), info.get('id'))
+        }
+    
+    @staticmethod
+    def _media_key(extractor_key: Optional[str], video_id) -> Optional[str]:
+        """Platform-wide identity of a video, used as the media cache key"""
+        if not extractor_key or not video_id:
+            return None
+        return f"{extractor_key}:{video_id}"
\ No newline at end of file
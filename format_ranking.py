@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Format ranking for Telegram delivery
+Picks the format (or video+audio pair) from an info dict's formats list that
+fits MAX_FILE_SIZE and can be stream-copied into an mp4 Telegram plays
+(H.264 + AAC), so the common case needs no re-encode. Formats that need
+transcoding are only chosen when nothing compatible is available.
+"""
+
+import logging
+from typing import Optional
+from yt_dlp.utils import get_compatible_ext
+from config import MAX_FILE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Codec prefixes Telegram clients play inline from an mp4
+COPY_VIDEO_CODECS = ('avc1', 'avc3', 'h264')
+COPY_AUDIO_CODECS = ('mp4a', 'aac')
+# Containers whose H.264/AAC streams need no remux at all
+MP4_EXTS = {'mp4', 'm4a', 'm4v', 'mov'}
+
+
+def _codec(fmt: dict, kind: str) -> Optional[str]:
+    """Lowercased codec of a format; None if unknown, 'none' if absent"""
+    value = fmt.get(f'{kind}codec')
+    return value.lower() if isinstance(value, str) else None
+
+
+def _has(fmt: dict, kind: str) -> bool:
+    return _codec(fmt, kind) != 'none'
+
+
+def _size(fmt: dict) -> Optional[int]:
+    return fmt.get('filesize') or fmt.get('filesize_approx') or None
+
+
+class FormatChoice:
+    """A single format or a video+audio pair and what delivering it costs"""
+    __slots__ = ('formats', 'size', 'video_copy', 'audio_copy')
+
+    def __init__(self, formats: tuple):
+        self.formats = formats
+        sizes = [_size(f) for f in formats]
+        self.size = sum(sizes) if all(sizes) else None
+        video = formats[0]
+        audio = formats[-1]
+        self.video_copy = self._copyable(video, 'v', COPY_VIDEO_CODECS)
+        self.audio_copy = self._copyable(audio, 'a', COPY_AUDIO_CODECS)
+
+    @staticmethod
+    def _copyable(fmt: dict, kind: str, codecs: tuple) -> bool:
+        codec = _codec(fmt, kind)
+        if codec is None:
+            # Extractor did not report codecs; an mp4 is almost always H.264/AAC
+            return fmt.get('ext') in MP4_EXTS
+        return codec.startswith(codecs)
+
+    @property
+    def needs_transcode(self) -> bool:
+        return not (self.video_copy and self.audio_copy)
+
+    def fits(self, max_size: int) -> bool:
+        return self.size is None or self.size <= max_size
+
+    def sort_key(self, max_size: int) -> tuple:
+        video = self.formats[0]
+        return (
+            self.fits(max_size),
+            self.video_copy,  # A video re-encode is the expensive part
+            self.audio_copy,
+            video.get('height') or 0,
+            len(self.formats) == 1,  # No merge step
+            str(video.get('protocol', '')).startswith('http'),
+            sum(f.get('tbr') or 0 for f in self.formats),
+        )
+
+    def to_format(self) -> dict:
+        """The format dict handed back to yt-dlp's format selection"""
+        if len(self.formats) == 1:
+            return self.formats[0]
+        video, audio = self.formats
+        if self.video_copy and self.audio_copy:
+            ext = 'mp4'
+        else:
+            ext = get_compatible_ext(vcodecs=[video.get('vcodec')], acodecs=[audio.get('acodec')],
+                                     vexts=[video['ext']], aexts=[audio['ext']])
+        merged = {
+            'requested_formats': [video, audio],
+            'format': f"{video.get('format')}+{audio.get('format')}",
+            'format_id': f"{video['format_id']}+{audio['format_id']}",
+            'ext': ext,
+            'protocol': f"{video.get('protocol')}+{audio.get('protocol')}",
+            'filesize_approx': self.size,
+            'tbr': (video.get('tbr') or video.get('vbr') or 0) + (audio.get('tbr') or audio.get('abr') or 0),
+        }
+        for key in ('width', 'height', 'resolution', 'fps', 'dynamic_range', 'vcodec', 'vbr', 'aspect_ratio'):
+            merged[key] = video.get(key)
+        for key in ('acodec', 'abr', 'asr', 'audio_channels'):
+            merged[key] = audio.get(key)
+        return merged
+
+    @property
+    def format_id(self) -> str:
+        return '+'.join(str(f.get('format_id')) for f in self.formats)
+
+    def describe(self) -> str:
+        size = f"{self.size / 1024 / 1024:.1f}MB" if self.size else 'unknown size'
+        work = 'transcode' if self.needs_transcode else 'copy'
+        return f"{self.format_id} ({self.formats[0].get('height') or '?'}p, {size}, {work})"
+
+
+def rank_formats(formats: list, max_size: int = MAX_FILE_SIZE) -> list:
+    """All usable formats and video+audio pairs, best first"""
+    usable = [f for f in formats if not f.get('has_drm') and (_has(f, 'v') or _has(f, 'a'))
+              and f.get('ext') not in ('mhtml', 'none')]
+    complete = [f for f in usable if _has(f, 'v') and _has(f, 'a')]
+    videos = [f for f in usable if _has(f, 'v') and not _has(f, 'a')]
+    audios = [f for f in usable if _has(f, 'a') and not _has(f, 'v')]
+
+    choices = [FormatChoice((f,)) for f in complete]
+    choices += [FormatChoice((v, a)) for v in videos for a in audios]
+    if not choices:
+        # Audio-only or video-only sources
+        choices = [FormatChoice((f,)) for f in usable]
+    choices.sort(key=lambda choice: choice.sort_key(max_size), reverse=True)
+
+    if choices and not choices[0].fits(max_size):
+        # Nothing fits; the smallest one at least has a chance after compression
+        choices.sort(key=lambda choice: choice.size or 0)
+    return choices
+
+
+class TelegramFormatSelector:
+    """Callable yt-dlp 'format' option backed by rank_formats()"""
+
+    def __init__(self, max_size: int = MAX_FILE_SIZE, preferred_format: Optional[str] = None):
+        self.max_size = max_size
+        self.preferred_format = preferred_format  # e.g. the format a partial download used
+
+    def __call__(self, ctx: dict):
+        formats = ctx.get('formats') or []
+        choices = rank_formats(formats, self.max_size)
+        if not choices:
+            if formats:
+                yield formats[-1]  # yt-dlp sorts formats worst to best
+            return
+        best = choices[0]
+        if self.preferred_format:
+            preferred = next((choice for choice in choices if choice.format_id == self.preferred_format), None)
+            if preferred:
+                logger.info(f"Keeping format {preferred.describe()}")
+                yield preferred.to_format()
+                return
+            logger.info(f"Format {self.preferred_format} is no longer offered, selecting again")
+        if best.needs_transcode:
+            logger.info(f"No stream-copyable format, will transcode: {best.describe()}")
+        else:
+            logger.info(f"Selected format {best.describe()}")
+        yield best.to_format()
+
+    def __repr__(self):
+        return f"TelegramFormatSelector(max_size={self.max_size}, preferred_format={self.preferred_format!r})"
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Persistent journal of running download jobs
+Each job that reaches the download stage is recorded with its URL, chosen
+format, temp directory and stage, so that after a crash or restart the bot
+can pick it up again from the partial files left in that directory.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+from typing import Optional
+from config import JOB_JOURNAL_FILE
+
+logger = logging.getLogger(__name__)
+
+
+class JournalEntry:
+    """One unfinished job as recorded in the journal"""
+    __slots__ = ('journal_id', 'url', 'canonical_url', 'user_id', 'source_chat_id', 'source_msg_id',
+                 'action', 'format_id', 'temp_dir', 'stage', 'stream_path', 'file_path', 'video_info')
+
+    def __init__(self, journal_id: int, url: str, canonical_url: Optional[str], user_id: int,
+                 source_chat_id, source_msg_id, action: Optional[str], format_id: Optional[str],
+                 temp_dir: str, stage: str, stream_path: Optional[str], file_path: Optional[str],
+                 video_info: Optional[str]):
+        self.journal_id = journal_id
+        self.url = url
+        self.canonical_url = canonical_url
+        self.user_id = user_id
+        self.source_chat_id = source_chat_id
+        self.source_msg_id = source_msg_id
+        self.action = action
+        self.format_id = format_id
+        self.temp_dir = temp_dir
+        self.stage = stage
+        self.stream_path = stream_path
+        self.file_path = file_path
+        try:
+            self.video_info = json.loads(video_info) if video_info else None
+        except ValueError:
+            self.video_info = None
+
+    def __repr__(self):
+        return f"JournalEntry({self.journal_id}, stage={self.stage!r}, url={self.url!r})"
+
+
+class JobJournal:
+    """SQLite-backed journal; one small indexed write per stage change"""
+
+    def __init__(self, path: str = JOB_JOURNAL_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                journal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                canonical_url TEXT,
+                user_id INTEGER NOT NULL,
+                source_chat_id INTEGER,
+                source_msg_id INTEGER,
+                action TEXT,
+                format_id TEXT,
+                temp_dir TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                stream_path TEXT,
+                file_path TEXT,
+                video_info TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def start(self, task_info, temp_dir: str, format_id: Optional[str] = None) -> int:
+        """Record a job entering the download stage; returns its journal id"""
+        now = time.time()
+        cursor = self._db.execute(
+            "INSERT INTO jobs (url, canonical_url, user_id, source_chat_id, source_msg_id, action, "
+            "format_id, temp_dir, stage, video_info, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'download', ?, ?, ?)",
+            (task_info.url, task_info.canonical_url, task_info.user_id, task_info.source_chat_id,
+             task_info.source_msg_id, task_info.action, format_id, temp_dir,
+             json.dumps(task_info.video_info) if task_info.video_info else None, now, now)
+        )
+        return cursor.lastrowid
+
+    def update(self, journal_id: int, **fields):
+        """Update stage, stream_path and/or file_path of a job"""
+        allowed = {'stage', 'stream_path', 'file_path'}
+        unknown = set(fields) - allowed
+        if unknown:
+            raise ValueError(f"Unknown journal fields: {', '.join(sorted(unknown))}")
+        if not fields:
+            return
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._db.execute(f"UPDATE jobs SET {assignments}, updated_at = ? WHERE journal_id = ?",
+                         (*fields.values(), time.time(), journal_id))
+
+    def finish(self, journal_id: int):
+        """Forget a job that completed, failed or was cancelled"""
+        self._db.execute("DELETE FROM jobs WHERE journal_id = ?", (journal_id,))
+
+    def unfinished(self) -> list:
+        """Jobs left behind by a previous run, oldest first"""
+        rows = self._db.execute(
+            "SELECT journal_id, url, canonical_url, user_id, source_chat_id, source_msg_id, action, "
+            "format_id, temp_dir, stage, stream_path, file_path, video_info FROM jobs ORDER BY journal_id"
+        ).fetchall()
+        return [JournalEntry(*row) for row in rows]
+
+    def temp_dirs(self) -> set:
+        """Temp directories that still belong to a journaled job"""
+        return {row[0] for row in self._db.execute("SELECT temp_dir FROM jobs")}
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def close(self):
+        self._db.close()
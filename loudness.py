@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Loudness analysis for audio enhancement
+Decodes only the audio track to 48 kHz PCM and measures integrated
+loudness, true peak and loudness range (ITU-R BS.1770 / EBU R128) with
+NumPy. Audio that already meets the target is left alone; the rest is
+normalized by a linear loudnorm pass fed with the real measurements. The
+same decode also measures the track through the enhancement EQ, since that
+is what the loudnorm after the EQ sees.
+Results are cached in SQLite by a hash of the file contents.
+
+NumPy is optional: without it analysis is unavailable and the fixed
+enhancement chain is used as before.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+from typing import Optional
+from config import LOUDNESS_CACHE_FILE
+from media_farm import run_ffmpeg
+from audio_enhancer import AudioEnhancer
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Delivery target, same as the enhancement chain's loudnorm
+TARGET_I = -14.0
+TARGET_TP = -1.0
+TARGET_LRA = 7.0
+# Integrated loudness this close to the target counts as already normalized
+TOLERANCE_LU = 1.5
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+SUB_BLOCK = SAMPLE_RATE // 10  # 100 ms; gating blocks are 4, short-term windows 30 of these
+ABSOLUTE_GATE = -70.0
+OVERSAMPLE = 4  # For the true-peak estimate
+HASH_SAMPLE = 1024 * 1024
+ANALYSIS_TIMEOUT = 600
+
+# BS.1770 K-weighting at 48 kHz: high-shelf pre-filter, then RLB high-pass
+_K_STAGES = (
+    ((1.53512485958697, -2.69169618940638, 1.19839281085285), (1.0, -1.69065929318241, 0.73248077421585)),
+    ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621)),
+)
+
+
+def available() -> bool:
+    return np is not None
+
+
+def content_hash(path: str) -> str:
+    """Hash of the size and the head, middle and tail of a file.
+
+    Reading three samples instead of the whole file keeps this cheap for
+    large videos while still telling different downloads apart.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - HASH_SAMPLE // 2), max(0, size - HASH_SAMPLE)}):
+            f.seek(offset)
+            digest.update(f.read(HASH_SAMPLE))
+    return digest.hexdigest()
+
+
+def _lufs(power):
+    return -0.691 + 10 * np.log10(power)
+
+
+class LoudnessStats:
+    """Measurements of one audio track; integrated is None for silence.
+
+    equalized holds the same measurements of the track after the
+    enhancement EQ, when they were taken.
+    """
+    __slots__ = ('integrated', 'true_peak', 'lra', 'threshold', 'equalized')
+
+    def __init__(self, integrated: Optional[float], true_peak: float, lra: float, threshold: float,
+                 equalized: Optional['LoudnessStats'] = None):
+        self.integrated = integrated
+        self.true_peak = true_peak
+        self.lra = lra
+        self.threshold = threshold
+        self.equalized = equalized
+
+    def within_target(self) -> bool:
+        """Loud enough and without peaks above the ceiling.
+
+        LRA is not checked: a linear loudnorm pass applies one gain and
+        would not change it anyway.
+        """
+        if self.integrated is None:
+            return True  # Silence; nothing to normalize
+        return abs(self.integrated - TARGET_I) <= TOLERANCE_LU and self.true_peak <= TARGET_TP
+
+    def loudnorm_filter(self) -> str:
+        """Single-pass linear loudnorm using these measurements"""
+        return (f"loudnorm=I={TARGET_I}:TP={TARGET_TP}:LRA={TARGET_LRA}"
+                f":measured_I={self.integrated:.2f}:measured_TP={self.true_peak:.2f}"
+                f":measured_LRA={self.lra:.2f}:measured_thresh={self.threshold:.2f}:linear=true")
+
+    def __repr__(self):
+        integrated = f"{self.integrated:.1f} LUFS" if self.integrated is not None else 'silent'
+        return f"LoudnessStats({integrated}, TP {self.true_peak:.1f} dBTP, LRA {self.lra:.1f} LU)"
+
+
+def _response(stages, z):
+    """Frequency response of cascaded biquads (b, a) at z = exp(-j*w)"""
+    response = np.ones_like(z)
+    for b, a in stages:
+        response *= (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    return response
+
+
+class _Meter:
+    """Incremental BS.1770 meter fed with interleaved float32 stereo PCM.
+
+    K-weighting is applied per 100 ms sub-block in the frequency domain,
+    which is accurate to a few hundredths of an LU for loudness purposes.
+    filter_stages, if given, are biquads applied to the signal first, the
+    same way; the peak is then the inter-sample estimate only, since the
+    filtered block edges ring.
+    """
+
+    def __init__(self, filter_stages=()):
+        self._pending = b''
+        self._powers = []  # K-weighted mean square per sub-block, summed over channels
+        self._peak = 0.0
+        self._mono = True  # Upmixed mono has identical channels and counts once
+        self.error = None
+        frequencies = np.fft.rfftfreq(SUB_BLOCK, 1 / SAMPLE_RATE)
+        z = np.exp(-2j * np.pi * frequencies / SAMPLE_RATE)
+        self._filter = _response(filter_stages, z) if filter_stages else None
+        # Parseval weights for a one-sided spectrum of an even-length block
+        parseval = np.full(len(frequencies), 2.0)
+        parseval[0] = parseval[-1] = 1.0
+        self._weights = np.abs(_response(_K_STAGES, z)) ** 2 * parseval / SUB_BLOCK ** 2
+
+    def feed(self, data: bytes):
+        try:
+            self._feed(data)
+        except Exception as e:
+            # The process runner only logs callback errors; remember it for result()
+            self.error = e
+            raise
+
+    def _feed(self, data: bytes):
+        data = self._pending + data
+        frame_bytes = 4 * CHANNELS * SUB_BLOCK
+        usable = len(data) - len(data) % frame_bytes
+        self._pending = data[usable:]
+        if usable:
+            samples = np.frombuffer(data[:usable], dtype='<f4').reshape(-1, SUB_BLOCK, CHANNELS)
+            self._add(samples)
+
+    def _add(self, blocks):
+        if self._mono and not np.array_equal(blocks[:, :, 0], blocks[:, :, 1]):
+            self._mono = False
+        spectra = np.fft.rfft(blocks, axis=1)
+        if self._filter is not None:
+            spectra = spectra * self._filter[None, :, None]
+            peak = self._oversampled_peak(spectra)
+        else:
+            peak = max(float(np.abs(blocks).max()), self._oversampled_peak(spectra))
+        self._powers.extend((np.abs(spectra) ** 2 * self._weights[None, :, None]).sum(axis=1).tolist())
+        self._peak = max(self._peak, peak)
+
+    @staticmethod
+    def _oversampled_peak(spectra) -> float:
+        """Inter-sample peak estimate, ignoring block edges where FFT resampling rings"""
+        upsampled = np.fft.irfft(spectra, n=SUB_BLOCK * OVERSAMPLE, axis=1) * OVERSAMPLE
+        edge = SUB_BLOCK * OVERSAMPLE // 8
+        return float(np.abs(upsampled[:, edge:-edge]).max())
+
+    def result(self) -> Optional[LoudnessStats]:
+        if not self._powers:
+            return None
+        channels = np.asarray(self._powers)
+        sub_blocks = channels[:, 0] if self._mono else channels.sum(axis=1)
+        true_peak = 20 * np.log10(self._peak) if self._peak > 0 else -144.0
+
+        integrated, threshold = self._integrated(sub_blocks)
+        return LoudnessStats(integrated, float(true_peak), self._range(sub_blocks), threshold)
+
+    @staticmethod
+    def _windows(sub_blocks, size: int):
+        """Mean power of each window of size sub-blocks, hopping one sub-block"""
+        if len(sub_blocks) < size:
+            return sub_blocks.mean(keepdims=True)
+        sums = np.cumsum(np.concatenate(([0.0], sub_blocks)))
+        return (sums[size:] - sums[:-size]) / size
+
+    def _integrated(self, sub_blocks) -> tuple:
+        blocks = self._windows(sub_blocks, 4)  # 400 ms, 75% overlap
+        gated = blocks[_lufs(np.maximum(blocks, 1e-20)) > ABSOLUTE_GATE]
+        if not len(gated):
+            return None, ABSOLUTE_GATE
+        threshold = float(_lufs(gated.mean())) - 10
+        gated = gated[_lufs(gated) > threshold]
+        return float(_lufs(gated.mean())), threshold
+
+    def _range(self, sub_blocks) -> float:
+        windows = self._windows(sub_blocks, 30)  # 3 s short-term loudness
+        loudness = _lufs(np.maximum(windows, 1e-20))
+        loudness = loudness[loudness > ABSOLUTE_GATE]
+        if len(loudness) < 2:
+            return 0.0
+        relative = float(_lufs(np.power(10, (loudness + 0.691) / 10).mean())) - 20
+        loudness = loudness[loudness > relative]
+        if len(loudness) < 2:
+            return 0.0
+        low, high = np.percentile(loudness, [10, 95])
+        return float(high - low)
+
+
+class LoudnessAnalyzer:
+    """Measure audio loudness once per content hash"""
+
+    def __init__(self, path: str = LOUDNESS_CACHE_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS loudness (
+                content_hash TEXT PRIMARY KEY,
+                integrated REAL,
+                true_peak REAL NOT NULL,
+                lra REAL NOT NULL,
+                threshold REAL NOT NULL,
+                measured_at REAL NOT NULL
+            )
+        """)
+
+    def analyze(self, media_path: str) -> Optional[LoudnessStats]:
+        """Loudness of the first audio track of a file, with and without the EQ; None if it cannot be measured"""
+        if np is None:
+            return None
+        try:
+            key = content_hash(media_path)
+        except OSError as e:
+            logger.warning(f"Could not hash {media_path}: {e}")
+            return None
+        # The EQ'd measurement is only valid for the EQ it was taken with
+        equalized_key = f"{key}:{hashlib.sha256(AudioEnhancer.eq_filter().encode()).hexdigest()[:16]}"
+        stats, equalized = self._cached(key), self._cached(equalized_key)
+        if stats is not None and equalized is not None:
+            stats.equalized = equalized
+            logger.info(f"Loudness of {os.path.basename(media_path)} (cached): {stats}")
+            return stats
+
+        stats = self.measure(media_path)
+        if stats is not None and stats.equalized is not None:
+            self._store(key, stats)
+            self._store(equalized_key, stats.equalized)
+        return stats
+
+    def _cached(self, key: str) -> Optional[LoudnessStats]:
+        row = self._db.execute("SELECT integrated, true_peak, lra, threshold FROM loudness WHERE content_hash = ?",
+                               (key,)).fetchone()
+        return LoudnessStats(*row) if row else None
+
+    def _store(self, key: str, stats: LoudnessStats):
+        self._db.execute("INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?, ?)",
+                         (key, stats.integrated, stats.true_peak, stats.lra, stats.threshold, time.time()))
+
+    @staticmethod
+    def measure(media_path: str) -> Optional[LoudnessStats]:
+        """Decode the audio track to PCM once and measure it as is and through the enhancement EQ"""
+        meters = (_Meter(), _Meter(AudioEnhancer.eq_stages(SAMPLE_RATE)))
+
+        def feed(data: bytes):
+            for meter in meters:
+                meter.feed(data)
+
+        # Default log level: the farm reads ffmpeg's -benchmark CPU report, logged at info
+        cmd = ['ffmpeg', '-hide_banner', '-nostats', '-nostdin', '-i', media_path, '-map', '0:a:0', '-vn', '-sn', '-dn',
+               '-ac', str(CHANNELS), '-ar', str(SAMPLE_RATE), '-f', 'f32le', 'pipe:1']
+        result = run_ffmpeg(cmd, 'analysis', timeout=ANALYSIS_TIMEOUT, capture_stdout=False, on_stdout_chunk=feed)
+        if not result.ok:
+            logger.warning(f"Loudness analysis failed: {'timed out' if result.timed_out else result.stderr}")
+            return None
+        error = next((meter.error for meter in meters if meter.error is not None), None)
+        if error is not None:
+            logger.warning(f"Loudness analysis failed: {error}")
+            return None
+        stats, equalized = (meter.result() for meter in meters)
+        if stats is not None:
+            stats.equalized = equalized
+        logger.info(f"Loudness of {os.path.basename(media_path)}: {stats}, after EQ {equalized} "
+                    f"in {result.elapsed:.1f}s")
+        return stats
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Persistent URL -> Telegram media cache
+Maps a platform video ("<extractor_key>:<id>") to the message and document
+it was last sent as, so a repeat link is re-sent by reference instead of
+being downloaded and uploaded again.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+from typing import Optional
+from telethon.tl.types import InputDocument
+from config import MEDIA_CACHE_FILE, MEDIA_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+
+class CachedMedia:
+    """One cached document and the message it came from"""
+    __slots__ = ('key', 'chat_id', 'message_id', 'document_id', 'access_hash',
+                 'file_reference', 'file_size', 'hits')
+
+    def __init__(self, key: str, chat_id: int, message_id: int, document_id: int,
+                 access_hash: int, file_reference: bytes, file_size: int = 0, hits: int = 0):
+        self.key = key
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.document_id = document_id
+        self.access_hash = access_hash
+        self.file_reference = file_reference
+        self.file_size = file_size
+        self.hits = hits
+
+    def input_document(self) -> InputDocument:
+        return InputDocument(id=self.document_id, access_hash=self.access_hash,
+                             file_reference=self.file_reference)
+
+    def __repr__(self):
+        return f"CachedMedia({self.key!r}, chat={self.chat_id}, msg={self.message_id})"
+
+
+class MediaCache:
+    """SQLite-backed cache with least-recently-used eviction.
+
+    Each call is a single indexed statement on a small WAL database, cheap
+    enough to run on the event loop.
+    """
+
+    def __init__(self, path: str = MEDIA_CACHE_FILE, max_entries: int = MEDIA_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS media (
+                key TEXT PRIMARY KEY,
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                document_id INTEGER NOT NULL,
+                access_hash INTEGER NOT NULL,
+                file_reference BLOB NOT NULL,
+                file_size INTEGER NOT NULL DEFAULT 0,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS media_last_used ON media (last_used)")
+
+    def get(self, key: str) -> Optional[CachedMedia]:
+        """Look up a key and mark it as recently used"""
+        row = self._db.execute(
+            "SELECT key, chat_id, message_id, document_id, access_hash, file_reference, file_size, hits "
+            "FROM media WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._db.execute("UPDATE media SET hits = hits + 1, last_used = ? WHERE key = ?", (time.time(), key))
+        return CachedMedia(*row)
+
+    def put(self, key: str, chat_id: int, message_id: int, document) -> Optional[CachedMedia]:
+        """Remember the document of a sent message; evicts the oldest entries when full"""
+        if document is None or not hasattr(document, 'access_hash'):
+            return None
+        now = time.time()
+        entry = CachedMedia(key, chat_id, message_id, document.id, document.access_hash,
+                            bytes(document.file_reference or b''), getattr(document, 'size', 0) or 0)
+        self._db.execute(
+            "INSERT INTO media (key, chat_id, message_id, document_id, access_hash, file_reference, "
+            "file_size, hits, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET chat_id = excluded.chat_id, message_id = excluded.message_id, "
+            "document_id = excluded.document_id, access_hash = excluded.access_hash, "
+            "file_reference = excluded.file_reference, file_size = excluded.file_size, "
+            "last_used = excluded.last_used",
+            (key, chat_id, message_id, entry.document_id, entry.access_hash,
+             entry.file_reference, entry.file_size, now, now)
+        )
+        self._evict()
+        return entry
+
+    def delete(self, key: str):
+        """Forget a key (e.g. the cached message was deleted)"""
+        self._db.execute("DELETE FROM media WHERE key = ?", (key,))
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+
+    def stats(self) -> dict:
+        """Entry count and hit/miss counters since startup"""
+        return {
+            'entries': len(self),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def close(self):
+        self._db.close()
+
+    def _evict(self):
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM media WHERE key IN (SELECT key FROM media ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+            logger.info(f"Evicted {excess} least recently used media cache entries")
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+CPU-aware ffmpeg worker farm
+Encode concurrency and per-process -threads are sized from the container's
+CPU quota (cgroup v2 cpu.max or v1 cfs quota, else the affinity mask). The
+bot process owns the farm; download workers ask it for a slot over their
+result pipe before starting ffmpeg and wait for the grant, so encodes from
+all jobs share one priority queue. Cheap work (analysis, remux) goes first;
+waiting raises a job's priority so transcodes are not starved.
+
+Outside a download worker (no farm connected) a local semaphore of the
+same size is used instead.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+import contextlib
+from typing import Callable, Optional
+from config import FFMPEG_SLOTS, FFMPEG_THREADS
+from process_runner import run_process_sync
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+PRIORITIES = {
+    'analysis': 0,   # Audio-only decode for loudness measurement
+    'remux': 1,
+    'audio': 2,
+    'slideshow': 3,
+    'transcode': 4,
+}
+DEFAULT_PRIORITY = 2
+# Seconds of waiting that count as one priority level
+AGING_SECONDS = 30.0
+# Printed by ffmpeg -benchmark at exit: its own getrusage(RUSAGE_SELF)
+_BENCH_LINE = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s')
+
+
+def cpu_quota() -> float:
+    """CPUs this process may use: cgroup quota if set, else the affinity mask"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            return max(0.1, int(quota) / int(period))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return max(0.1, quota / period)
+    except (OSError, ValueError):
+        pass
+    if hasattr(os, 'sched_getaffinity'):
+        return float(len(os.sched_getaffinity(0)))
+    return float(os.cpu_count() or 1)
+
+
+def plan_farm(cpus: float, slots: int = FFMPEG_SLOTS, threads: int = FFMPEG_THREADS) -> tuple:
+    """(concurrent encodes, ffmpeg -threads each); 0 means derive from cpus.
+
+    x264 scales well to a few threads but not to a whole machine, so by
+    default two threads per encode and as many encodes as that fills.
+    """
+    cpus = max(1, int(cpus))
+    if slots <= 0:
+        slots = max(1, cpus // 2)
+    if threads <= 0:
+        threads = max(1, cpus // slots)
+    return slots, threads
+
+
+def with_threads(cmd: list, threads: int) -> list:
+    """Insert -threads as an output option, before the output path"""
+    return cmd[:-1] + ['-threads', str(threads), cmd[-1]]
+
+
+def with_benchmark(cmd: list) -> list:
+    """Make ffmpeg report its own CPU time on stderr when it exits"""
+    return cmd[:1] + ['-benchmark'] + cmd[1:]
+
+
+class _Request:
+    __slots__ = ('job_id', 'kind', 'priority', 'grant', 'queued_at')
+
+    def __init__(self, job_id: str, kind: str, grant: Callable):
+        self.job_id = job_id
+        self.kind = kind
+        self.priority = PRIORITIES.get(kind, DEFAULT_PRIORITY)
+        self.grant = grant
+        self.queued_at = time.monotonic()
+
+    def effective_priority(self, now: float) -> float:
+        return self.priority - (now - self.queued_at) / AGING_SECONDS
+
+
+class MediaWorkerFarm:
+    """Slots for ffmpeg processes, granted by priority (runs on the event loop)"""
+
+    def __init__(self, cpus: Optional[float] = None, slots: int = FFMPEG_SLOTS, threads: int = FFMPEG_THREADS):
+        self.cpus = cpus if cpus is not None else cpu_quota()
+        self.slots, self.threads = plan_farm(self.cpus, slots, threads)
+        self._queue = []  # _Request, in arrival order
+        self._running = {}  # job_id -> (kind, started_at)
+        self._started_at = time.monotonic()
+        # Metrics
+        self.busy_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.kinds = {}  # kind -> {'count', 'wait', 'busy'}
+        logger.info(f"ffmpeg farm: {self.cpus:g} CPUs -> {self.slots} slots x {self.threads} threads")
+
+    def request(self, job_id: str, kind: str, grant: Callable):
+        """Queue a job for a slot; grant(threads) is called when it gets one"""
+        self._queue.append(_Request(job_id, kind, grant))
+        self._dispatch()
+
+    def release(self, job_id: str, cpu_seconds: float = 0.0):
+        """A job's ffmpeg finished; hand its slot to the next one"""
+        running = self._running.pop(job_id, None)
+        if running is None:
+            return
+        kind, started = running
+        busy = time.monotonic() - started
+        self.busy_seconds += busy
+        self.cpu_seconds += cpu_seconds
+        self._kind(kind)['busy'] += busy
+        self._dispatch()
+
+    def forget(self, job_id: str):
+        """Drop the slot and queued requests of a worker that exited or was killed"""
+        self._queue = [r for r in self._queue if r.job_id != job_id]
+        self.release(job_id)
+
+    def handle(self, job_id: str, grant: Callable, op: str, *args):
+        """Apply a 'farm' message from a download worker"""
+        if op == 'acquire':
+            self.request(job_id, args[0], grant)
+        elif op == 'release':
+            self.release(job_id, *args)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        uptime = max(1e-6, now - self._started_at)
+        busy = self.busy_seconds + sum(now - started for _kind, started in self._running.values())
+        return {
+            'cpus': self.cpus,
+            'slots': self.slots,
+            'threads': self.threads,
+            'running': len(self._running),
+            'queued': len(self._queue),
+            'utilization': busy / (self.slots * uptime),  # Share of slot time in use
+            'cpu_utilization': self.cpu_seconds / (self.cpus * uptime),  # Of finished encodes
+            'kinds': {kind: dict(entry) for kind, entry in self.kinds.items()},
+        }
+
+    def _kind(self, kind: str) -> dict:
+        return self.kinds.setdefault(kind, {'count': 0, 'wait': 0.0, 'busy': 0.0})
+
+    def _dispatch(self):
+        while self._queue and len(self._running) < self.slots:
+            now = time.monotonic()
+            request = min(self._queue, key=lambda r: r.effective_priority(now))
+            self._queue.remove(request)
+            entry = self._kind(request.kind)
+            entry['count'] += 1
+            entry['wait'] += now - request.queued_at
+            self._running[request.job_id] = (request.kind, now)
+            try:
+                request.grant(self.threads)
+            except Exception as e:
+                logger.debug(f"Could not grant ffmpeg slot to {request.job_id}: {e}")
+                self._running.pop(request.job_id, None)
+
+
+class FarmClient:
+    """Worker-process side: ask the bot's farm for a slot and wait for the grant"""
+
+    def __init__(self, send: Callable, grant_conn):
+        self._send = send
+        self._grant_conn = grant_conn
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def slot(self, job: 'MediaJob'):
+        with self._lock:
+            self._send('farm', ('acquire', job.kind))
+            try:
+                threads = self._grant_conn.recv()
+            except (EOFError, OSError):
+                threads = _local.threads  # Bot went away; the result will not arrive anyway
+            try:
+                yield threads
+            finally:
+                self._send('farm', ('release', job.cpu_seconds))
+
+
+class _LocalGate:
+    """Fallback for processes without a farm: a plain semaphore, no priorities"""
+
+    def __init__(self):
+        self.slots, self.threads = plan_farm(cpu_quota())
+        self._semaphore = threading.BoundedSemaphore(self.slots)
+
+    @contextlib.contextmanager
+    def slot(self, job: 'MediaJob'):
+        with self._semaphore:
+            yield self.threads
+
+
+_local = _LocalGate()
+_client = None
+
+
+def connect(client: Optional[FarmClient]):
+    """Route this process's ffmpeg jobs through the bot's farm"""
+    global _client
+    _client = client
+
+
+class MediaJob:
+    """State of one ffmpeg job: its kind, temp outputs, timings and CPU time.
+
+    Each call site creates its own, so concurrent jobs never share the
+    list of files to clean up.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.temp_files = []
+        self.threads = None
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.cpu_seconds = 0.0  # Of this job's ffmpeg runs only, as reported by -benchmark
+
+    def track(self, path: str) -> str:
+        """Remember a temp output to delete if the job does not consume it"""
+        self.temp_files.append(path)
+        return path
+
+    def keep(self, path: str):
+        """Stop tracking a temp output that became the job's result"""
+        if path in self.temp_files:
+            self.temp_files.remove(path)
+
+    def run(self, cmd: list, on_stderr_line: Optional[Callable] = None, **kwargs):
+        """Run an ffmpeg command once the farm grants a slot; returns its ProcessResult.
+
+        CPU time is read from ffmpeg's own -benchmark report rather than
+        RUSAGE_CHILDREN, which would also count every other ffmpeg the
+        process finished meanwhile. It stays 0 if ffmpeg is killed.
+        """
+        def on_line(line: str):
+            match = _BENCH_LINE.search(line)
+            if match:
+                self.cpu_seconds += float(match.group(1)) + float(match.group(2))
+            if on_stderr_line:
+                on_stderr_line(line)
+
+        gate = _client or _local
+        queued = time.monotonic()
+        with gate.slot(self) as threads:
+            started = time.monotonic()
+            self.wait_seconds = started - queued
+            self.threads = threads
+            if self.wait_seconds > 1:
+                logger.info(f"ffmpeg {self.kind} job waited {self.wait_seconds:.1f}s for a slot")
+            try:
+                return run_process_sync(with_benchmark(with_threads(cmd, threads)), on_stderr_line=on_line, **kwargs)
+            finally:
+                self.run_seconds = time.monotonic() - started
+
+    def cleanup(self):
+        for path in self.temp_files:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not clean up {path}: {e}")
+        self.temp_files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+def run_ffmpeg(cmd: list, kind: str, **kwargs):
+    """Run one ffmpeg command through the farm"""
+    with MediaJob(kind) as job:
+        return job.run(cmd, **kwargs)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Probe-once media information shared by all pipeline stages
+A MediaInfo is produced by a single look at the file (the in-process MP4
+box parser, ffprobe for other containers, or straight from the yt-dlp info
+dict when it already names codecs, size and duration) and cached by
+path, keyed on the file's mtime and size. Stages that write a new file
+update the entry in place instead of probing their own output again.
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+import mp4_boxes
+from process_runner import probe, probe_sync
+
+logger = logging.getLogger(__name__)
+
+# ffprobe format_name of mp4/mov files
+MP4_FORMAT_NAMES = {'mov', 'mp4', 'm4a', '3gp', '3g2', 'mj2'}
+MP4_CONTAINER = 'mov,mp4,m4a,3gp,3g2,mj2'
+# yt-dlp ext -> ffprobe format_name
+EXT_CONTAINERS = {
+    'mp4': MP4_CONTAINER, 'm4a': MP4_CONTAINER, 'm4v': MP4_CONTAINER, 'mov': MP4_CONTAINER,
+    'webm': 'matroska,webm', 'mkv': 'matroska,webm', 'flv': 'flv', 'ts': 'mpegts',
+}
+# yt-dlp codec string prefixes -> ffprobe codec_name
+CODEC_NAMES = (
+    ('avc', 'h264'), ('h264', 'h264'), ('hvc1', 'hevc'), ('hev1', 'hevc'), ('h265', 'hevc'),
+    ('vp09', 'vp9'), ('vp9', 'vp9'), ('vp08', 'vp8'), ('vp8', 'vp8'), ('av01', 'av1'),
+    ('mp4a', 'aac'), ('aac', 'aac'), ('opus', 'opus'), ('vorbis', 'vorbis'), ('mp3', 'mp3'),
+    ('ac-3', 'ac3'), ('ec-3', 'eac3'), ('flac', 'flac'),
+)
+MAX_ENTRIES = 256
+
+
+def _codec_name(value) -> Optional[str]:
+    """ffprobe name of a yt-dlp codec string; '' if absent, None if unknown"""
+    if not isinstance(value, str):
+        return None
+    value = value.lower()
+    if value == 'none':
+        return ''
+    return next((name for prefix, name in CODEC_NAMES if value.startswith(prefix)), None)
+
+
+class MediaInfo:
+    """Streams, container and geometry of one media file"""
+    __slots__ = ('path', 'size', 'mtime', 'vcodec', 'acodec', 'container', 'duration',
+                 'width', 'height', 'faststart', 'source')
+
+    def __init__(self, path: Optional[str], vcodec: Optional[str], acodec: Optional[str], container: str,
+                 duration: float, width: int = 0, height: int = 0, source: str = 'ffprobe',
+                 faststart: Optional[bool] = None):
+        self.path = path
+        self.vcodec = vcodec
+        self.acodec = acodec
+        self.container = container
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.faststart = faststart  # moov before mdat; None if unknown
+        self.source = source  # 'mp4_boxes', 'ffprobe', 'info_dict' or the stage that wrote the file
+        self.size = None
+        self.mtime = None
+        if path:
+            self.stat()
+
+    @classmethod
+    def from_ffprobe(cls, path: Optional[str], data: dict) -> 'MediaInfo':
+        streams = data.get('streams', [])
+        video = next((s for s in streams if s.get('codec_type') == 'video'
+                      and not (s.get('disposition') or {}).get('attached_pic')), None)
+        audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+        fmt = data.get('format', {})
+        try:
+            duration = float(fmt.get('duration') or 0)
+        except ValueError:
+            duration = 0.0
+        return cls(path,
+                   video.get('codec_name') if video else None,
+                   audio.get('codec_name') if audio else None,
+                   fmt.get('format_name', ''), duration,
+                   (video.get('width') or 0) if video else 0,
+                   (video.get('height') or 0) if video else 0)
+
+    @classmethod
+    def from_mp4_boxes(cls, path: str) -> Optional['MediaInfo']:
+        """Describe an MP4/MOV file without ffprobe; None for other containers"""
+        parsed = mp4_boxes.parse(path)
+        if parsed is None:
+            return None
+        return cls(path, parsed['vcodec'], parsed['acodec'], MP4_CONTAINER, parsed['duration'],
+                   parsed['width'], parsed['height'], source='mp4_boxes', faststart=parsed['faststart'])
+
+    @classmethod
+    def from_info_dict(cls, path: str, info: dict) -> Optional['MediaInfo']:
+        """Build from a yt-dlp format/info dict; None if it lacks anything a probe gives"""
+        vcodec = _codec_name(info.get('vcodec'))
+        acodec = _codec_name(info.get('acodec'))
+        container = EXT_CONTAINERS.get(info.get('ext'))
+        duration = info.get('duration')
+        if vcodec is None or acodec is None or container is None or not duration:
+            return None
+        width, height = info.get('width') or 0, info.get('height') or 0
+        if vcodec and not (width and height):
+            return None
+        faststart = mp4_boxes.is_faststart(path) if container == MP4_CONTAINER else None
+        return cls(path, vcodec or None, acodec or None, container, float(duration),
+                   width, height, source='info_dict', faststart=faststart)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'MediaInfo':
+        info = cls(None, data['vcodec'], data['acodec'], data['container'], data['duration'],
+                   data['width'], data['height'], data['source'], data.get('faststart'))
+        info.path, info.size, info.mtime = data['path'], data['size'], data['mtime']
+        return info
+
+    def to_dict(self) -> dict:
+        """Plain dict for sending to another process"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def stat(self):
+        """Record the size and mtime the information belongs to"""
+        st = os.stat(self.path)
+        self.size, self.mtime = st.st_size, st.st_mtime_ns
+
+    def is_current(self) -> bool:
+        """Whether the file on disk is still the one described"""
+        try:
+            st = os.stat(self.path)
+        except (OSError, TypeError):
+            return False
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime
+
+    @property
+    def is_mp4(self) -> bool:
+        return bool(MP4_FORMAT_NAMES & set(self.container.split(',')))
+
+    @property
+    def has_video(self) -> bool:
+        return self.vcodec is not None
+
+    @property
+    def has_audio(self) -> bool:
+        return self.acodec is not None
+
+    def __repr__(self):
+        return (f"MediaInfo(v={self.vcodec}, a={self.acodec}, container={self.container!r}, "
+                f"{self.width}x{self.height}, {self.duration:.1f}s, faststart={self.faststart}, from {self.source})")
+
+
+class MediaInfoCache:
+    """Path -> MediaInfo, valid while the file keeps its mtime and size"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Metrics
+        self.hits = 0
+        self.parsed = 0
+        self.probes = 0
+        self.seeded = 0
+
+    def get(self, path: str) -> Optional[MediaInfo]:
+        """Cached information about path, if the file has not changed since"""
+        key = os.path.abspath(path)
+        with self._lock:
+            info = self._entries.get(key)
+        if info is None:
+            return None
+        if not info.is_current():
+            self.discard(path)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        return info
+
+    def put(self, info: MediaInfo) -> MediaInfo:
+        with self._lock:
+            key = os.path.abspath(info.path)
+            self._entries[key] = info
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return info
+
+    def discard(self, path: str):
+        with self._lock:
+            self._entries.pop(os.path.abspath(path), None)
+
+    def seed(self, path: str, info_dict: dict) -> Optional[MediaInfo]:
+        """Fill the entry for a downloaded file from its yt-dlp info dict, without probing"""
+        if not path or not os.path.exists(path) or self.get(path):
+            return None
+        info = MediaInfo.from_info_dict(path, info_dict)
+        if info is None:
+            return None
+        with self._lock:
+            self.seeded += 1
+        return self.put(info)
+
+    def moved(self, info: MediaInfo, new_path: str, source: str, **fields) -> MediaInfo:
+        """Update info in place for the file a stage wrote from it (changed fields given)"""
+        if info.path:
+            self.discard(info.path)
+        for name, value in fields.items():
+            setattr(info, name, value)
+        info.path = new_path
+        info.source = source
+        info.stat()
+        return self.put(info)
+
+    def probe_sync(self, path: str) -> Optional[MediaInfo]:
+        """Cached information, probing the file at most once; None if ffprobe fails"""
+        info = self.get(path) or self._parse(path)
+        if info is not None:
+            return info
+        data = probe_sync(path)
+        with self._lock:
+            self.probes += 1
+        if not data:
+            logger.warning(f"ffprobe failed for {path}")
+            return None
+        return self.put(MediaInfo.from_ffprobe(path, data))
+
+    async def probe(self, path: str) -> Optional[MediaInfo]:
+        """Async variant of probe_sync() for the event loop"""
+        info = self.get(path) or self._parse(path)
+        if info is not None:
+            return info
+        data = await probe(path)
+        with self._lock:
+            self.probes += 1
+        if not data:
+            logger.warning(f"ffprobe failed for {path}")
+            return None
+        return self.put(MediaInfo.from_ffprobe(path, data))
+
+    def _parse(self, path: str) -> Optional[MediaInfo]:
+        """MP4s are read in-process; only other containers need ffprobe"""
+        info = MediaInfo.from_mp4_boxes(path)
+        if info is None:
+            return None
+        with self._lock:
+            self.parsed += 1
+        return self.put(info)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'parsed': self.parsed,
+                    'probes': self.probes, 'seeded': self.seeded}
+
+
+# One cache per process; download workers hand their entries to the parent
+media_info_cache = MediaInfoCache()
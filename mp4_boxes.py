@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Minimal ISO-BMFF (MP4/MOV) box parser
+Reads only box headers and the few small boxes that hold duration, track
+codecs and dimensions (mvhd, tkhd, mdhd, hdlr, stsd, and esds for mp4a
+audio) through mmap, so describing a file costs a handful of page reads
+instead of an ffprobe process. Anything it does not understand returns
+None and callers fall back to ffprobe.
+"""
+
+import mmap
+import struct
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Box types that may start an ISO-BMFF file
+LEADING_BOXES = {b'ftyp', b'styp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pdin'}
+# Boxes whose payload is a list of child boxes, on the way to the ones we read
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'mvex'}
+# Sample entry fourcc -> ffprobe codec_name (mp4a is resolved from its esds)
+SAMPLE_CODECS = {
+    b'avc1': 'h264', b'avc3': 'h264', b'hvc1': 'hevc', b'hev1': 'hevc', b'vp09': 'vp9', b'vp08': 'vp8',
+    b'av01': 'av1', b'mp4v': 'mpeg4', b'Opus': 'opus', b'ac-3': 'ac3', b'ec-3': 'eac3',
+    b'fLaC': 'flac', b'.mp3': 'mp3',
+}
+# esds DecoderConfigDescriptor objectTypeIndication of an mp4a entry -> ffprobe codec_name
+AUDIO_OBJECT_TYPES = {0x40: 'aac', 0x66: 'aac', 0x67: 'aac', 0x68: 'aac', 0x69: 'mp3', 0x6B: 'mp3'}
+# Bytes of AudioSampleEntry fields before its child boxes, by QuickTime sound description version
+AUDIO_ENTRY_SIZES = {0: 36, 1: 52, 2: 72}
+
+
+class BoxError(ValueError):
+    """Raised for truncated or inconsistent boxes"""
+
+
+def _boxes(buf, start: int, end: int):
+    """Yield (type, payload start, box end) of the boxes in buf[start:end]"""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', buf, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise BoxError('truncated largesize')
+            size = struct.unpack_from('>Q', buf, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset  # Extends to the end of the parent
+        if size < header or offset + size > end:
+            raise BoxError(f"bad size {size} for {box_type!r} at {offset}")
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def _find(buf, start: int, end: int, box_type: bytes) -> Optional[tuple]:
+    for found, payload, box_end in _boxes(buf, start, end):
+        if found == box_type:
+            return payload, box_end
+    return None
+
+
+def _full_box_times(buf, payload: int) -> tuple:
+    """(timescale, duration) of an mvhd or mdhd box"""
+    version = buf[payload]
+    if version == 1:
+        return struct.unpack_from('>IQ', buf, payload + 4 + 16)
+    return struct.unpack_from('>II', buf, payload + 4 + 8)
+
+
+def _descriptor(buf, offset: int, end: int) -> tuple:
+    """(tag, payload start, payload end) of an MPEG-4 descriptor with its variable-length size"""
+    tag = buf[offset]
+    size = 0
+    offset += 1
+    for _ in range(4):
+        byte = buf[offset]
+        offset += 1
+        size = size << 7 | byte & 0x7F
+        if not byte & 0x80:
+            break
+    if offset + size > end:
+        raise BoxError(f"descriptor {tag:#x} overruns its box")
+    return tag, offset, offset + size
+
+
+def _mp4a_codec(buf, entry: int, entry_end: int) -> Optional[str]:
+    """Codec of an mp4a sample entry from its esds objectTypeIndication; None if unknown"""
+    children = entry + AUDIO_ENTRY_SIZES.get(struct.unpack_from('>H', buf, entry + 16)[0], 36)
+    esds = _find(buf, children, entry_end, b'esds')
+    if not esds:
+        wave = _find(buf, children, entry_end, b'wave')  # QuickTime keeps it one level down
+        esds = wave and _find(buf, *wave, b'esds')
+    if not esds:
+        return None
+    tag, payload, end = _descriptor(buf, esds[0] + 4, esds[1])
+    if tag == 0x03:  # ES_Descriptor: ES_ID, flags, then optional fields
+        flags = buf[payload + 2]
+        payload += 3
+        if flags & 0x80:
+            payload += 2  # dependsOn_ES_ID
+        if flags & 0x40:
+            payload += 1 + buf[payload]  # URL
+        if flags & 0x20:
+            payload += 2  # OCR_ES_ID
+        tag, payload, end = _descriptor(buf, payload, end)
+    if tag != 0x04:  # DecoderConfigDescriptor
+        return None
+    return AUDIO_OBJECT_TYPES.get(buf[payload])
+
+
+def _parse_track(buf, start: int, end: int) -> Optional[dict]:
+    mdia = _find(buf, start, end, b'mdia')
+    if not mdia:
+        return None
+    hdlr = _find(buf, *mdia, b'hdlr')
+    mdhd = _find(buf, *mdia, b'mdhd')
+    if not hdlr or not mdhd:
+        return None
+    handler = bytes(buf[hdlr[0] + 8:hdlr[0] + 12])
+    timescale, duration = _full_box_times(buf, mdhd[0])
+    track = {'handler': handler, 'duration': duration / timescale if timescale else 0.0,
+             'codec': None, 'width': 0, 'height': 0}
+
+    minf = _find(buf, *mdia, b'minf')
+    stbl = minf and _find(buf, *minf, b'stbl')
+    stsd = stbl and _find(buf, *stbl, b'stsd')
+    if stsd and struct.unpack_from('>I', buf, stsd[0] + 4)[0] > 0:
+        entry = stsd[0] + 8
+        fourcc = bytes(buf[entry + 4:entry + 8])
+        track['codec'] = SAMPLE_CODECS.get(fourcc, fourcc)
+        if fourcc == b'mp4a':
+            # MP3 and other MPEG-4 audio share this fourcc; None sends the file to ffprobe
+            entry_end = entry + struct.unpack_from('>I', buf, entry)[0]
+            track['codec'] = _mp4a_codec(buf, entry, min(entry_end, stsd[1]))
+        if handler == b'vide':
+            # VisualSampleEntry: 8 byte header, 8 reserved/index, 16 pre-defined, then width/height
+            track['width'], track['height'] = struct.unpack_from('>HH', buf, entry + 32)
+    if handler == b'vide' and not (track['width'] and track['height']):
+        tkhd = _find(buf, start, end, b'tkhd')
+        if tkhd:
+            dims = tkhd[0] + (88 if buf[tkhd[0]] == 1 else 76)
+            width, height = struct.unpack_from('>II', buf, dims)
+            track['width'], track['height'] = width >> 16, height >> 16
+    return track
+
+
+def _top_level(buf) -> dict:
+    """Offsets of the first moov and mdat boxes"""
+    if len(buf) < 8 or bytes(buf[4:8]) not in LEADING_BOXES:
+        raise BoxError('not an ISO-BMFF file')
+    found = {}
+    for box_type, payload, box_end in _boxes(buf, 0, len(buf)):
+        if box_type in (b'moov', b'mdat', b'moof') and box_type not in found:
+            found[box_type] = (payload, box_end)
+        if b'moov' in found and (b'mdat' in found or b'moof' in found):
+            break
+    return found
+
+
+def _faststart(found: dict) -> Optional[bool]:
+    if b'moov' not in found:
+        return None
+    media = [found[key][0] for key in (b'mdat', b'moof') if key in found]
+    return not media or found[b'moov'][0] < min(media)
+
+
+def parse(path: str) -> Optional[dict]:
+    """Describe an MP4/MOV file like a minimal ffprobe, or None if unsupported.
+
+    Returns vcodec and acodec (ffprobe names, None for a missing stream),
+    duration in seconds, width, height and faststart (moov before the media).
+    """
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            found = _top_level(buf)
+            if b'moov' not in found:
+                return None
+            moov = found[b'moov']
+            mvhd = _find(buf, *moov, b'mvhd')
+            if not mvhd:
+                return None
+            timescale, duration = _full_box_times(buf, mvhd[0])
+            if not duration:
+                # Fragmented files keep the total in mvex/mehd
+                mvex = _find(buf, *moov, b'mvex')
+                mehd = mvex and _find(buf, *mvex, b'mehd')
+                if mehd:
+                    fmt = '>Q' if buf[mehd[0]] == 1 else '>I'
+                    duration = struct.unpack_from(fmt, buf, mehd[0] + 4)[0]
+            tracks = [_parse_track(buf, payload, box_end)
+                      for box_type, payload, box_end in _boxes(buf, *moov) if box_type == b'trak']
+            faststart = _faststart(found)
+    except (OSError, ValueError, struct.error, IndexError) as e:
+        logger.debug(f"MP4 box parse of {path} failed: {e}")
+        return None
+
+    tracks = [track for track in tracks if track]
+    video = next((t for t in tracks if t['handler'] == b'vide'), None)
+    audio = next((t for t in tracks if t['handler'] == b'soun'), None)
+    if not duration or not timescale:
+        duration = max((t['duration'] for t in tracks), default=0.0)
+    else:
+        duration /= timescale
+    for track in (video, audio):
+        if track and not isinstance(track['codec'], str):
+            return None  # Unknown or encrypted sample entry; let ffprobe name it
+    if not duration or (video and not (video['width'] and video['height'])):
+        return None
+    return {
+        'vcodec': video['codec'] if video else None,
+        'acodec': audio['codec'] if audio else None,
+        'duration': float(duration),
+        'width': video['width'] if video else 0,
+        'height': video['height'] if video else 0,
+        'faststart': faststart,
+    }
+
+
+def is_faststart(path: str) -> Optional[bool]:
+    """Whether moov precedes the media data; None if not an MP4 or no moov yet"""
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return _faststart(_top_level(buf))
+    except (OSError, ValueError, struct.error, IndexError):
+        return None
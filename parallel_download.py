@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Parallel downloading for yt-dlp
+Large progressive (single-file HTTP) formats are fetched as byte ranges over
+several connections into a preallocated file. Segmented DASH/HLS formats
+use yt-dlp's own concurrent fragment downloads (concurrent_fragment_downloads).
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import yt_dlp
+from yt_dlp.downloader.common import FileDownloader
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.postprocessor import FFmpegMergerPP
+from yt_dlp.utils import DownloadError
+from config import DOWNLOAD_CONNECTIONS
+
+logger = logging.getLogger(__name__)
+
+# Progressive files smaller than this are not worth splitting
+MIN_SPLIT_SIZE = 16 * 1024 * 1024
+# Ranges are handed out in chunks so fast connections take more of the file
+MIN_CHUNK_SIZE = 2 * 1024 * 1024
+READ_BLOCK = 256 * 1024
+PROGRESS_INTERVAL = 0.25
+
+
+class RangeSplitFD(FileDownloader):
+    """Download one HTTP resource as concurrent byte ranges"""
+
+    FD_NAME = 'rangesplit'
+
+    @staticmethod
+    def can_download(info_dict: dict, params: dict) -> bool:
+        """Whether a selected format should be split into ranges"""
+        if DOWNLOAD_CONNECTIONS < 2 or params.get('nopart') or params.get('test'):
+            return False  # nopart: the file is tailed while downloading and must grow in order
+        if info_dict.get('protocol') not in ('http', 'https') or info_dict.get('is_live'):
+            return False
+        if info_dict.get('requested_formats') or not str(info_dict.get('url', '')).startswith('http'):
+            return False
+        size = info_dict.get('filesize') or info_dict.get('filesize_approx') or 0
+        return size >= MIN_SPLIT_SIZE
+
+    def real_download(self, filename, info_dict):
+        url = info_dict['url']
+        headers = dict(info_dict.get('http_headers') or {})
+        total = self._probe_size(url, headers)
+        if not total:
+            # No range support; use yt-dlp's regular single-connection download
+            fd = HttpFD(self.ydl, self.params)
+            for hook in self._progress_hooks[1:]:
+                fd.add_progress_hook(hook)
+            return fd.real_download(filename, info_dict)
+
+        tmpfilename = self.temp_name(filename)
+        ranges_path = tmpfilename + '.ranges'
+        self.report_destination(filename)
+        chunk_size = max(MIN_CHUNK_SIZE, -(-total // (DOWNLOAD_CONNECTIONS * 4)))
+        chunks = [(start, min(start + chunk_size, total) - 1) for start in range(0, total, chunk_size)]
+
+        # Chunks finished by an interrupted earlier run are kept
+        done = set()
+        if self.params.get('continuedl', True) and os.path.exists(tmpfilename):
+            done = self._load_done_chunks(ranges_path, total, chunk_size)
+        pending = [chunk for chunk in chunks if chunk[0] not in done]
+        connections = min(DOWNLOAD_CONNECTIONS, len(pending)) or 1
+        if done:
+            logger.info(f"Resuming range-split download: {len(done)}/{len(chunks)} chunks already on disk")
+        logger.info(f"Range-split download of {total} bytes in {len(pending)} chunks over {connections} connections")
+
+        state = {'downloaded': sum(end - start + 1 for start, end in chunks if start in done),
+                 'next': 0, 'last_report': 0.0}
+        lock = threading.Lock()
+        started = time.time()
+
+        def report(status: str):
+            downloaded = state['downloaded']
+            elapsed = time.time() - started
+            self._hook_progress({
+                'status': status,
+                'downloaded_bytes': downloaded,
+                'total_bytes': total,
+                'filename': filename,
+                'tmpfilename': tmpfilename,
+                'elapsed': elapsed,
+                'speed': self.calc_speed(started, time.time(), downloaded),
+                'eta': self.calc_eta(started, time.time(), total, downloaded),
+            }, info_dict)
+
+        with open(tmpfilename, 'r+b' if done else 'wb') as f, open(ranges_path, 'a' if done else 'w') as journal:
+            if not done:
+                self._preallocate(f.fileno(), total)
+                journal.write(f"{total} {chunk_size}\n")
+                journal.flush()
+
+            def worker():
+                while True:
+                    with lock:
+                        if state['next'] >= len(pending):
+                            return
+                        start, end = pending[state['next']]
+                        state['next'] += 1
+                    self._download_range(url, headers, f.fileno(), start, end, on_bytes)
+                    with lock:
+                        journal.write(f"{start}\n")
+                        journal.flush()
+
+            def on_bytes(count: int):
+                with lock:
+                    state['downloaded'] += count
+                    now = time.time()
+                    if now - state['last_report'] < PROGRESS_INTERVAL:
+                        return
+                    state['last_report'] = now
+                    report('downloading')
+
+            with ThreadPoolExecutor(max_workers=connections, thread_name_prefix='range') as executor:
+                futures = [executor.submit(worker) for _ in range(connections)]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    with lock:
+                        state['next'] = len(pending)  # Stop the other workers
+                    raise
+
+        os.remove(ranges_path)
+        self.try_rename(tmpfilename, filename)
+        self._hook_progress({
+            'status': 'finished',
+            'downloaded_bytes': total,
+            'total_bytes': total,
+            'filename': filename,
+            'elapsed': time.time() - started,
+        }, info_dict)
+        return True
+
+    def _probe_size(self, url: str, headers: dict):
+        """Total size if the server answers range requests, else None"""
+        try:
+            response = self.ydl.urlopen(Request(url, headers={**headers, 'Range': 'bytes=0-0'}))
+            try:
+                content_range = response.headers.get('Content-Range', '')
+                if response.status != 206 or '/' not in content_range:
+                    return None
+                total = content_range.rsplit('/', 1)[1]
+                return int(total) if total.isdigit() else None
+            finally:
+                response.close()
+        except Exception as e:
+            logger.info(f"Range probe failed, using a single connection: {e}")
+            return None
+
+    def _download_range(self, url: str, headers: dict, fd: int, start: int, end: int, on_bytes):
+        """Fetch bytes start..end (inclusive) and write them at their offset"""
+        retries = self.params.get('retries', 10)
+        attempt = 0
+        position = start
+        while True:
+            try:
+                request = Request(url, headers={**headers, 'Range': f'bytes={position}-{end}'})
+                response = self.ydl.urlopen(request)
+                try:
+                    if response.status != 206:
+                        raise DownloadError(f"Server ignored range request (HTTP {response.status})")
+                    while position <= end:
+                        data = response.read(min(READ_BLOCK, end - position + 1))
+                        if not data:
+                            raise OSError(f"Connection closed at byte {position} of range {start}-{end}")
+                        os.pwrite(fd, data, position)
+                        position += len(data)
+                        on_bytes(len(data))
+                finally:
+                    response.close()
+                return
+            except DownloadError:
+                raise
+            except Exception as e:
+                attempt += 1
+                if attempt > retries:
+                    raise DownloadError(f"Range {start}-{end} failed: {e}") from e
+                self.report_retry(e, attempt, retries)
+                time.sleep(min(2 ** attempt, 30) / 4)
+
+    @staticmethod
+    def _load_done_chunks(ranges_path: str, total: int, chunk_size: int) -> set:
+        """Start offsets of the chunks a previous run completed (empty if unusable)"""
+        try:
+            with open(ranges_path) as f:
+                header = f.readline().split()
+                if header != [str(total), str(chunk_size)]:
+                    return set()  # Different file or chunking; start over
+                # A line cut short by a crash has no newline and is ignored
+                return {int(line) for line in f if line.endswith('\n') and line.strip().isdigit()}
+        except (OSError, ValueError):
+            return set()
+
+    @staticmethod
+    def _preallocate(fd: int, size: int):
+        """Reserve the whole file up front so ranges can be written in any order"""
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, size)
+
+
+class ParallelYoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL that hands large progressive formats to RangeSplitFD.
+
+    With the 'defer_merge' param, video+audio formats are left as separate
+    files instead of being merged by FFmpegMergerPP; the downloaded paths are
+    returned in the info dict's 'deferred_merge' so the caller's finishing
+    pass can mux them while it processes them anyway.
+    """
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if subtitle or test or not RangeSplitFD.can_download(info, self.params):
+            return super().dl(name, info, subtitle=subtitle, test=test)
+
+        fd = RangeSplitFD(self, self.params)
+        for hook in self._progress_hooks:
+            fd.add_progress_hook(hook)
+        new_info = self._copy_infodict(info)
+        if new_info.get('http_headers') is None:
+            new_info['http_headers'] = self._calc_headers(new_info)
+        return fd.download(name, new_info, subtitle)
+
+    def post_process(self, filename, info, files_to_move=None):
+        if self.params.get('defer_merge') and info.get('__files_to_merge'):
+            info['__postprocessors'] = [pp for pp in info.get('__postprocessors') or []
+                                        if not isinstance(pp, FFmpegMergerPP)]
+            info['deferred_merge'] = info.pop('__files_to_merge')
+        return super().post_process(filename, info, files_to_move)
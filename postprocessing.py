@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Codec-aware post-processing of downloaded videos
+Looks the file up in the MediaInfo cache (probing it at most once) and
+runs the cheapest ffmpeg pass that makes it a Telegram-playable mp4:
+nothing, a -c copy remux, an audio-only re-encode (also used for audio
+enhancement, unless loudness analysis finds the audio already on target)
+or, as a last resort, a full transcode. Separately downloaded video and
+audio streams are merged in that same pass.
+"""
+
+import os
+import logging
+import threading
+from typing import Optional
+import loudness as loudness_analysis
+from audio_enhancer import AudioEnhancer
+from media_info import MediaInfo, MP4_CONTAINER, media_info_cache
+from process_runner import ffmpeg_progress_parser
+from media_farm import MediaJob
+
+logger = logging.getLogger(__name__)
+
+ACTION_NONE = 'none'
+ACTION_REMUX = 'remux'
+ACTION_AUDIO = 'audio'
+ACTION_TRANSCODE = 'transcode'
+ACTIONS = (ACTION_NONE, ACTION_REMUX, ACTION_AUDIO, ACTION_TRANSCODE)
+
+# Codecs Telegram plays inline from an mp4
+PLAYABLE_VIDEO_CODECS = {'h264'}
+PLAYABLE_AUDIO_CODECS = {'aac'}
+PROCESS_TIMEOUT = 1800
+
+
+def choose_action(probe: MediaInfo, enhance_audio: bool = False) -> str:
+    """Cheapest action that leaves a playable mp4 (with enhanced audio if asked)"""
+    if probe.vcodec is not None and probe.vcodec not in PLAYABLE_VIDEO_CODECS:
+        return ACTION_TRANSCODE
+    if probe.acodec is not None and (enhance_audio or probe.acodec not in PLAYABLE_AUDIO_CODECS):
+        return ACTION_AUDIO
+    if not probe.is_mp4 or probe.faststart is False:
+        # A moov after the media keeps Telegram from playing it before the download ends
+        return ACTION_REMUX
+    return ACTION_NONE
+
+
+class PostProcessStats:
+    """Per-action counters: jobs, ffmpeg CPU seconds and media seconds"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._actions = {action: {'count': 0, 'cpu': 0.0, 'media': 0.0} for action in ACTIONS}
+
+    def record(self, action: str, cpu_seconds: float, media_seconds: float):
+        with self._lock:
+            entry = self._actions.setdefault(action, {'count': 0, 'cpu': 0.0, 'media': 0.0})
+            entry['count'] += 1
+            entry['cpu'] += cpu_seconds
+            entry['media'] += media_seconds
+
+    def stats(self) -> dict:
+        """Snapshot plus the estimated CPU seconds saved by not transcoding everything"""
+        with self._lock:
+            actions = {action: dict(entry) for action, entry in self._actions.items()}
+        transcode = actions.get(ACTION_TRANSCODE, {})
+        saved = None
+        if transcode.get('media'):
+            rate = transcode['cpu'] / transcode['media']  # CPU seconds per media second
+            saved = sum(entry['media'] * rate - entry['cpu']
+                        for action, entry in actions.items() if action != ACTION_TRANSCODE)
+        return {'actions': actions, 'cpu_saved': saved}
+
+
+class MediaPostProcessor:
+    """Probe a downloaded file and run the cheapest post-processing pass"""
+
+    def __init__(self, enhance_audio: bool = True):
+        self.enhance_audio = enhance_audio
+        self._loudness = None  # LoudnessAnalyzer, opened on first use
+        self.progress_callback = None  # callback(phase, current, total)
+        self.result_callback = None  # callback(action, cpu_seconds, media_seconds)
+
+    def process(self, input_path: str) -> str:
+        """Post-process a file; returns the resulting path (the input on failure)"""
+        base, _ext = os.path.splitext(input_path)
+        return self.finish([input_path], f"{base}.mp4") or input_path
+
+    def finish(self, inputs: list, output_path: str) -> Optional[str]:
+        """Turn the downloaded file(s) into output_path in a single ffmpeg pass.
+
+        inputs is one file or the separate video and audio downloads of a
+        merged format; the merge, the audio filters and +faststart share one
+        invocation so the media is read and written once. If that pass fails
+        on separate streams they are merged with -c copy instead. The inputs
+        are removed on success. Returns the final path, or None on failure.
+        """
+        probes = []
+        for path in inputs:
+            info = media_info_cache.probe_sync(path)
+            if info is None:
+                return None
+            probes.append(info)
+        probe, video_index, audio_index = self._combine(probes)
+        enhance, loudness = self._plan_enhancement(inputs[audio_index] if audio_index is not None else None)
+        action = choose_action(probe, enhance)
+        names = ' + '.join(os.path.basename(path) for path in inputs)
+        logger.info(f"Post-processing {names}: {probe} -> {action}")
+
+        if action == ACTION_NONE:
+            self._record(action, 0.0, probe.duration)
+            return inputs[0]
+
+        temp_path = f"{os.path.splitext(output_path)[0]}_processed.mp4"
+        audio_args = self._audio_args(action, probe, enhance, loudness)
+        cmd = self._command(inputs, video_index, audio_index, self._video_args(action) + audio_args, temp_path)
+
+        on_progress = None
+        if self.progress_callback and probe.duration:
+            on_progress = ffmpeg_progress_parser(probe.duration, lambda done, total: self.progress_callback('process', done, total))
+
+        with MediaJob(action) as job:
+            job.track(temp_path)
+            result = job.run(cmd, timeout=PROCESS_TIMEOUT, capture_stdout=False, on_stdout_line=on_progress)
+
+            if not result.ok or not self._verify(temp_path):
+                logger.error(f"Post-processing ({action}) failed: {'timed out' if result.timed_out else result.stderr}")
+                if len(inputs) < 2:
+                    return None
+                # Both streams are on disk; a plain merge still delivers the video
+                action, audio_args = ACTION_REMUX, ['-c:a', 'copy']
+                cmd = self._command(inputs, video_index, audio_index, ['-c', 'copy'], temp_path)
+                result = job.run(cmd, timeout=PROCESS_TIMEOUT, capture_stdout=False, on_stdout_line=on_progress)
+                if not result.ok or not self._verify(temp_path):
+                    logger.error(f"Merging {names} failed: {'timed out' if result.timed_out else result.stderr}")
+                    return None
+            os.replace(temp_path, output_path)
+
+        for path in inputs:
+            if os.path.abspath(path) != os.path.abspath(output_path) and os.path.exists(path):
+                os.remove(path)
+            media_info_cache.discard(path)
+        # What was written is known from the command; no need to probe the output
+        media_info_cache.moved(probe, output_path, 'postprocess', container=MP4_CONTAINER, faststart=True,
+                          vcodec='h264' if action == ACTION_TRANSCODE else probe.vcodec,
+                          acodec='aac' if audio_args[:2] == ['-c:a', 'aac'] else probe.acodec)
+        logger.info(f"Post-processing ({action}) done in {job.run_seconds:.1f}s with {job.threads} threads, "
+                    f"{job.cpu_seconds:.1f}s CPU")
+        self._record(action, job.cpu_seconds, probe.duration)
+        return output_path
+
+    @staticmethod
+    def _combine(probes: list) -> tuple:
+        """Merged view of the inputs plus the input index of the video and audio stream"""
+        video_index = next((i for i, p in enumerate(probes) if p.vcodec is not None), None)
+        audio_index = next((i for i, p in enumerate(probes) if p.acodec is not None), None)
+        if len(probes) == 1:
+            return probes[0], video_index, audio_index
+        video = probes[video_index] if video_index is not None else None
+        # Separate streams always need muxing, so the merged view has no container
+        probe = MediaInfo(None, video.vcodec if video else None,
+                          probes[audio_index].acodec if audio_index is not None else None,
+                          '', max(p.duration for p in probes),
+                          video.width if video else 0, video.height if video else 0, source='merge')
+        return probe, video_index, audio_index
+
+    @staticmethod
+    def _command(inputs: list, video_index: Optional[int], audio_index: Optional[int], codec_args: list,
+                 output_path: str) -> list:
+        """ffmpeg command writing the chosen streams of inputs to a faststart mp4"""
+        cmd = ['ffmpeg', '-y']
+        for path in inputs:
+            cmd += ['-i', path]
+        if video_index is not None:
+            cmd += ['-map', f'{video_index}:v:0']
+        if audio_index is not None:
+            cmd += ['-map', f'{audio_index}:a:0']
+        cmd += ['-dn', '-sn'] + codec_args
+        return cmd + ['-movflags', '+faststart', '-progress', 'pipe:1', '-nostats', output_path]
+
+    def _video_args(self, action: str) -> list:
+        if action == ACTION_TRANSCODE:
+            return ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p']
+        return ['-c:v', 'copy']
+
+    def _plan_enhancement(self, audio_path: Optional[str]) -> tuple:
+        """(enhance, LoudnessStats or None) for the input holding the audio track"""
+        if not self.enhance_audio or audio_path is None:
+            return False, None
+        loudness = self._measure_loudness(audio_path)
+        if loudness is not None and loudness.within_target():
+            logger.info(f"Audio already within loudness target ({loudness}), not enhancing")
+            return False, loudness
+        return True, loudness
+
+    def _measure_loudness(self, audio_path: str):
+        """LoudnessStats of the audio track, or None if analysis is unavailable"""
+        if not loudness_analysis.available():
+            return None
+        if self._loudness is None:
+            self._loudness = loudness_analysis.LoudnessAnalyzer()
+        return self._loudness.analyze(audio_path)
+
+    def _audio_args(self, action: str, probe: MediaInfo, enhance: bool, loudness=None) -> list:
+        if probe.acodec is None:
+            return []
+        if action in (ACTION_AUDIO, ACTION_TRANSCODE):
+            if enhance:
+                return AudioEnhancer.audio_args(loudness)
+            if probe.acodec not in PLAYABLE_AUDIO_CODECS:
+                return ['-c:a', 'aac', '-b:a', '192k']
+        return ['-c:a', 'copy']
+
+    @staticmethod
+    def _verify(path: str) -> bool:
+        """The output exists and is not empty.
+
+        Every -map names a stream the inputs are known to have, so ffmpeg
+        already fails when one of them cannot be written.
+        """
+        return os.path.exists(path) and os.path.getsize(path) >= 1024
+
+    def _record(self, action: str, cpu_seconds: float, media_seconds: float):
+        if self.result_callback:
+            try:
+                self.result_callback(action, cpu_seconds, media_seconds)
+            except Exception as e:
+                logger.debug(f"Post-processing result callback failed: {e}")
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Async process runner for ffmpeg, ffprobe and gallery-dl
+Streams output instead of buffering it, enforces timeouts and kills the
+child when the caller is cancelled.
+"""
+
+import re
+import time
+import json
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Lines of stderr kept per process; ffmpeg can print megabytes of it
+STDERR_TAIL_LINES = 50
+_LINE_SPLIT = re.compile(rb'[\r\n]')
+
+
+class ProcessResult:
+    """Outcome of a finished (or killed) process"""
+
+    def __init__(self, cmd: list, returncode: Optional[int], stdout: str, stderr_tail: list,
+                 elapsed: float, timed_out: bool = False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr_tail = stderr_tail
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out
+
+    @property
+    def stderr(self) -> str:
+        """Last lines of stderr, enough to explain a failure"""
+        return '\n'.join(self.stderr_tail)
+
+    def json(self) -> Optional[dict]:
+        """Parse stdout as JSON (ffprobe -print_format json)"""
+        try:
+            return json.loads(self.stdout) if self.stdout else None
+        except ValueError:
+            return None
+
+    def __repr__(self):
+        return f"ProcessResult({self.cmd[0]!r}, returncode={self.returncode}, elapsed={self.elapsed:.2f}s, timed_out={self.timed_out})"
+
+
+async def _pump(stream, on_line: Optional[Callable], tail: Optional[deque], chunks: Optional[list],
+                on_chunk: Optional[Callable] = None):
+    """Read a pipe in chunks, splitting on both \\n and \\r (ffmpeg status lines)"""
+    pending = b''
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        if chunks is not None:
+            chunks.append(chunk)
+        if on_chunk is not None:
+            try:
+                on_chunk(chunk)
+            except Exception as e:
+                logger.debug(f"Process output callback failed: {e}")
+        if on_line is None and tail is None:
+            continue
+        pending += chunk
+        *lines, pending = _LINE_SPLIT.split(pending)
+        for raw in lines:
+            if raw:
+                _emit(raw, on_line, tail)
+    if pending:
+        _emit(pending, on_line, tail)
+
+
+def _emit(raw: bytes, on_line: Optional[Callable], tail: Optional[deque]):
+    line = raw.decode('utf-8', errors='replace')
+    if tail is not None:
+        tail.append(line)
+    if on_line is not None:
+        try:
+            on_line(line)
+        except Exception as e:
+            logger.debug(f"Process output callback failed: {e}")
+
+
+async def run_process(cmd: list, timeout: Optional[float] = None, capture_stdout: bool = True,
+                      on_stdout_line: Optional[Callable] = None, on_stderr_line: Optional[Callable] = None,
+                      stderr_lines: int = STDERR_TAIL_LINES,
+                      on_stdout_chunk: Optional[Callable] = None) -> ProcessResult:
+    """Run a command with asyncio.create_subprocess_exec.
+
+    stdout is collected when capture_stdout is set (small outputs such as
+    ffprobe JSON) and/or passed line by line to on_stdout_line (ffmpeg
+    -progress) or as raw bytes to on_stdout_chunk (decoded PCM). Only the
+    last stderr_lines lines of stderr are kept. On
+    timeout the process is killed and the result has timed_out set; if the
+    caller is cancelled the process is killed before CancelledError propagates.
+
+    Raises FileNotFoundError if the executable does not exist.
+    """
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+
+    tail = deque(maxlen=stderr_lines)
+    chunks = [] if capture_stdout else None
+    pumps = asyncio.gather(
+        _pump(process.stdout, on_stdout_line, None, chunks, on_stdout_chunk),
+        _pump(process.stderr, on_stderr_line, tail, None)
+    )
+    timed_out = False
+    try:
+        await asyncio.wait_for(asyncio.shield(pumps), timeout)
+        await process.wait()
+    except asyncio.TimeoutError:
+        timed_out = True
+        logger.warning(f"{cmd[0]} timed out after {timeout}s, killing pid {process.pid}")
+        _kill(process)
+        await process.wait()
+        await asyncio.gather(pumps, return_exceptions=True)
+    except asyncio.CancelledError:
+        _kill(process)
+        # Pipes hit EOF once the child is dead; reap it so no zombie is left
+        await asyncio.gather(pumps, process.wait(), return_exceptions=True)
+        raise
+
+    stdout = b''.join(chunks).decode('utf-8', errors='replace') if chunks is not None else ''
+    return ProcessResult(list(cmd), process.returncode, stdout, list(tail),
+                         time.monotonic() - started, timed_out)
+
+
+def _kill(process):
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
+
+
+def run_process_sync(cmd: list, **kwargs) -> ProcessResult:
+    """Blocking wrapper around run_process for worker threads and processes.
+
+    Must not be called from a thread that is already running an event loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(run_process(cmd, **kwargs))
+    raise RuntimeError("run_process_sync() called from a running event loop; await run_process() instead")
+
+
+def _ffprobe_cmd(path: str, show_format: bool, show_streams: bool) -> list:
+    cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json']
+    if show_format:
+        cmd.append('-show_format')
+    if show_streams:
+        cmd.append('-show_streams')
+    cmd.append(path)
+    return cmd
+
+
+async def probe(path: str, show_format: bool = True, show_streams: bool = True, timeout: float = 30) -> Optional[dict]:
+    """Run ffprobe and return its parsed JSON, or None on failure"""
+    result = await run_process(_ffprobe_cmd(path, show_format, show_streams), timeout=timeout)
+    return result.json() if result.ok else None
+
+
+def probe_sync(path: str, show_format: bool = True, show_streams: bool = True, timeout: float = 30) -> Optional[dict]:
+    """Blocking variant of probe()"""
+    result = run_process_sync(_ffprobe_cmd(path, show_format, show_streams), timeout=timeout)
+    return result.json() if result.ok else None
+
+
+def ffmpeg_progress_parser(duration: float, callback: Callable) -> Callable:
+    """Build an on_stdout_line handler for ffmpeg '-progress pipe:1' output.
+
+    callback(seconds_done, duration) is called once per progress block.
+    """
+    state = {'seconds': 0.0}
+
+    def on_line(line: str):
+        key, _, value = line.partition('=')
+        if key in ('out_time_us', 'out_time_ms'):
+            # Both keys carry microseconds (out_time_ms is misnamed in ffmpeg)
+            try:
+                state['seconds'] = max(0.0, int(value) / 1_000_000)
+            except ValueError:
+                pass
+        elif key == 'progress':
+            seconds = duration if value == 'end' and duration else state['seconds']
+            callback(seconds, duration)
+
+    return on_line
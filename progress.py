@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Coalesced progress reporting for download, processing and upload
+Feeds from yt-dlp progress hooks, ffmpeg -progress output and Telethon
+upload callbacks are rendered into one status message, edited at most once
+per interval and only when the rendered text changes.
+"""
+
+import time
+import asyncio
+import logging
+from typing import Optional
+from telethon.errors import FloodWaitError
+from config import PROGRESS_INTERVAL
+from utils import create_progress_bar, format_file_size, format_duration
+
+logger = logging.getLogger(__name__)
+
+# Phase -> (title, unit). 'bytes' phases show sizes and MB/s, 'seconds'
+# phases show media time and encode speed (x realtime).
+PHASES = {
+    'download': ("⬇️ **Đang tải video...**", 'bytes'),
+    'process': ("⚙️ **Đang xử lý video...**", 'seconds'),
+    'upload': ("📤 **Đang upload...**", 'bytes'),
+}
+
+# Weight of the newest sample in the throughput moving average
+_RATE_SMOOTHING = 0.3
+
+
+class ProgressReporter:
+    """Render progress of one job into its status message"""
+
+    def __init__(self, status_msg, footer: str = '', min_interval: float = PROGRESS_INTERVAL):
+        self.status_msg = status_msg
+        self.footer = footer
+        self.min_interval = min_interval
+        self.phase = None
+        self.current = 0
+        self.total = 0
+        self.rate = 0.0
+        self._sample_time = 0.0
+        self._sample_value = 0
+        self._last_text = None
+        self._next_edit_at = 0.0
+        self._flush_handle = None
+        self._edit_task = None
+        self._closed = False
+        self._dirty = False
+        self.edits = 0
+        self.skipped = 0
+
+    def update(self, phase: str, current: float, total: Optional[float] = None):
+        """Record new progress; the status message is edited later, coalesced"""
+        if self._closed:
+            return
+        now = time.monotonic()
+        if phase != self.phase or current < self._sample_value:
+            # New phase or a new file within the phase (e.g. audio after video)
+            self.phase = phase
+            self.rate = 0.0
+            self._sample_time = now
+            self._sample_value = current
+        elif now - self._sample_time >= 0.5:
+            sample = (current - self._sample_value) / (now - self._sample_time)
+            self.rate = sample if not self.rate else (_RATE_SMOOTHING * sample + (1 - _RATE_SMOOTHING) * self.rate)
+            self._sample_time = now
+            self._sample_value = current
+        self.current = current
+        self.total = total or 0
+        self._dirty = True
+        self._schedule()
+
+    async def close(self):
+        """Stop editing; call before writing the final status text"""
+        self._closed = True
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._edit_task and not self._edit_task.done():
+            await asyncio.gather(self._edit_task, return_exceptions=True)
+
+    def render(self) -> str:
+        """Build the status text for the current state"""
+        title, unit = PHASES.get(self.phase, ("⏳ **Đang xử lý...**", 'bytes'))
+        lines = [title]
+        if self.total > 0:
+            lines.append(create_progress_bar(min(self.current, self.total), self.total))
+        if unit == 'bytes':
+            size = format_file_size(int(self.current))
+            if self.total > 0:
+                size += f" / {format_file_size(int(self.total))}"
+            lines.append(f"💾 {size}")
+            if self.rate > 0:
+                lines.append(f"🚀 {format_file_size(int(self.rate))}/s" + self._eta())
+        else:
+            position = format_duration(int(self.current))
+            if self.total > 0:
+                position += f" / {format_duration(int(self.total))}"
+            lines.append(f"⏱️ {position}")
+            if self.rate > 0:
+                lines.append(f"🚀 x{self.rate:.1f}" + self._eta())
+        if self.footer:
+            lines.append(self.footer)
+        return '\n'.join(lines)
+
+    def _eta(self) -> str:
+        if self.total <= 0 or self.rate <= 0 or self.current >= self.total:
+            return ''
+        return f" • ⏳ còn {format_duration(int((self.total - self.current) / self.rate))}"
+
+    def _schedule(self):
+        if self._flush_handle or (self._edit_task and not self._edit_task.done()):
+            return  # An edit is already pending; it will pick up the latest state
+        loop = asyncio.get_running_loop()
+        delay = max(0.0, self._next_edit_at - time.monotonic())
+        self._flush_handle = loop.call_later(delay, self._start_edit)
+
+    def _start_edit(self):
+        self._flush_handle = None
+        if not self._closed:
+            self._edit_task = asyncio.ensure_future(self._edit())
+
+    async def _edit(self):
+        self._dirty = False
+        text = self.render()
+        if text == self._last_text:
+            self.skipped += 1
+        else:
+            self._next_edit_at = time.monotonic() + self.min_interval
+            try:
+                await self.status_msg.edit(text)
+                self._last_text = text
+                self.edits += 1
+            except FloodWaitError as e:
+                logger.warning(f"Progress edit hit FloodWait, pausing edits for {e.seconds}s")
+                self._next_edit_at = time.monotonic() + e.seconds
+            except Exception as e:
+                logger.debug(f"Progress edit failed: {e}")
+        self._edit_task = None
+        if self._dirty and not self._closed:
+            # Progress moved on while the edit was in flight
+            self._schedule()
@@ -20,10 +20,10 @@ def setup_logging():
         ]
     )
 
-def signal_handler(signum, frame):
-    """Handle shutdown signals"""
+def signal_handler(signum, main_task):
+    """Handle shutdown signals by cancelling the bot, which keeps unfinished jobs for the next start"""
     logging.info(f"Received signal {signum}, shutting down...")
-    sys.exit(0)
+    main_task.cancel()
 
 async def main():
     """Main function to run the bot"""
@@ -31,17 +31,18 @@ async def main():
     setup_logging()
     logger = logging.getLogger(__name__)
     
-    # Setup signal handlers
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    # Setup signal handlers; docker stop and stop.sh send SIGTERM
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, signal_handler, signum, asyncio.current_task())
     
     try:
         logger.info("Starting Telegram Video Client Bot...")
         bot = TelegramVideoClient()
         await bot.run()
         
-    except KeyboardInterrupt:
-        logger.info("Bot stopped by user")
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logger.info("Bot stopped")
     except Exception as e:
         logger.error(f"Fatal error: {e}")
         sys.exit(1)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Indexed registry of active download/upload tasks
+Lookups by user, by (user, URL) and by stage are O(1) instead of a scan
+over every active task.
+"""
+
+import asyncio
+from collections import OrderedDict
+from typing import Optional
+
+
+class TaskRecord:
+    """State of one URL being processed"""
+    __slots__ = ('task_id', 'task', 'url', 'canonical_url', 'status_msg', 'stage', 'user_id',
+                 'source_chat_id', 'source_msg_id', 'action', 'video_info', 'ie_result',
+                 'progress', 'uploaded_media', 'journal_id', 'temp_dir', 'format_id',
+                 'downloaded_file', 'stage_changed', 'cancelled')
+
+    def __init__(self, task_id: str, url: str, status_msg, user_id: int,
+                 source_chat_id=None, source_msg_id=None, stage: str = 'info'):
+        self.task_id = task_id
+        self.task = None  # asyncio.Task running the current stage
+        self.url = url
+        self.canonical_url = None  # Resolved short link; what every stage downloads
+        self.status_msg = status_msg
+        self.stage = stage
+        self.user_id = user_id
+        self.source_chat_id = source_chat_id
+        self.source_msg_id = source_msg_id
+        self.action = None
+        self.video_info = None
+        self.ie_result = None  # Raw yt-dlp info dict, reused by the download step
+        self.progress = None  # ProgressReporter while a pipeline is running
+        self.uploaded_media = None  # Media of the first delivered message, reused for other chats
+        self.journal_id = None  # Row in the job journal once the download started
+        self.temp_dir = None  # Download directory; reused when a job is resumed
+        self.format_id = None  # Format to download; a resumed job keeps its partial format
+        self.downloaded_file = None  # Finished download of a resumed job, ready for upload
+        self.stage_changed = asyncio.Event()  # Replaced on every stage transition
+        self.cancelled = asyncio.Event()
+
+    def __repr__(self):
+        return f"TaskRecord({self.task_id!r}, user={self.user_id}, stage={self.stage!r}, url={self.url!r})"
+
+
+class TaskRegistry:
+    """Active tasks keyed by task_id with secondary indexes"""
+
+    def __init__(self, on_remove=None):
+        self.on_remove = on_remove  # callback(record) after a task left the registry
+        self._tasks = OrderedDict()  # task_id -> TaskRecord, in creation order
+        self._by_user = {}  # user_id -> OrderedDict(task_id -> TaskRecord)
+        self._by_user_url = {}  # (user_id, url) -> TaskRecord
+        self._by_stage = {}  # stage -> OrderedDict(task_id -> TaskRecord)
+        self._by_user_stage = {}  # (user_id, stage) -> OrderedDict(task_id -> TaskRecord)
+
+    def __contains__(self, task_id) -> bool:
+        return task_id in self._tasks
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def __iter__(self):
+        return iter(list(self._tasks.values()))
+
+    def add(self, record: TaskRecord):
+        """Register a new task"""
+        self.pop(record.task_id)
+        self._tasks[record.task_id] = record
+        self._by_user.setdefault(record.user_id, OrderedDict())[record.task_id] = record
+        self._by_user_url[(record.user_id, record.url)] = record
+        self._index_stage(record)
+
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        return self._tasks.get(task_id)
+
+    def pop(self, task_id: str, default=None) -> Optional[TaskRecord]:
+        """Remove a task and wake anything still waiting on it"""
+        record = self._tasks.pop(task_id, None)
+        if record is None:
+            return default
+        self._discard(self._by_user, record.user_id, task_id)
+        if self._by_user_url.get((record.user_id, record.url)) is record:
+            del self._by_user_url[(record.user_id, record.url)]
+        self._unindex_stage(record)
+        record.stage_changed.set()
+        if self.on_remove:
+            self.on_remove(record)
+        return record
+
+    def set_stage(self, task_id: str, stage: str):
+        """Move a task to a new stage and wake whoever waits on the change"""
+        record = self._tasks.get(task_id)
+        if record is None:
+            return
+        if record.stage != stage:
+            self._unindex_stage(record)
+            record.stage = stage
+            self._index_stage(record)
+        changed = record.stage_changed
+        record.stage_changed = asyncio.Event()
+        changed.set()
+
+    def for_user(self, user_id: int) -> list:
+        """All tasks of a user, oldest first"""
+        return list(self._by_user.get(user_id, {}).values())
+
+    def find(self, user_id: int, url: str) -> Optional[TaskRecord]:
+        """Active task of a user for a URL, if any"""
+        return self._by_user_url.get((user_id, url))
+
+    def first_in_stage(self, user_id: int, stage: str) -> Optional[TaskRecord]:
+        """Oldest task of a user in the given stage"""
+        tasks = self._by_user_stage.get((user_id, stage))
+        return next(iter(tasks.values())) if tasks else None
+
+    def in_stage(self, stage: str) -> list:
+        """All tasks in the given stage, oldest first"""
+        return list(self._by_stage.get(stage, {}).values())
+
+    def stage_counts(self) -> dict:
+        """Number of tasks per stage"""
+        return {stage: len(tasks) for stage, tasks in self._by_stage.items()}
+
+    def _index_stage(self, record: TaskRecord):
+        self._by_stage.setdefault(record.stage, OrderedDict())[record.task_id] = record
+        self._by_user_stage.setdefault((record.user_id, record.stage), OrderedDict())[record.task_id] = record
+
+    def _unindex_stage(self, record: TaskRecord):
+        self._discard(self._by_stage, record.stage, record.task_id)
+        self._discard(self._by_user_stage, (record.user_id, record.stage), record.task_id)
+
+    @staticmethod
+    def _discard(index: dict, key, task_id: str):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.pop(task_id, None)
+            if not bucket:
+                del index[key]
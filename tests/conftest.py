@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# config.py reads these at import time; keep the tests off the real download directory
+os.environ.setdefault('API_ID', '1')
+os.environ.setdefault('API_HASH', 'test')
+os.environ.setdefault('PHONE_NUMBER', '+10000000000')
+os.environ.setdefault('TARGET_CHAT_ID', '1')
+os.environ.setdefault('ADMIN_USER_ID', '1')
+os.environ.setdefault('DOWNLOAD_DIR', tempfile.mkdtemp(prefix='bot-tests-'))
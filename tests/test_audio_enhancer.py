@@ -0,0 +1,45 @@
+import cmath
+import math
+
+from audio_enhancer import EQ_BANDS, AudioEnhancer
+
+
+class _Stats:
+    def __init__(self, integrated, equalized=None):
+        self.integrated = integrated
+        self.equalized = equalized
+
+    def loudnorm_filter(self):
+        return f"loudnorm=measured_I={self.integrated}:linear=true"
+
+
+def gain_db(stages, frequency, sample_rate=48000):
+    z = cmath.exp(-2j * math.pi * frequency / sample_rate)
+    response = 1
+    for b, a in stages:
+        response *= (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    return 20 * math.log10(abs(response))
+
+
+def test_measured_loudnorm_comes_after_the_eq():
+    audio_filter = AudioEnhancer.audio_args(_Stats(-20.0, equalized=_Stats(-17.5)))[-1]
+    filters = audio_filter.split(',')
+    assert ','.join(filters[:-1]) == AudioEnhancer.eq_filter()
+    assert filters[-1] == 'loudnorm=measured_I=-17.5:linear=true'
+
+
+def test_fixed_chain_without_an_eq_measurement():
+    for loudness in (None, _Stats(-20.0), _Stats(-20.0, equalized=_Stats(None))):
+        audio_filter = AudioEnhancer.audio_args(loudness)[-1]
+        assert audio_filter.startswith('volume=2.5,' + AudioEnhancer.eq_filter() + ',compand=')
+
+
+def test_eq_stages_match_the_filter_bands():
+    stages = AudioEnhancer.eq_stages(48000)
+    assert len(stages) == len(EQ_BANDS)
+    for (kind, frequency, _width, gain), stage in zip(EQ_BANDS, stages):
+        if kind == 'equalizer':
+            assert abs(gain_db([stage], frequency) - gain) < 1e-6
+    # Butterworth corners of the high- and low-pass
+    assert abs(gain_db(stages[0:1], 30) + 3.0) < 0.1
+    assert abs(gain_db(stages[1:2], 18000) + 3.0) < 0.1
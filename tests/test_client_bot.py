@@ -0,0 +1,95 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import time
+
+import pytest
+
+import download_workers
+from client_bot import TelegramVideoClient
+from download_workers import DownloadProcessPool
+from job_journal import JobJournal
+from task_registry import TaskRecord, TaskRegistry
+
+
+def _partial_download_worker(conn, grant_conn, method_name, args):
+    """Stands in for yt-dlp: leaves a .part file in the job's temp dir and keeps downloading"""
+    os.setsid()
+    with open(os.path.join(args[1], 'video.mp4.part'), 'wb') as f:
+        f.write(b'\0' * 1024)
+    time.sleep(60)
+
+
+class _Cleanup:
+    def remove_dir(self, temp_dir):
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def remove_file(self, file_path):
+        self.remove_dir(os.path.dirname(file_path))
+
+
+class _Stats:
+    def record(self, *args):
+        pass
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_workers, '_worker_main', _partial_download_worker)
+    bot = TelegramVideoClient.__new__(TelegramVideoClient)
+    bot.journal = JobJournal(str(tmp_path / 'jobs.db'))
+    bot.active_tasks = TaskRegistry(on_remove=bot.forget_journaled_job)
+    bot.shutting_down = False
+    bot.cleanup = _Cleanup()
+    bot.postprocess_stats = _Stats()
+    yield bot
+    bot.journal.close()
+
+
+async def start_download(bot):
+    """Run a journaled download the way the action handlers do and wait for its first partial file"""
+    bot.download_pool = DownloadProcessPool(1)
+    bot.download_pool._ctx = multiprocessing.get_context('fork')
+    task_info = TaskRecord('1', 'https://example.com/v', None, 42, stage='download')
+    bot.active_tasks.add(task_info)
+
+    async def pipeline():
+        try:
+            await bot.download_video_async_cancellable(task_info.url, '1')
+        except asyncio.CancelledError:
+            bot.active_tasks.pop('1', None)
+
+    task_info.task = asyncio.create_task(pipeline())
+    for _ in range(500):
+        if task_info.temp_dir and os.path.exists(os.path.join(task_info.temp_dir, 'video.mp4.part')):
+            return task_info
+        await asyncio.sleep(0.01)
+    raise AssertionError('worker did not start downloading')
+
+
+def test_shutdown_keeps_the_journal_entry_and_partial_files(bot):
+    async def scenario():
+        task_info = await start_download(bot)
+        await bot.stop_jobs()
+        assert len(bot.active_tasks) == 0
+        return task_info.temp_dir
+
+    temp_dir = asyncio.run(scenario())
+    [entry] = bot.journal.unfinished()
+    assert entry.temp_dir == temp_dir
+    assert os.path.exists(os.path.join(temp_dir, 'video.mp4.part'))
+    shutil.rmtree(temp_dir)
+
+
+def test_user_cancel_drops_the_journal_entry_and_partial_files(bot):
+    async def scenario():
+        task_info = await start_download(bot)
+        task_info.cancelled.set()
+        task_info.task.cancel()
+        await asyncio.gather(task_info.task, return_exceptions=True)
+        return task_info.temp_dir
+
+    temp_dir = asyncio.run(scenario())
+    assert bot.journal.unfinished() == []
+    assert not os.path.exists(temp_dir)
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+
+import pytest
+
+import disk_space
+from disk_space import UNKNOWN_SIZE_ESTIMATE, DiskSpaceController, DiskSpaceError, estimate_job_bytes
+
+
+def controller(free: int) -> DiskSpaceController:
+    disk = DiskSpaceController(margin=0)
+    disk.free_bytes = lambda: free
+    return disk
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_estimate_job_bytes():
+    assert estimate_job_bytes(100, factor=2.0) == 200
+    assert estimate_job_bytes(None, factor=1.0) == UNKNOWN_SIZE_ESTIMATE
+
+
+def test_admits_while_reservations_fit():
+    async def scenario():
+        disk = controller(1000)
+        await disk.acquire('a', 400)
+        await disk.acquire('b', 600)
+        return disk.stats()
+
+    stats = run(scenario())
+    assert (stats['active'], stats['reserved'], stats['waiting']) == (2, 1000, 0)
+
+
+def test_rejects_job_that_can_never_fit():
+    async def scenario():
+        disk = controller(1000)
+        with pytest.raises(DiskSpaceError):
+            await disk.acquire('huge', 2000)
+        return disk.stats()
+
+    assert run(scenario())['rejected'] == 1
+
+
+def test_waiting_jobs_are_admitted_in_arrival_order():
+    async def scenario():
+        disk = controller(1000)
+        admitted = []
+
+        async def job(job_id, nbytes):
+            await disk.acquire(job_id, nbytes)
+            admitted.append(job_id)
+
+        await disk.acquire('running', 900)
+        large = asyncio.create_task(job('large', 800))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(job('small', 50))
+        await asyncio.sleep(0)
+        # 'small' would fit now but must not overtake 'large'
+        assert admitted == [] and disk.stats()['waiting'] == 2
+        disk.release('running')
+        await asyncio.gather(large, small)
+        return admitted
+
+    assert run(scenario()) == ['large', 'small']
+
+
+def test_waiting_job_rejected_once_nothing_is_left_to_free():
+    async def scenario():
+        disk = controller(1000)
+        await disk.acquire('running', 500)
+        waiting = asyncio.create_task(disk.acquire('huge', 1500))
+        await asyncio.sleep(0)
+        disk.release('running')
+        with pytest.raises(DiskSpaceError):
+            await waiting
+
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        disk = controller(1000)
+        notified = []
+
+        async def on_waiting():
+            notified.append(True)
+
+        await disk.acquire('running', 900)
+        waiting = asyncio.create_task(disk.acquire('next', 500, on_waiting=on_waiting))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        return disk.stats(), notified
+
+    stats, notified = run(scenario())
+    assert stats['waiting'] == 0 and stats['active'] == 1
+    assert notified == [True]
+
+
+def test_reserve_context_releases_on_exit():
+    async def scenario():
+        disk = controller(1000)
+        async with disk.reserve('job', 700):
+            inside = disk.stats()['reserved']
+        return inside, disk.stats()['reserved']
+
+    assert run(scenario()) == (700, 0)
+
+
+def test_written_bytes_are_measured_off_the_event_loop(tmp_path, monkeypatch):
+    async def scenario():
+        disk = controller(10 * 1024 * 1024)
+        await disk.acquire('job', 1024 * 1024, str(tmp_path))
+        (tmp_path / 'video.mp4.part').write_bytes(b'\1' * 512 * 1024)
+        walked = []
+
+        def dir_size(path):
+            walked.append(threading.get_ident())
+            return measure(path)
+
+        monkeypatch.setattr(disk_space, '_dir_size', dir_size)
+        before = disk.stats()['outstanding']
+        await disk.refresh()
+        return before, disk.stats()['outstanding'], walked
+
+    measure = disk_space._dir_size
+    before, after, walked = run(scenario())
+    assert before == 1024 * 1024
+    assert after <= 512 * 1024
+    assert walked and threading.get_ident() not in walked
@@ -0,0 +1,92 @@
+from format_ranking import FormatChoice, TelegramFormatSelector, rank_formats
+
+MB = 1024 * 1024
+
+
+def ids(choice: FormatChoice) -> str:
+    return '+'.join(f['format_id'] for f in choice.formats)
+
+
+def fmt(format_id: str, vcodec: str = 'none', acodec: str = 'none', ext: str = 'mp4', height=None,
+        filesize=None, tbr=None, protocol: str = 'https') -> dict:
+    return {'format_id': format_id, 'format': format_id, 'vcodec': vcodec, 'acodec': acodec, 'ext': ext,
+            'height': height, 'filesize': filesize, 'tbr': tbr, 'protocol': protocol}
+
+
+YOUTUBE_FORMATS = [
+    fmt('140', acodec='mp4a.40.2', ext='m4a', filesize=3 * MB, tbr=128),
+    fmt('251', acodec='opus', ext='webm', filesize=3 * MB, tbr=160),
+    fmt('137', vcodec='avc1.640028', height=1080, filesize=60 * MB, tbr=4000),
+    fmt('248', vcodec='vp9', ext='webm', height=1080, filesize=50 * MB, tbr=3500),
+    fmt('22', vcodec='avc1.64001F', acodec='mp4a.40.2', height=720, filesize=40 * MB, tbr=2000),
+]
+
+
+def test_copyable_pair_beats_higher_resolution_transcode():
+    formats = YOUTUBE_FORMATS + [fmt('313', vcodec='vp9', ext='webm', height=2160, filesize=200 * MB)]
+    best = rank_formats(formats)[0]
+    assert ids(best) == '137+140'
+    assert not best.needs_transcode
+
+
+def test_oversized_formats_rank_below_fitting_ones():
+    best = rank_formats(YOUTUBE_FORMATS, max_size=50 * MB)[0]
+    assert ids(best) == '22'
+    assert best.fits(50 * MB)
+
+
+def test_smallest_choice_when_nothing_fits():
+    choices = rank_formats(YOUTUBE_FORMATS, max_size=1 * MB)
+    assert not choices[0].fits(1 * MB)
+    assert ids(choices[0]) == '22'
+    assert choices[0].size == min(choice.size for choice in choices)
+
+
+def test_transcode_only_when_nothing_is_copyable():
+    formats = [fmt('248', vcodec='vp9', ext='webm', height=1080, filesize=50 * MB),
+               fmt('251', acodec='opus', ext='webm', filesize=3 * MB)]
+    best = rank_formats(formats)[0]
+    assert ids(best) == '248+251'
+    assert best.needs_transcode
+
+
+def test_unreported_codecs_trust_the_mp4_extension():
+    assert not FormatChoice((fmt('hls', vcodec=None, acodec=None, ext='mp4'),)).needs_transcode
+    assert FormatChoice((fmt('flv', vcodec=None, acodec=None, ext='flv'),)).needs_transcode
+
+
+def test_unknown_size_counts_as_fitting():
+    choice = FormatChoice((fmt('137', vcodec='avc1', height=1080), fmt('140', acodec='mp4a', filesize=3 * MB)))
+    assert choice.size is None
+    assert choice.fits(1)
+
+
+def test_drm_and_storyboard_formats_are_skipped():
+    formats = [dict(fmt('drm', vcodec='avc1', acodec='mp4a', height=1080), has_drm=True),
+               fmt('sb0', vcodec='none', acodec='none', ext='mhtml'),
+               fmt('18', vcodec='avc1', acodec='mp4a', height=360)]
+    assert [ids(choice) for choice in rank_formats(formats)] == ['18']
+
+
+def test_merged_pair_format_dict():
+    merged = rank_formats(YOUTUBE_FORMATS)[0].to_format()
+    assert merged['format_id'] == '137+140'
+    assert merged['ext'] == 'mp4'
+    assert [f['format_id'] for f in merged['requested_formats']] == ['137', '140']
+    assert merged['filesize_approx'] == 63 * MB
+    assert merged['height'] == 1080
+    assert merged['acodec'] == 'mp4a.40.2'
+
+
+def test_selector_yields_the_best_choice():
+    ctx = {'formats': YOUTUBE_FORMATS}
+    assert [f['format_id'] for f in TelegramFormatSelector()(ctx)] == ['137+140']
+    assert [f['format_id'] for f in TelegramFormatSelector(max_size=50 * MB)(ctx)] == ['22']
+    assert list(TelegramFormatSelector()({'formats': []})) == []
+
+
+def test_selector_keeps_preferred_format_and_falls_back():
+    ctx = {'formats': YOUTUBE_FORMATS}
+    assert [f['format_id'] for f in TelegramFormatSelector(preferred_format='22')(ctx)] == ['22']
+    assert [f['format_id'] for f in TelegramFormatSelector(preferred_format='gone')(ctx)] == ['137+140']
+    assert rank_formats(YOUTUBE_FORMATS)[0].format_id == '137+140'
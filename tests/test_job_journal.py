@@ -0,0 +1,56 @@
+import pytest
+
+from job_journal import JobJournal
+from task_registry import TaskRecord
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = JobJournal(str(tmp_path / 'journal' / 'jobs.db'))
+    yield journal
+    journal.close()
+
+
+def task(url: str = 'https://example.com/v') -> TaskRecord:
+    record = TaskRecord('1', url, None, 42, source_chat_id=-100, source_msg_id=7)
+    record.canonical_url = url + '?canonical'
+    record.action = 'send'
+    record.video_info = {'title': 'Video', 'duration': 12}
+    return record
+
+
+def test_start_records_the_job(journal):
+    journal_id = journal.start(task(), '/tmp/job', format_id='137+140')
+    [entry] = journal.unfinished()
+    assert entry.journal_id == journal_id
+    assert (entry.url, entry.canonical_url, entry.user_id) == ('https://example.com/v', 'https://example.com/v?canonical', 42)
+    assert (entry.source_chat_id, entry.source_msg_id, entry.action) == (-100, 7, 'send')
+    assert (entry.format_id, entry.temp_dir, entry.stage) == ('137+140', '/tmp/job', 'download')
+    assert entry.video_info == {'title': 'Video', 'duration': 12}
+    assert journal.temp_dirs() == {'/tmp/job'}
+
+
+def test_update_and_finish(journal):
+    first = journal.start(task('https://example.com/a'), '/tmp/a')
+    second = journal.start(task('https://example.com/b'), '/tmp/b')
+    journal.update(first, stage='upload', file_path='/tmp/a/video.mp4')
+    journal.finish(second)
+    [entry] = journal.unfinished()
+    assert (entry.journal_id, entry.stage, entry.file_path) == (first, 'upload', '/tmp/a/video.mp4')
+    assert len(journal) == 1
+
+
+def test_update_rejects_unknown_fields(journal):
+    journal_id = journal.start(task(), '/tmp/job')
+    with pytest.raises(ValueError):
+        journal.update(journal_id, url='https://evil.example')
+
+
+def test_entries_survive_reopening(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    journal = JobJournal(path)
+    journal.start(task(), '/tmp/job')
+    journal.close()
+    reopened = JobJournal(path)
+    assert [entry.temp_dir for entry in reopened.unfinished()] == ['/tmp/job']
+    reopened.close()
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from client_bot import JobScheduler, QueueFullError
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_global_cap_queues_then_admits_in_order():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent=2, max_per_user=5, max_queued=5)
+        await scheduler.acquire('a', 1)
+        await scheduler.acquire('b', 2)
+        c = asyncio.create_task(scheduler.acquire('c', 3))
+        d = asyncio.create_task(scheduler.acquire('d', 4))
+        await settle()
+        assert (scheduler.queue_position('c'), scheduler.queue_position('d')) == (1, 2)
+        scheduler.release('a')
+        await c
+        assert not d.done()
+        scheduler.release('b')
+        await d
+        return scheduler.stats()
+
+    stats = run(scenario())
+    assert (stats['running'], stats['queued'], stats['admitted'], stats['completed']) == (2, 0, 4, 2)
+    assert stats['peak_queue_depth'] == 2
+
+
+def test_user_at_cap_does_not_block_other_users():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent=3, max_per_user=1, max_queued=5)
+        await scheduler.acquire('a1', 1)
+        second = asyncio.create_task(scheduler.acquire('a2', 1))
+        await settle()
+        await asyncio.wait_for(scheduler.acquire('b1', 2), 1)
+        assert not second.done()
+        assert scheduler.stats()['running_by_user'] == {1: 1, 2: 1}
+        scheduler.release('a1')
+        await second
+
+    run(scenario())
+
+
+def test_full_queue_rejects_new_jobs():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent=1, max_per_user=1, max_queued=1)
+        await scheduler.acquire('a', 1)
+        waiting = asyncio.create_task(scheduler.acquire('b', 2))
+        await settle()
+        with pytest.raises(QueueFullError):
+            await scheduler.acquire('c', 3)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        return scheduler.stats()
+
+    stats = run(scenario())
+    assert (stats['rejected'], stats['queued']) == (1, 0)
+
+
+def test_queued_jobs_are_told_their_position():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent=1, max_per_user=1, max_queued=5)
+        positions = {'b': [], 'c': []}
+
+        def on_queued(job_id):
+            async def notify(position):
+                positions[job_id].append(position)
+            return notify
+
+        await scheduler.acquire('a', 1)
+        b = asyncio.create_task(scheduler.acquire('b', 2, on_queued('b')))
+        await settle()
+        c = asyncio.create_task(scheduler.acquire('c', 3, on_queued('c')))
+        await settle()
+        scheduler.release('a')
+        await b
+        await settle()
+        scheduler.release('b')
+        await c
+        return positions
+
+    assert run(scenario()) == {'b': [1], 'c': [2, 1]}
+
+
+def test_slot_context_releases_on_error():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent=1, max_per_user=1, max_queued=0)
+        with pytest.raises(RuntimeError):
+            async with scheduler.slot('a', 1):
+                raise RuntimeError('job failed')
+        async with scheduler.slot('b', 1):
+            return scheduler.stats()['running']
+
+    assert run(scenario()) == 1
+
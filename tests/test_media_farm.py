@@ -0,0 +1,96 @@
+import pytest
+
+import media_farm
+from media_farm import MediaWorkerFarm, plan_farm, with_threads
+
+
+@pytest.mark.parametrize('cpus, expected', [(1, (1, 1)), (2, (1, 2)), (2.5, (1, 2)), (4, (2, 2)), (8, (4, 2)),
+                                            (0.5, (1, 1))])
+def test_plan_farm_from_cpu_quota(cpus, expected):
+    assert plan_farm(cpus, 0, 0) == expected
+
+
+def test_plan_farm_overrides():
+    assert plan_farm(8, 3, 0) == (3, 2)
+    assert plan_farm(8, 0, 4) == (4, 4)
+    assert plan_farm(8, 2, 1) == (2, 1)
+
+
+def test_with_threads_goes_before_the_output_path():
+    cmd = ['ffmpeg', '-i', 'in.webm', '-c', 'copy', 'out.mp4']
+    assert with_threads(cmd, 3) == ['ffmpeg', '-i', 'in.webm', '-c', 'copy', '-threads', '3', 'out.mp4']
+    assert cmd[-1] == 'out.mp4'  # Not modified in place
+
+
+def test_farm_grants_by_priority():
+    farm = MediaWorkerFarm(cpus=2, slots=1, threads=2)
+    granted = []
+    for job_id, kind in (('t', 'transcode'), ('s', 'slideshow'), ('r', 'remux'), ('a', 'analysis')):
+        farm.request(job_id, kind, lambda threads, job_id=job_id: granted.append((job_id, threads)))
+    assert granted == [('t', 2)]
+    for job_id in ('t', 'a', 'r'):
+        farm.release(job_id)
+    assert [job_id for job_id, _threads in granted] == ['t', 'a', 'r', 's']
+
+
+def test_waiting_raises_priority(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(media_farm.time, 'monotonic', lambda: clock[0])
+    farm = MediaWorkerFarm(cpus=1, slots=1, threads=1)
+    granted = []
+    farm.request('busy', 'remux', granted.append)
+    farm.request('old', 'transcode', lambda threads: granted.append('old'))
+    clock[0] += media_farm.AGING_SECONDS * 5
+    farm.request('new', 'analysis', lambda threads: granted.append('new'))
+    farm.release('busy')
+    assert granted[-1] == 'old'
+
+
+def test_forget_frees_slot_and_queue():
+    farm = MediaWorkerFarm(cpus=2, slots=1, threads=2)
+    granted = []
+    farm.request('dead', 'audio', lambda threads: granted.append('dead'))
+    farm.request('queued', 'audio', lambda threads: granted.append('queued'))
+    farm.request('next', 'audio', lambda threads: granted.append('next'))
+    farm.forget('queued')
+    farm.forget('dead')
+    assert granted == ['dead', 'next']
+
+
+def test_failed_grant_does_not_hold_a_slot():
+    farm = MediaWorkerFarm(cpus=2, slots=1, threads=2)
+
+    def closed_pipe(threads):
+        raise OSError('pipe closed')
+
+    farm.request('gone', 'audio', closed_pipe)
+    assert farm.stats()['running'] == 0
+
+
+def test_stats_count_kinds_and_cpu():
+    farm = MediaWorkerFarm(cpus=2, slots=2, threads=1)
+    farm.handle('a', lambda threads: None, 'acquire', 'remux')
+    farm.handle('a', lambda threads: None, 'release', 3.0)
+    stats = farm.stats()
+    assert (stats['slots'], stats['threads'], stats['running'], stats['queued']) == (2, 1, 0, 0)
+    assert stats['kinds']['remux']['count'] == 1
+    assert farm.cpu_seconds == 3.0
+
+
+def test_media_job_reads_cpu_from_benchmark(monkeypatch, tmp_path):
+    calls = []
+
+    def fake_run(cmd, on_stderr_line=None, **kwargs):
+        calls.append(cmd)
+        on_stderr_line('bench: utime=1.500s stime=0.250s rtime=2.000s')
+        return 'result'
+
+    monkeypatch.setattr(media_farm, 'run_process_sync', fake_run)
+    partial = tmp_path / 'partial.mp4'
+    partial.write_bytes(b'x')
+    with media_farm.MediaJob('remux') as job:
+        job.track(str(partial))
+        assert job.run(['ffmpeg', '-i', 'in', 'out.mp4']) == 'result'
+    assert calls[0][:2] == ['ffmpeg', '-benchmark'] and calls[0][-3:-1] == ['-threads', str(job.threads)]
+    assert job.cpu_seconds == 1.75
+    assert not partial.exists()
@@ -0,0 +1,130 @@
+import struct
+
+import pytest
+
+import mp4_boxes
+
+
+def box(box_type: bytes, *children: bytes) -> bytes:
+    payload = b''.join(children)
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type: bytes, payload: bytes, version: int = 0) -> bytes:
+    return box(box_type, bytes([version, 0, 0, 0]), payload)
+
+
+def times(timescale: int, duration: int) -> bytes:
+    """mvhd/mdhd version 0 fields up to the duration"""
+    return struct.pack('>IIII', 0, 0, timescale, duration)
+
+
+def descriptor(tag: int, payload: bytes, long_size: bool = False) -> bytes:
+    if long_size:
+        # ffmpeg writes sizes padded to four bytes
+        size = bytes([0x80, 0x80, 0x80, len(payload)])
+    else:
+        size = bytes([len(payload)])
+    return bytes([tag]) + size + payload
+
+
+def esds(object_type: int, long_size: bool = False) -> bytes:
+    config = descriptor(0x04, bytes([object_type, 0x15]) + b'\0' * 11, long_size)
+    return full_box(b'esds', descriptor(0x03, struct.pack('>HB', 1, 0) + config, long_size))
+
+
+def video_entry(fourcc: bytes = b'avc1', width: int = 1280, height: int = 720) -> bytes:
+    return box(fourcc, b'\0' * 6, struct.pack('>H', 1), b'\0' * 16, struct.pack('>HH', width, height), b'\0' * 50)
+
+
+def audio_entry(*children: bytes, fourcc: bytes = b'mp4a') -> bytes:
+    return box(fourcc, b'\0' * 6, struct.pack('>H', 1), b'\0' * 8,
+               struct.pack('>HHHHI', 2, 16, 0, 0, 48000 << 16), *children)
+
+
+def trak(handler: bytes, entry: bytes, timescale: int = 1000, duration: int = 10000) -> bytes:
+    hdlr = full_box(b'hdlr', b'\0' * 4 + handler + b'\0' * 13)
+    stsd = full_box(b'stsd', struct.pack('>I', 1) + entry)
+    stbl = box(b'stbl', stsd)
+    return box(b'trak', box(b'mdia', full_box(b'mdhd', times(timescale, duration) + b'\0' * 4),
+                            hdlr, box(b'minf', stbl)))
+
+
+def moov(*tracks: bytes, duration: int = 10000, mvex: bytes = b'') -> bytes:
+    return box(b'moov', full_box(b'mvhd', times(1000, duration) + b'\0' * 80), *tracks, mvex)
+
+
+FTYP = box(b'ftyp', b'isom', struct.pack('>I', 512), b'isomavc1')
+MDAT = box(b'mdat', b'\0' * 64)
+AV_TRACKS = (trak(b'vide', video_entry()), trak(b'soun', audio_entry(esds(0x40))))
+
+
+@pytest.fixture
+def write(tmp_path):
+    def write(data: bytes, name: str = 'video.mp4') -> str:
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+def test_faststart_file(write):
+    path = write(FTYP + moov(*AV_TRACKS) + MDAT)
+    assert mp4_boxes.parse(path) == {
+        'vcodec': 'h264', 'acodec': 'aac', 'duration': 10.0,
+        'width': 1280, 'height': 720, 'faststart': True,
+    }
+    assert mp4_boxes.is_faststart(path) is True
+
+
+def test_moov_after_mdat_is_not_faststart(write):
+    path = write(FTYP + MDAT + moov(*AV_TRACKS))
+    assert mp4_boxes.parse(path)['faststart'] is False
+    assert mp4_boxes.is_faststart(path) is False
+
+
+def test_fragmented_duration_comes_from_mehd(write):
+    mvex = box(b'mvex', full_box(b'mehd', struct.pack('>I', 7500)))
+    tracks = (trak(b'vide', video_entry(), duration=0), trak(b'soun', audio_entry(esds(0x40)), duration=0))
+    moof = box(b'moof', full_box(b'mfhd', struct.pack('>I', 1)))
+    parsed = mp4_boxes.parse(write(FTYP + moov(*tracks, duration=0, mvex=mvex) + moof + MDAT))
+    assert parsed['duration'] == 7.5
+    assert parsed['faststart'] is True
+
+
+def test_audio_only_file(write):
+    parsed = mp4_boxes.parse(write(FTYP + moov(trak(b'soun', audio_entry(esds(0x40)))) + MDAT, 'audio.m4a'))
+    assert parsed['vcodec'] is None
+    assert parsed['acodec'] == 'aac'
+    assert (parsed['width'], parsed['height']) == (0, 0)
+
+
+@pytest.mark.parametrize('object_type, codec', [(0x40, 'aac'), (0x67, 'aac'), (0x69, 'mp3'), (0x6B, 'mp3')])
+def test_mp4a_codec_from_esds(write, object_type, codec):
+    tracks = (trak(b'vide', video_entry()), trak(b'soun', audio_entry(esds(object_type, long_size=True))))
+    assert mp4_boxes.parse(write(FTYP + moov(*tracks) + MDAT))['acodec'] == codec
+
+
+@pytest.mark.parametrize('audio', [audio_entry(esds(0xA5)), audio_entry()], ids=['unknown-object-type', 'no-esds'])
+def test_unresolved_mp4a_falls_back_to_ffprobe(write, audio):
+    assert mp4_boxes.parse(write(FTYP + moov(trak(b'vide', video_entry()), trak(b'soun', audio)) + MDAT)) is None
+
+
+def test_quicktime_wave_box_holds_esds(write):
+    # Version 1 sound description: 16 more bytes of fields, esds inside a wave box
+    entry = box(b'mp4a', b'\0' * 6, struct.pack('>H', 1), struct.pack('>H', 1), b'\0' * 6,
+                struct.pack('>HHHHI', 2, 16, 0, 0, 48000 << 16), b'\0' * 16, box(b'wave', esds(0x6B)))
+    parsed = mp4_boxes.parse(write(FTYP + moov(trak(b'vide', video_entry()), trak(b'soun', entry)) + MDAT))
+    assert parsed['acodec'] == 'mp3'
+
+
+def test_unknown_video_fourcc_is_not_guessed(write):
+    tracks = (trak(b'vide', video_entry(b'xvid')), trak(b'soun', audio_entry(esds(0x40))))
+    assert mp4_boxes.parse(write(FTYP + moov(*tracks) + MDAT)) is None
+
+
+def test_non_mp4_and_truncated_files(write):
+    assert mp4_boxes.parse(write(b'\x1a\x45\xdf\xa3' + b'\0' * 64, 'video.webm')) is None
+    assert mp4_boxes.is_faststart(write(b'\x1a\x45\xdf\xa3' + b'\0' * 64, 'video.webm')) is None
+    data = FTYP + moov(*AV_TRACKS) + MDAT
+    assert mp4_boxes.parse(write(data[:len(FTYP) + 40], 'truncated.mp4')) is None
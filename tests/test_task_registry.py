@@ -0,0 +1,80 @@
+import asyncio
+
+from task_registry import TaskRecord, TaskRegistry
+
+
+def record(task_id: str, user_id: int = 1, url: str = None, stage: str = 'info') -> TaskRecord:
+    return TaskRecord(task_id, url or f"https://example.com/{task_id}", None, user_id, stage=stage)
+
+
+def test_lookups_by_user_url_and_stage():
+    async def scenario():
+        registry = TaskRegistry()
+        a, b, c = record('a', user_id=1), record('b', user_id=1, stage='download'), record('c', user_id=2)
+        for r in (a, b, c):
+            registry.add(r)
+        assert len(registry) == 3 and 'b' in registry
+        assert registry.for_user(1) == [a, b]
+        assert registry.find(2, c.url) is c
+        assert registry.find(2, a.url) is None
+        assert registry.in_stage('info') == [a, c]
+        assert registry.first_in_stage(1, 'download') is b
+        assert registry.stage_counts() == {'info': 2, 'download': 1}
+
+    asyncio.run(scenario())
+
+
+def test_set_stage_moves_indexes_and_wakes_waiters():
+    async def scenario():
+        registry = TaskRegistry()
+        a = record('a')
+        registry.add(a)
+        changed = a.stage_changed
+        registry.set_stage('a', 'upload')
+        assert changed.is_set() and not a.stage_changed.is_set()
+        assert registry.in_stage('info') == []
+        assert registry.first_in_stage(1, 'upload') is a
+        assert registry.stage_counts() == {'upload': 1}
+
+    asyncio.run(scenario())
+
+
+def test_pop_clears_every_index_and_reports_removal():
+    async def scenario():
+        removed = []
+        registry = TaskRegistry(on_remove=removed.append)
+        a = record('a', stage='download')
+        registry.add(a)
+        assert registry.pop('a') is a
+        assert registry.pop('a', 'missing') == 'missing'
+        assert removed == [a]
+        assert a.stage_changed.is_set()
+        assert (registry.for_user(1), registry.find(1, a.url), registry.stage_counts()) == ([], None, {})
+        assert registry.first_in_stage(1, 'download') is None
+
+    asyncio.run(scenario())
+
+
+def test_re_adding_a_task_id_replaces_the_old_record():
+    async def scenario():
+        registry = TaskRegistry()
+        old, new = record('a', url='https://example.com/old'), record('a', url='https://example.com/new')
+        registry.add(old)
+        registry.add(new)
+        assert list(registry) == [new]
+        assert registry.find(1, old.url) is None
+        assert registry.find(1, new.url) is new
+
+    asyncio.run(scenario())
+
+
+def test_same_url_for_two_tasks_keeps_the_newer_index_entry():
+    async def scenario():
+        registry = TaskRegistry()
+        first, second = record('a', url='https://example.com/v'), record('b', url='https://example.com/v')
+        registry.add(first)
+        registry.add(second)
+        registry.pop('a')
+        assert registry.find(1, 'https://example.com/v') is second
+
+    asyncio.run(scenario())
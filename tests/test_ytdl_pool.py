@@ -0,0 +1,36 @@
+import yt_dlp
+
+from ytdl_pool import YoutubeDLPool
+
+
+class _NoResetYoutubeDL(yt_dlp.YoutubeDL):
+    """Stands in for a yt-dlp release without one of the internals the pool resets"""
+
+    def __init__(self, params):
+        super().__init__(params)
+        del self._num_downloads
+
+
+def test_checkout_overrides_are_undone():
+    pool = YoutubeDLPool({'quiet': True}, 1)
+    with pool.checkout(format='worst', outtmpl='/tmp/%(id)s.%(ext)s') as ydl:
+        borrowed = ydl
+        assert ydl.params['format'] == 'worst'
+    with pool.checkout() as ydl:
+        assert ydl is borrowed
+        assert 'format' not in ydl.params
+        assert ydl.params['outtmpl']['default'] != '/tmp/%(id)s.%(ext)s'
+    assert pool.stats()['reused'] == 1
+    pool.close()
+
+
+def test_missing_internals_disable_reuse():
+    pool = YoutubeDLPool({'quiet': True}, 1, factory=_NoResetYoutubeDL)
+    with pool.checkout(format='worst') as ydl:
+        first = ydl
+        assert ydl.params['format'] == 'worst'
+    with pool.checkout() as ydl:
+        assert ydl is not first
+        assert 'format' not in ydl.params
+    stats = pool.stats()
+    assert not stats['reusable'] and stats['idle'] == 0 and stats['reused'] == 0
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Parallel multi-connection upload engine
+Uploads file parts concurrently over several MTProto sender connections to
+the account's own DC and returns an InputFile/InputFileBig that
+client.send_file accepts in place of a path. Files that are still being
+downloaded can be streamed: parts are sent as soon as they are on disk.
+"""
+
+import os
+import math
+import asyncio
+import inspect
+import logging
+from typing import Callable, Optional
+from telethon import TelegramClient, helpers, utils
+from telethon.errors import FloodWaitError
+from telethon.network import MTProtoSender
+from telethon.tl.functions.upload import SaveBigFilePartRequest
+from telethon.tl.types import InputFileBig
+from config import UPLOAD_CONNECTIONS, MAX_FILE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Telegram treats files above 10MB as "big" (SaveBigFilePart, no MD5)
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+# One extra connection per this many bytes, up to UPLOAD_CONNECTIONS
+BYTES_PER_CONNECTION = 64 * 1024 * 1024
+PART_RETRIES = 5
+# How often a growing file is checked for new complete parts
+STREAM_POLL_INTERVAL = 0.2
+
+
+class _StreamUpload:
+    """Upload of a file that is still being written"""
+    __slots__ = ('path', 'task', 'complete', 'final_size', 'progress_callback')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.task = None
+        self.complete = asyncio.Event()
+        self.final_size = 0
+        self.progress_callback = None
+
+
+class ParallelUploader:
+    """Upload large files with several concurrent connections"""
+
+    def __init__(self, client: TelegramClient, max_connections: int = UPLOAD_CONNECTIONS):
+        self.client = client
+        self.max_connections = max(1, max_connections)
+        self._streams = {}  # path -> _StreamUpload
+
+    def plan(self, file_size: int) -> tuple:
+        """Pick (part_size, part_count, connections) for a file size"""
+        part_size = utils.get_appropriated_part_size(file_size) * 1024
+        part_count = max(1, math.ceil(file_size / part_size))
+        connections = min(self.max_connections, part_count, 1 + file_size // BYTES_PER_CONNECTION)
+        return part_size, part_count, max(1, connections)
+
+    async def upload(self, file_path: str, progress_callback: Optional[Callable] = None):
+        """Upload file_path and return an input file usable with send_file.
+
+        progress_callback(uploaded, total) may be a coroutine function; an
+        exception it raises (e.g. CancelledError) aborts the upload.
+        """
+        stream = self._streams.pop(file_path, None)
+        if stream is not None:
+            result = await self._finish_stream(stream, progress_callback)
+            if result is not None:
+                return result
+
+        file_size = os.path.getsize(file_path)
+        if file_size <= BIG_FILE_THRESHOLD:
+            # Small files need an MD5 and gain nothing from parallelism
+            return await self.client.upload_file(file_path, progress_callback=progress_callback)
+
+        part_size, part_count, connections = self.plan(file_size)
+        logger.info(f"Uploading {file_path}: {part_count} parts of {part_size // 1024}KB over {connections} connections")
+
+        senders = await self._create_senders(connections)
+        try:
+            file_id = helpers.generate_random_long()
+            await self._upload_parts(senders, file_path, file_id, file_size, part_size, part_count, progress_callback)
+        finally:
+            await asyncio.gather(*(sender.disconnect() for sender in senders), return_exceptions=True)
+
+        return InputFileBig(id=file_id, parts=part_count, name=os.path.basename(file_path))
+
+    def start_stream(self, file_path: str, expected_size: int = 0):
+        """Start uploading a file while it is being downloaded.
+
+        A later upload(file_path) returns the streamed result once the file is
+        complete, or falls back to a normal upload if streaming failed.
+        """
+        if file_path in self._streams:
+            return
+        stream = _StreamUpload(file_path)
+        stream.task = asyncio.ensure_future(self._stream_parts(stream, expected_size))
+        # Failures are reported by upload(); don't log them as unretrieved
+        stream.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self._streams[file_path] = stream
+
+    def abort_stream(self, file_path: str):
+        """Drop a streamed upload whose download failed or was cancelled"""
+        stream = self._streams.pop(file_path, None)
+        if stream is not None:
+            stream.task.cancel()
+            logger.info(f"Aborted streamed upload of {file_path}")
+
+    async def _finish_stream(self, stream: _StreamUpload, progress_callback: Optional[Callable]):
+        """Mark a streamed file complete and wait for its last parts"""
+        if not os.path.exists(stream.path):
+            stream.task.cancel()
+            return None
+        stream.final_size = os.path.getsize(stream.path)
+        stream.progress_callback = progress_callback
+        stream.complete.set()
+        try:
+            return await stream.task
+        except asyncio.CancelledError:
+            stream.task.cancel()
+            raise
+        except Exception as e:
+            logger.warning(f"Streamed upload of {stream.path} failed, uploading again: {e}")
+            return None
+
+    async def _stream_parts(self, stream: _StreamUpload, expected_size: int):
+        """Send parts of a growing file as they become complete.
+
+        Until the download finishes the total part count is unknown and parts
+        are sent with file_total_parts=-1; the last part is always held back
+        so that it goes out with the real count.
+        """
+        size_hint = min(max(expected_size or 0, BIG_FILE_THRESHOLD + 1), MAX_FILE_SIZE)
+        _, _, connections = self.plan(size_hint)
+        # The size is only an estimate, so use the part size valid up to the maximum file size
+        part_size = utils.get_appropriated_part_size(MAX_FILE_SIZE) * 1024
+        senders = await self._create_senders(connections)
+        file_id = helpers.generate_random_long()
+        parts = asyncio.Queue()
+        uploaded = 0
+        loop = asyncio.get_running_loop()
+
+        try:
+            while not os.path.exists(stream.path):
+                if stream.complete.is_set():
+                    return None
+                await asyncio.sleep(STREAM_POLL_INTERVAL)
+
+            with open(stream.path, 'rb') as f:
+                async def worker(sender):
+                    nonlocal uploaded
+                    while True:
+                        index = await parts.get()
+                        if index is None:
+                            return
+                        data = await loop.run_in_executor(None, os.pread, f.fileno(), part_size, index * part_size)
+                        total_parts = math.ceil(stream.final_size / part_size) if stream.complete.is_set() else -1
+                        await self._send_part(sender, SaveBigFilePartRequest(file_id, index, total_parts, data))
+                        uploaded += len(data)
+                        if stream.progress_callback:
+                            result = stream.progress_callback(uploaded, stream.final_size or size_hint)
+                            if inspect.isawaitable(result):
+                                await result
+
+                workers = [asyncio.ensure_future(worker(sender)) for sender in senders]
+                completed = asyncio.ensure_future(stream.complete.wait())
+                try:
+                    queued = 0
+                    while not stream.complete.is_set():
+                        if not os.path.exists(stream.path):
+                            raise FileNotFoundError(f"{stream.path} was removed before the upload finished")
+                        # Hold back the last complete part until the size is final
+                        ready = os.fstat(f.fileno()).st_size // part_size - 1
+                        while queued < ready:
+                            parts.put_nowait(queued)
+                            queued += 1
+                        await asyncio.wait([completed, *workers],
+                                           timeout=STREAM_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+                        for task in workers:
+                            if task.done():
+                                task.result()  # Surface a failed part
+
+                    if stream.final_size <= BIG_FILE_THRESHOLD:
+                        return None  # Small files must be sent with SaveFilePart
+                    part_count = math.ceil(stream.final_size / part_size)
+                    while queued < part_count:
+                        parts.put_nowait(queued)
+                        queued += 1
+                    for _ in workers:
+                        parts.put_nowait(None)
+                    await asyncio.gather(*workers)
+                finally:
+                    completed.cancel()
+                    for task in workers:
+                        task.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            await asyncio.gather(*(sender.disconnect() for sender in senders), return_exceptions=True)
+            if self._streams.get(stream.path) is stream:
+                del self._streams[stream.path]
+
+        logger.info(f"Streamed upload of {stream.path} finished: {part_count} parts of {part_size // 1024}KB")
+        return InputFileBig(id=file_id, parts=part_count, name=os.path.basename(stream.path))
+
+    async def _create_senders(self, count: int) -> list:
+        """Open extra connections to our own DC, reusing the session auth key"""
+        dc = await self.client._get_dc(self.client.session.dc_id)
+
+        async def connect():
+            sender = MTProtoSender(self.client.session.auth_key, loggers=self.client._log)
+            await sender.connect(self.client._connection(
+                dc.ip_address, dc.port, dc.id,
+                loggers=self.client._log,
+                proxy=self.client._proxy
+            ))
+            return sender
+
+        results = await asyncio.gather(*(connect() for _ in range(count)), return_exceptions=True)
+        senders = [r for r in results if isinstance(r, MTProtoSender)]
+        for r in results:
+            if isinstance(r, BaseException):
+                logger.warning(f"Could not open upload connection: {r}")
+        if not senders:
+            raise ConnectionError("No upload connection could be opened")
+        return senders
+
+    async def _upload_parts(self, senders: list, file_path: str, file_id: int, file_size: int,
+                            part_size: int, part_count: int, progress_callback: Optional[Callable]):
+        """Have one worker per sender pull part indexes from a shared queue"""
+        parts = asyncio.Queue()
+        for index in range(part_count):
+            parts.put_nowait(index)
+        uploaded = 0
+        loop = asyncio.get_running_loop()
+
+        with open(file_path, 'rb') as f:
+            def read_part(index: int) -> bytes:
+                return os.pread(f.fileno(), part_size, index * part_size)
+
+            async def worker(sender):
+                nonlocal uploaded
+                while True:
+                    try:
+                        index = parts.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    data = await loop.run_in_executor(None, read_part, index)
+                    request = SaveBigFilePartRequest(file_id, index, part_count, data)
+                    await self._send_part(sender, request)
+                    uploaded += len(data)
+                    if progress_callback:
+                        result = progress_callback(uploaded, file_size)
+                        if inspect.isawaitable(result):
+                            await result
+
+            workers = [asyncio.ensure_future(worker(sender)) for sender in senders]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _send_part(self, sender, request):
+        """Send one part, retrying transient failures with backoff"""
+        for attempt in range(1, PART_RETRIES + 1):
+            try:
+                if not await self.client._call(sender, request):
+                    raise RuntimeError(f"Telegram rejected part {request.file_part}")
+                return
+            except FloodWaitError as e:
+                logger.warning(f"FloodWait {e.seconds}s on upload part {request.file_part}")
+                await asyncio.sleep(e.seconds)
+            except (ConnectionError, asyncio.TimeoutError, RuntimeError) as e:
+                if attempt == PART_RETRIES:
+                    raise
+                delay = min(2 ** attempt, 30)
+                logger.warning(f"Upload part {request.file_part} failed ({e}), retry {attempt}/{PART_RETRIES} in {delay}s")
+                await asyncio.sleep(delay)
+        raise RuntimeError(f"Upload part {request.file_part} failed after {PART_RETRIES} attempts")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+URL canonicalization with a short-link resolution cache
+TikTok short links (vt/vm.tiktok.com) are resolved once over a
+pooled HTTP session; results are kept in an LRU cache with a TTL and
+concurrent lookups of the same link share one request.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from config import URL_CACHE_SIZE, URL_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Hosts whose links only redirect to the real video page
+SHORT_LINK_HOSTS = {'vt.tiktok.com', 'vm.tiktok.com'}
+# Query parameters that only carry tracking/share info
+TRACKING_PARAMS = {'fbclid', 'gclid', 'igshid', 'si'}
+TIKTOK_SHARE_PARAMS = {
+    '_r', '_t', 'is_from_webapp', 'sender_device', 'sender_web_id', 'is_copy_url',
+    'share_app_id', 'share_item_id', 'share_link_id', 'social_sharing', 'tt_from',
+    'u_code', 'timestamp', 'user_id', 'web_id',
+}
+RESOLVE_TIMEOUT = 15
+
+
+class UrlCanonicalizer:
+    """Resolve short links and normalize video URLs, with caching"""
+
+    def __init__(self, max_entries: int = URL_CACHE_SIZE, ttl: float = URL_CACHE_TTL):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._cache = OrderedDict()  # url -> (canonical_url, expires_at)
+        self._inflight = {}  # url -> threading.Event of the lookup in progress
+        self._lock = threading.Lock()
+        self._session = None
+        self.hits = 0
+        self.misses = 0
+
+    def canonicalize(self, url: str) -> str:
+        """Canonical form of a URL, resolving short links (blocking, cached).
+
+        Safe to call from several threads; only one request per short link
+        is made at a time. On a resolution failure the normalized input URL
+        is returned and not cached.
+        """
+        key = url.strip()
+        if not self.is_short_link(key):
+            return self.normalize(key)
+
+        while True:
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached and cached[1] > time.monotonic():
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return cached[0]
+                pending = self._inflight.get(key)
+                if pending is None:
+                    pending = self._inflight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another thread is resolving this link; wait for its result
+            pending.wait(RESOLVE_TIMEOUT + 5)
+            with self._lock:
+                if key not in self._cache and key in self._inflight:
+                    return self.normalize(key)  # Owner is stuck; don't pile up
+
+        try:
+            resolved = self._resolve(key)
+            canonical = self.normalize(resolved) if resolved else None
+            if canonical:
+                with self._lock:
+                    self._cache[key] = (canonical, time.monotonic() + self.ttl)
+                    self._cache.move_to_end(key)
+                    while len(self._cache) > self.max_entries:
+                        self._cache.popitem(last=False)
+                logger.info(f"Resolved short link {key} -> {canonical}")
+                return canonical
+            return self.normalize(key)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending.set()
+
+    async def canonicalize_async(self, url: str) -> str:
+        """canonicalize() off the event loop"""
+        if not self.is_short_link(url.strip()):
+            return self.normalize(url.strip())
+        return await asyncio.get_running_loop().run_in_executor(None, self.canonicalize, url)
+
+    @staticmethod
+    def is_short_link(url: str) -> bool:
+        host = (urlsplit(url).hostname or '').lower()
+        return host in SHORT_LINK_HOSTS
+
+    @staticmethod
+    def normalize(url: str) -> str:
+        """Lowercase scheme/host and drop fragments and tracking parameters"""
+        try:
+            parts = urlsplit(url.strip())
+        except ValueError:
+            return url
+        if not parts.scheme or not parts.netloc:
+            return url
+        host = parts.netloc.lower()
+        dropped = TRACKING_PARAMS | TIKTOK_SHARE_PARAMS if host.endswith('tiktok.com') else TRACKING_PARAMS
+        query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                 if k not in dropped and not k.startswith('utm_')]
+        return urlunsplit((parts.scheme.lower(), host, parts.path,
+                           urlencode(query, doseq=True), ''))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._cache), 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _resolve(self, url: str) -> Optional[str]:
+        """Follow redirects of a short link over the pooled session"""
+        try:
+            response = self._get_session().head(url, allow_redirects=True, timeout=RESOLVE_TIMEOUT)
+            response.close()
+            return response.url
+        except Exception as e:
+            logger.warning(f"Could not resolve short link {url}: {e}")
+            return None
+
+    def _get_session(self):
+        # Created lazily so worker processes that never resolve don't pay for it
+        with self._lock:
+            if self._session is not None:
+                return self._session
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=1)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+            return session
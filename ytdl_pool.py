@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Pool of warm, reusable YoutubeDL instances
+Building a YoutubeDL loads extractors, post-processors (which probe ffmpeg),
+cookies and HTTP handlers; a pooled instance does that once and is checked
+out per job with temporary option overrides.
+
+Resetting an instance between jobs touches YoutubeDL internals. If the
+installed yt-dlp lacks any of them, checkout() builds a fresh instance per
+job instead of silently misconfiguring a reused one.
+"""
+
+import time
+import logging
+import threading
+import contextlib
+from typing import Optional
+import yt_dlp
+from yt_dlp.postprocessor import get_postprocessor
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+# YoutubeDL internals _apply()/_restore() rely on
+RESET_METHODS = ('_parse_outtmpl', 'build_format_selector', 'add_post_processor')
+RESET_ATTRIBUTES = ('format_selector', '_progress_hooks', '_pps', '_download_retcode', '_num_downloads')
+# Checked once at import; instance attributes are checked on the first instance built
+RESET_SUPPORTED = all(callable(getattr(yt_dlp.YoutubeDL, name, None)) for name in RESET_METHODS)
+if not RESET_SUPPORTED:
+    logger.warning(f"yt-dlp {yt_dlp.version.__version__} lacks the YoutubeDL internals the pool resets; "
+                   f"YoutubeDL instances will not be reused")
+
+
+class YoutubeDLPool:
+    """Reusable YoutubeDL instances sharing one set of base options"""
+
+    def __init__(self, base_opts: dict, size: int = 1, name: str = 'ytdl', factory=yt_dlp.YoutubeDL):
+        self.base_opts = base_opts
+        self.factory = factory
+        self.size = max(1, size)
+        self.name = name
+        self._idle = []
+        self._lock = threading.Lock()
+        self.reusable = RESET_SUPPORTED  # Cleared if an instance lacks the attributes reset between jobs
+        self.created = 0
+        self.reused = 0
+        self.setup_time = 0.0
+
+    def warm(self, count: Optional[int] = None):
+        """Create idle instances ahead of the first job"""
+        if not self.reusable:
+            return
+        count = min(self.size, count or self.size)
+        with self._lock:
+            missing = count - len(self._idle)
+        for _ in range(max(0, missing)):
+            self._release(self._create())
+        logger.info(f"Warmed {self.name} pool with {count} YoutubeDL instances")
+
+    @contextlib.contextmanager
+    def checkout(self, **overrides):
+        """Borrow an instance with per-job option overrides.
+
+        Supports plain params plus 'outtmpl', 'format', 'progress_hooks'
+        and 'postprocessors', which YoutubeDL only reads at construction.
+        The instance is restored to the base options when returned. Without
+        reset support the job gets its own instance, closed afterwards.
+        """
+        ydl = self._take() if self.reusable else None
+        if not self.reusable:
+            # Possibly just found out on the instance _take() built
+            if ydl is not None:
+                ydl.close()
+            ydl = self._create(overrides)
+            try:
+                yield ydl
+            finally:
+                ydl.close()
+            return
+        saved = self._apply(ydl, overrides)
+        try:
+            yield ydl
+        finally:
+            try:
+                self._restore(ydl, saved)
+                self._release(ydl)
+            except Exception as e:
+                logger.warning(f"Discarding YoutubeDL instance that could not be reset: {e}")
+                ydl.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = len(self._idle)
+        return {'idle': idle, 'reusable': self.reusable, 'created': self.created, 'reused': self.reused,
+                'avg_setup': self.setup_time / self.created if self.created else 0.0}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ydl in idle:
+            ydl.close()
+
+    def _create(self, overrides: Optional[dict] = None):
+        started = time.perf_counter()
+        ydl = self.factory(dict(self.base_opts, **(overrides or {})))
+        with self._lock:
+            self.created += 1
+            self.setup_time += time.perf_counter() - started
+        if self.reusable and not all(hasattr(ydl, name) for name in RESET_ATTRIBUTES):
+            missing = [name for name in RESET_ATTRIBUTES if not hasattr(ydl, name)]
+            logger.warning(f"YoutubeDL has no {', '.join(missing)}; {self.name} pool will not reuse instances")
+            self.reusable = False
+        return ydl
+
+    def _take(self):
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+        return self._create()
+
+    def _release(self, ydl):
+        with self._lock:
+            if self.reusable and len(self._idle) < self.size:
+                self._idle.append(ydl)
+                return
+        ydl.close()
+
+    def _apply(self, ydl, overrides: dict) -> dict:
+        """Apply overrides and return what is needed to undo them"""
+        saved = {
+            'params': {key: ydl.params.get(key, _MISSING) for key in overrides},
+            'format_selector': ydl.format_selector,
+            'progress_hooks': list(ydl._progress_hooks),
+            'pps': {when: list(pps) for when, pps in ydl._pps.items()},
+        }
+        for key, value in overrides.items():
+            if key == 'outtmpl':
+                value = dict(value) if isinstance(value, dict) else {'default': value}
+            ydl.params[key] = value
+            if key == 'outtmpl':
+                ydl._parse_outtmpl()
+            elif key == 'format':
+                ydl.format_selector = value if value in (None, '-') or callable(value) else ydl.build_format_selector(value)
+            elif key == 'progress_hooks':
+                ydl._progress_hooks = list(value or [])
+            elif key == 'postprocessors':
+                ydl._pps = {when: [] for when in ydl._pps}
+                for pp_def_raw in value or []:
+                    pp_def = dict(pp_def_raw)
+                    when = pp_def.pop('when', 'post_process')
+                    ydl.add_post_processor(get_postprocessor(pp_def.pop('key'))(ydl, **pp_def), when=when)
+        return saved
+
+    @staticmethod
+    def _restore(ydl, saved: dict):
+        for key, value in saved['params'].items():
+            if value is _MISSING:
+                ydl.params.pop(key, None)
+            else:
+                ydl.params[key] = value
+        if 'outtmpl' in saved['params']:
+            ydl._parse_outtmpl()
+        ydl.format_selector = saved['format_selector']
+        ydl._progress_hooks = saved['progress_hooks']
+        ydl._pps = saved['pps']
+        # Per-run counters that would otherwise leak into the next job
+        ydl._download_retcode = 0
+        ydl._num_downloads = 0
+